@@ -1,16 +1,235 @@
+import os
+import sys
 import time
+import math
+import argparse
+import json
+import io
+import heapq
+import collections
+import itertools
+import functools
+import bisect
 import shutil
-import msvcrt
 import random
+import atexit
+import selectors
+import signal
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import msvcrt
+except ImportError:  # Not on Windows: keys come from termios instead
+    msvcrt = None
+try:
+    import termios
+    import tty
+except ImportError:  # Windows
+    termios = tty = None
 
 # --- Game Constants ---
 WIDTH = 60
 HEIGHT = 17  # Increased by 1 for even bottom boxes
 PLAYER_START_X = WIDTH * 1 // 4  # Player starts at 1/4th of the width, mirroring enemy at 3/4th
+# Balance: enemy regen timers run at a tenth of battle speed. That is the old
+# regen pass's effective rate for one regenerating enemy: it only ran on the two
+# 0.05 s ticks a second where int(clock * 10) % 10 == 0. The old pass also moved
+# every enemy's timer once per regenerating enemy, so groups of regenerating
+# enemies healed faster together; that scaling is dropped on purpose.
+ENEMY_REGEN_SPEED = 0.1
+
+# --- Clocks ---
+class RealClock:
+    """Wall clock used for interactive play."""
+    def now(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+class VirtualClock:
+    """Simulated clock for headless runs: sleeping only moves time forward."""
+    def __init__(self):
+        self.time = 0.0
+
+    def now(self):
+        return self.time
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.time += seconds
+
+# --- Frame Pacing ---
+class FramePacer:
+    """
+    Decides when to draw, at a target frame rate that doesn't depend on the
+    simulation. Frames sit on a fixed 1/fps grid; when the game can't keep up,
+    the missed frames are dropped instead of being drawn late.
+    """
+    def __init__(self, clock, fps=30):
+        self.clock = clock
+        self.interval = 1.0 / fps
+        self.next_frame = clock.now()
+        self.frames = 0
+        self.dropped = 0
+
+    def frame_due(self, now):
+        return now >= self.next_frame
+
+    def drew(self, now):
+        """A frame was drawn; book the next one, skipping any slots it overran."""
+        self.frames += 1
+        missed = int((now - self.next_frame) / self.interval)
+        self.dropped += missed
+        self.next_frame += (missed + 1) * self.interval
+
+    def drop(self, now):
+        """Skip every frame slot up to now."""
+        missed = int((now - self.next_frame) / self.interval) + 1
+        self.dropped += missed
+        self.next_frame += missed * self.interval
+
+# --- Instrumentation Hooks ---
+class Probe:
+    """
+    Hook points for watching a running game. The battle, renderer, animations,
+    timeline and announcements call these on their `probe` attribute; with no
+    probe set (the default) they skip the calls, so an unwatched game runs as is.
+    Spans nest: each enter() is closed by a leave() with the same name and
+    category. Category "phase" marks the parts of a battle tick and the battle's
+    frames; "battle" the ticks; "render", "animation" everything else timed.
+    The hooks here do nothing, so subclasses override only what they need.
+    """
+    def enter(self, name, cat):
+        """A span starts."""
+
+    def leave(self, name, cat, args=None):
+        """The span entered last ends; `args` describe it."""
+
+    def battle_started(self, battle, state):
+        """Battle.start has set up `state`."""
+
+    def battle_finished(self, battle, state, result):
+        """The battle is over; `result` is None if the game left it midway."""
+
+    def attacked(self, attacker, defender, records):
+        """Battle.attack resolved an attack into these BattleLog records."""
+
+    def skill_cast(self, skill):
+        """A player skill went off in battle."""
+
+    def summoned(self, count):
+        """`count` enemies joined the fight."""
+
+    def effect(self, track):
+        """An AnimationTrack started on the timeline."""
+
+    def level_up(self, player):
+        """The level-up screen is about to open."""
+
+    def enter_room(self, room_number):
+        """The game entered a room."""
+
+class ProbeGroup(Probe):
+    """Passes every hook on to several probes, in order."""
+    def __init__(self, probes):
+        self.probes = list(probes)
+
+    def enter(self, name, cat):
+        for probe in self.probes:
+            probe.enter(name, cat)
+
+    def leave(self, name, cat, args=None):
+        for probe in reversed(self.probes):  # Unwind in the opposite order
+            probe.leave(name, cat, args)
+
+    def battle_started(self, battle, state):
+        for probe in self.probes:
+            probe.battle_started(battle, state)
+
+    def battle_finished(self, battle, state, result):
+        for probe in self.probes:
+            probe.battle_finished(battle, state, result)
+
+    def attacked(self, attacker, defender, records):
+        for probe in self.probes:
+            probe.attacked(attacker, defender, records)
+
+    def skill_cast(self, skill):
+        for probe in self.probes:
+            probe.skill_cast(skill)
+
+    def summoned(self, count):
+        for probe in self.probes:
+            probe.summoned(count)
+
+    def effect(self, track):
+        for probe in self.probes:
+            probe.effect(track)
+
+    def level_up(self, player):
+        for probe in self.probes:
+            probe.level_up(player)
+
+    def enter_room(self, room_number):
+        for probe in self.probes:
+            probe.enter_room(room_number)
+
+def combine_probes(*probes):
+    """One probe for all the given ones that aren't None (None if there are none)."""
+    probes = [probe for probe in probes if probe is not None]
+    if len(probes) > 1:
+        return ProbeGroup(probes)
+    return probes[0] if probes else None
+
+def probed(cat, name=None):
+    """Report each call of the decorated method to `self.probe` as a span (named after the method by default)."""
+    def decorate(method):
+        span = name or method.__qualname__
+
+        @functools.wraps(method)
+        def probed_method(self, *args, **kwargs):
+            probe = self.probe
+            if probe is None:
+                return method(self, *args, **kwargs)
+            probe.enter(span, cat)
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                probe.leave(span, cat)
+        return probed_method
+    return decorate
+
+# --- Random Streams ---
+class RandomStreams:
+    """
+    One seeded random.Random per subsystem, all derived from a single run seed.
+    Keeping the streams apart means extra rolls in one subsystem (say, a new
+    combat skill) don't shift the enemies or loot of the rest of the run.
+    """
+    SUBSYSTEMS = ["combat", "spawning", "loot", "events", "level_up"]
+
+    def __init__(self, seed=None):
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """Reseed every stream from `seed` (a fresh random seed if None) and return it."""
+        if seed is None:
+            seed = random.SystemRandom().randrange(2**32)
+        self.run_seed = seed
+        for name in self.SUBSYSTEMS:
+            setattr(self, name, random.Random(f"{seed}:{name}"))
+        return seed
+
+rng = RandomStreams()
 
 class Skill:
     """Base class for all skills."""
     char = '?'
+    # What use() gets in battle: "self" (just the player), "enemy" (one random
+    # living enemy) or "enemies" (all living enemies). None = passive, never used.
+    target = None
+    requires_target = False  # Only fire while an enemy is alive
     def __init__(self, name, description, cooldown):
         self.name = name
         self.description = description
@@ -23,6 +242,7 @@ class Skill:
 
 class BigSlashSkill(Skill):
     char = 'S'
+    target = "enemies"
     def __init__(self):
         super().__init__("Big Slash", "Deal double damage to all enemies.", cooldown=8.0)
 
@@ -39,6 +259,8 @@ class BigSlashSkill(Skill):
 
 class DoubleAttackSkill(Skill):
     char = 'D'
+    target = "enemy"
+    requires_target = True
     def __init__(self):
         super().__init__("Double Attack", "Attack twice with bonus crit chance.", cooldown=6.0)
 
@@ -50,7 +272,7 @@ class DoubleAttackSkill(Skill):
             for _ in range(2):
                 damage = max(1, player.attack - enemy.defence)
                 crit = False
-                if random.random() < player.crit_chance:
+                if rng.combat.random() < player.crit_chance:
                     damage = int(damage * player.crit_damage)
                     crit = True
                 enemy.hp -= damage
@@ -62,6 +284,7 @@ class DoubleAttackSkill(Skill):
 
 class BlessingLightSkill(Skill):
     char = 'L'
+    target = "self"
     def __init__(self):
         super().__init__("Blessing Light", "Heal 10% of max HP.", cooldown=12.0)
 
@@ -75,6 +298,7 @@ class BlessingLightSkill(Skill):
     
 class ThornBurstSkill(Skill):
     char = 'T'
+    target = "enemies"
     def __init__(self):
         super().__init__("Thorn Burst", "Deal your thorn damage to all enemies.", cooldown=7.0)
     def use(self, player, enemies):
@@ -85,6 +309,8 @@ class ThornBurstSkill(Skill):
 
 class LuckyStrikeSkill(Skill):
     char = '$'
+    target = "enemy"
+    requires_target = True
     def __init__(self):
         super().__init__("Lucky Strike", "Deal bonus damage equal to your luck.", cooldown=6.0)
     def use(self, player, enemy):
@@ -95,6 +321,7 @@ class LuckyStrikeSkill(Skill):
 
 class RegenWaveSkill(Skill):
     char = 'R'
+    target = "self"
     def __init__(self):
         super().__init__("Regen Wave", "Heal for 2x your regen.", cooldown=8.0)
     def use(self, player):
@@ -105,6 +332,7 @@ class RegenWaveSkill(Skill):
 
 class CritShieldSkill(Skill):
     char = '#'
+    target = "self"
     def __init__(self):
         super().__init__("Shield Wall", "Shield: 3x your defence for 3s.", cooldown=10.0)
     def use(self, player):
@@ -118,6 +346,8 @@ class CritShieldSkill(Skill):
 
 class LifestealNovaSkill(Skill):
     char = 'N'
+    target = "enemies"
+    requires_target = True
     def __init__(self):
         super().__init__("Lifesteal Nova", "Hit all enemies, heal for total dealt.", cooldown=9.0)
     def use(self, player, enemies):
@@ -143,6 +373,7 @@ class CounterDodgeSkill(Skill):
 
 class GoldRushSkill(Skill):
     char = 'G'
+    target = "self"
     def __init__(self):
         super().__init__("Gold Rush", "Gain 2 gold every 8s.", cooldown=8.0)
     def use(self, player):
@@ -152,6 +383,8 @@ class GoldRushSkill(Skill):
 
 class GuaranteedCritSkill(Skill):
     char = '!'
+    target = "enemy"
+    requires_target = True
     def __init__(self):
         super().__init__("Sure Crit", "Next attack is a guaranteed crit.", cooldown=7.0)
     def use(self, player, enemy):
@@ -162,6 +395,7 @@ class GuaranteedCritSkill(Skill):
 
 class AdrenalineRushSkill(Skill):
     char = 'A'
+    target = "self"
     def __init__(self):
         super().__init__("Adrenaline Rush", "+50% attack speed for 3s.", cooldown=10.0)
     def use(self, player):
@@ -176,6 +410,7 @@ class AdrenalineRushSkill(Skill):
 
 class JackpotSkill(Skill):
     char = 'J'
+    target = "self"
     def __init__(self):
         super().__init__("Jackpot", "Gain gold equal to your luck.", cooldown=10.0)
     def use(self, player):
@@ -186,6 +421,7 @@ class JackpotSkill(Skill):
 
 class GambleSkill(Skill):
     char = '?'
+    target = "self"
     def __init__(self):
         super().__init__("Gamble", "", cooldown=7.0)  # Leave description blank
 
@@ -198,7 +434,7 @@ class GambleSkill(Skill):
         win_chance = min(0.5 + 0.03 * player.luck, 0.8)
         lose_chance = 1.0 - win_chance
         self.description = self.get_description(player)
-        if random.random() < win_chance:
+        if rng.combat.random() < win_chance:
             player.gold += 10
             result = "win 10 gold!"
         else:
@@ -209,6 +445,7 @@ class GambleSkill(Skill):
 
 class GlassCannonSkill(Skill):
     char = 'g'
+    target = "self"
     def __init__(self):
         super().__init__("Glass Cannon", "+3 atk, -10 max HP (permanent).", cooldown=0.0)
     def use(self, player):
@@ -223,10 +460,12 @@ class GlassCannonSkill(Skill):
 
 class ClumsySwingSkill(Skill):
     char = 'Z'
+    target = "enemy"
+    requires_target = True
     def __init__(self):
         super().__init__("Clumsy Swing", "2x dmg, 30% chance to miss.", cooldown=8.0)
     def use(self, player, enemy):
-        if random.random() < 0.7:
+        if rng.combat.random() < 0.7:
             self.cooldown_timer = 0.0
             return "CLUMSY SWING! You miss!"
         damage = int(max(1, player.attack * 2 - enemy.defence))
@@ -236,6 +475,7 @@ class ClumsySwingSkill(Skill):
 
 class UnstablePowerSkill(Skill):
     char = 'U'
+    target = "self"
     def __init__(self):
         super().__init__("Unstable Power", "2x atk (1 turn), then 0.5x atk (2 turns).", cooldown=10.0)
     def use(self, player):
@@ -249,6 +489,7 @@ class UnstablePowerSkill(Skill):
 
 class InvincibleSkill(Skill):
     char = 'I'
+    target = "self"
     def __init__(self):
         super().__init__("Invincible", "No damage taken for 2s.", cooldown=12.0)
     def use(self, player):
@@ -327,12 +568,12 @@ class BloodPactSkill(Skill):
     
 class BlindingFlashSkill(Skill):
     char = 'B'
+    target = "enemies"
+    requires_target = True
     def __init__(self):
         super().__init__("Blinding Flash", "All enemies skip their next attack.", cooldown=10.0)
     def use(self, player, enemies):
         for enemy in enemies:
-            if not hasattr(enemy, "skip_turns"):
-                enemy.skip_turns = 0
             enemy.skip_turns += 1
         self.cooldown_timer = 0.0
         return "BLINDING FLASH! All enemies are stunned for 1 turn!"
@@ -344,7 +585,7 @@ class ScholarSkill(Skill):
     def use(self, player):
         if "ScholarSkill" in player.permanent_skills_used:
             return None
-        player.xp_gain_multiplier = getattr(player, "xp_gain_multiplier", 1.0) * 1.3
+        player.xp_gain_multiplier *= 1.3
         player.permanent_skills_used.add("ScholarSkill")
         self.cooldown_timer = 0.0
         return "SCHOLAR! +30% XP gain!"
@@ -390,7 +631,7 @@ class TreasureHunterSkill(Skill):
     def use(self, player):
         if "TreasureHunterSkill" in player.permanent_skills_used:
             return None
-        player.loot_chance_bonus = getattr(player, "loot_chance_bonus", 0.0) + 0.15
+        player.loot_chance_bonus += 0.15
         player.permanent_skills_used.add("TreasureHunterSkill")
         return "TREASURE HUNTER! +15% loot chance!"
 
@@ -406,6 +647,8 @@ class HealingDodgeSkill(Skill):
 
 class HemorrhageSkill(Skill):
     char = 'H'
+    target = "enemy"
+    requires_target = True
     def __init__(self):
         super().__init__("Hemorrhage", "Trigger all stored bleed at once on an enemy.", cooldown=7.0)
 
@@ -422,6 +665,7 @@ class HemorrhageSkill(Skill):
 
 class BloodlustSkill(Skill):
     char = 'B'
+    target = "self"
     def __init__(self):
         super().__init__("Bloodlust", "For 5s, heal 1 HP each time you inflict bleed.", cooldown=10.0)
 
@@ -461,10 +705,146 @@ SKILL_POOL = [
     HemorrhageSkill,
     BloodlustSkill,
 ]  
+
+# How Battle calls Skill.use for each targeting mode
+SKILL_TARGETING = {
+    "self": lambda skill, player, enemies: skill.use(player),
+    "enemy": lambda skill, player, enemies: skill.use(player, rng.combat.choice(enemies)),
+    "enemies": lambda skill, player, enemies: skill.use(player, enemies),
+}
     
 # --- Entity Classes ---
+# --- Stat Sheet ---
+# How much one level of upgrade_stat (or one equipment level) adds
+STAT_STEPS = {
+    "attack": 1.2, "attack_speed": 0.12, "crit_chance": 0.05, "crit_damage": 0.2,
+    "defence": 1, "health_regen": 2, "thorn_damage": 1, "lifesteal": 0.05,
+    "dodge_chance": 0.05, "max_hp": 6, "luck": 1, "bleed": 1,
+}
+# (floor, cap) the layered value is kept within (None = unbounded)
+STAT_LIMITS = {
+    "attack": (1, None), "attack_speed": (0.1, None), "crit_chance": (0.0, 1.0),
+    "crit_damage": (1.0, None), "defence": (0, None), "health_regen": (0, None),
+    "thorn_damage": (0, None), "lifesteal": (0.0, 1.0), "dodge_chance": (0.0, 0.7),
+    "max_hp": (1, None), "luck": (0, 10), "bleed": (0, None),
+}
+
+class StatSheet:
+    """
+    Layered player stats: (base + levels + gear) * (1 + gear percent), kept
+    within STAT_LIMITS, plus whatever was changed directly (skills, potions)
+    and the boosts that last one battle (stat potions). The total of each stat
+    is stored on the owner's attribute, so reading a stat is a plain attribute
+    read; a total is only recomputed when one of its layers changes. Gear
+    layers are summed from the equipped items each time (math.fsum, so the
+    order items went on doesn't matter), which makes equip/unequip exact
+    inverses.
+    """
+    __slots__ = ('owner', 'base', 'levels', 'adjust', 'boosts', 'cached', 'written', 'gear')
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.base = {stat: getattr(owner, stat) for stat in STAT_STEPS}
+        self.levels = dict.fromkeys(STAT_STEPS, 0)
+        self.adjust = dict.fromkeys(STAT_STEPS, 0)  # Direct changes to the total
+        self.boosts = {}  # stat -> (amount added until clear_boosts(), adjust layer when it went on)
+        self.cached = dict(self.base)   # Last value from the layers
+        self.written = dict(self.base)  # Last total written to the owner
+        self.gear = {}  # id(item) -> equipped item
+
+    def layered(self, stat):
+        """The stat's value from its layers alone (no direct changes)."""
+        items = self.gear.values()
+        parts = [self.base[stat], self.levels[stat]] + [item.level * STAT_STEPS[stat] for item in items if item.stat == stat]
+        value = math.fsum(parts)
+        if all(type(part) is int for part in parts):
+            value = int(value)
+        percent = math.fsum(item.bonus_stats[stat] for item in items if stat in item.bonus_stats)
+        if percent:
+            value *= 1 + percent
+        floor, cap = STAT_LIMITS[stat]
+        value = max(floor, value)
+        return value if cap is None else min(cap, value)
+
+    def recompute(self, stats):
+        """Write fresh totals for the `stats` whose layers changed, keeping any direct changes made since."""
+        owner = self.owner
+        for stat in stats:
+            value = self.layered(stat)
+            previous = self.cached[stat]
+            if value == previous:
+                continue
+            self.keep_direct_changes(stat)
+            self.cached[stat] = value
+            total = self.write(stat)
+            if stat == "max_hp":
+                # Gaining max HP heals by as much; losing it only caps HP
+                if value > previous:
+                    owner.hp += value - previous
+                else:
+                    owner.hp = min(owner.hp, total)
+
+    def keep_direct_changes(self, stat):
+        """Move whatever changed the owner's attribute since the last write into the adjust layer."""
+        current = getattr(self.owner, stat)
+        if current != self.written[stat]:
+            self.adjust[stat] += current - self.written[stat]
+
+    def write(self, stat):
+        """Store the stat's total on the owner and return it."""
+        total = self.cached[stat] + self.adjust[stat] if self.adjust[stat] else self.cached[stat]
+        if stat in self.boosts:
+            total += self.boosts[stat][0]
+        self.written[stat] = total
+        setattr(self.owner, stat, total)
+        return total
+
+    def boost(self, stat, amount):
+        """Add `amount` to the stat until clear_boosts()."""
+        self.keep_direct_changes(stat)
+        added, adjust = self.boosts.get(stat, (0, self.adjust[stat]))
+        self.boosts[stat] = (added + amount, adjust)
+        self.write(stat)
+
+    def clear_boosts(self):
+        """
+        Take every boost off and return the stats that had one. Direct changes
+        made to a boosted stat while it was on go with it, like the boost they
+        were made on top of; level-ups and gear changed since stay.
+        """
+        stats = list(self.boosts)
+        for stat in stats:
+            self.adjust[stat] = self.boosts.pop(stat)[1]
+            total = self.write(stat)
+            if stat == "max_hp":
+                self.owner.hp = min(self.owner.hp, total)
+        return stats
+
+    def add_level(self, stat, levels=1):
+        self.levels[stat] += levels * STAT_STEPS[stat]
+        self.recompute((stat,))
+
+    def equip(self, item):
+        self.gear[id(item)] = item
+        self.recompute(self.item_stats(item))
+
+    def unequip(self, item):
+        if self.gear.pop(id(item), None) is not None:
+            self.recompute(self.item_stats(item))
+
+    @staticmethod
+    def item_stats(item):
+        return [item.stat] + [stat for stat in item.bonus_stats if stat != item.stat]
+
 class Entity:
     """Base class for all entities (player, enemies)."""
+    # Every attribute is declared here or in a subclass: no per-instance dict
+    __slots__ = (
+        'x', 'char', 'attack', 'attack_speed', 'crit_chance', 'crit_damage', 'hp', 'max_hp',
+        'defence', 'health_regen', 'thorn_damage', 'lifesteal', 'dodge_chance', 'luck',
+        'regen_timer', 'skip_turns',
+    )
+
     def __init__(self, x, char):
         self.x = x
         self.char = char
@@ -480,15 +860,24 @@ class Entity:
         self.lifesteal = 0.0
         self.dodge_chance = 0.05
         self.luck = 0  # <--- Add this line
+        self.regen_timer = 0.0  # Seconds toward the next regen
+        self.skip_turns = 0     # Attacks to skip (stuns)
 
 class Player(Entity):
     """Player character."""
+    __slots__ = (
+        'xp', 'level', 'xp_to_next', 'skill_cooldown', 'skill_cooldown_timer', 'potions',
+        'equipment_items', 'lifesteal_pool', 'gold', 'skills', 'timed_effects',
+        'permanent_skills_used', 'boss_xp_bonus', 'bleed', 'bleed_counter',
+        'xp_gain_multiplier', 'loot_chance_bonus', 'stat_boosts', 'equipment',
+        'sheet', 'announcements',
+    )
+
     def __init__(self, x):
         super().__init__(x, '@')
         self.xp = 0
         self.level = 1
         self.xp_to_next = 10  # Start with 10 XP for level 2
-        self.regen_timer = 0.0
         self.skill_cooldown = 10.0  # Default, override in subclasses
         self.skill_cooldown_timer = 0.0
         self.potions = [None, None, None, None]  # 4 potion slots
@@ -502,11 +891,17 @@ class Player(Entity):
         self.boss_xp_bonus = 1.0
         self.bleed = 0
         self.bleed_counter = 0
+        self.xp_gain_multiplier = 1.0  # Scholar
+        self.loot_chance_bonus = 0.0   # Treasure Hunter
+        self.stat_boosts = {}  # stat -> "double" or "+1" for the next battle (stat potions)
+        self.equipment = {}    # stat -> equipped item
+        self.announcements = None
+        self.sheet = StatSheet(self)  # Everything above is the base layer
 
     def gain_xp(self, amount):
         leveled_up = False
-        skill_mult = getattr(self, "xp_gain_multiplier", 1.0)
-        boss_mult = getattr(self, "boss_xp_bonus", 1.0)
+        skill_mult = self.xp_gain_multiplier
+        boss_mult = self.boss_xp_bonus
         self.xp += int(amount * skill_mult * boss_mult)
         while self.xp >= self.xp_to_next:
             self.xp -= self.xp_to_next
@@ -516,31 +911,15 @@ class Player(Entity):
         return leveled_up
 
     def upgrade_stat(self, stat):
-        if stat == "attack":
-            self.attack += 1.2
-        elif stat == "attack_speed":
-            self.attack_speed += 0.12
-        elif stat == "crit_chance":
-            self.crit_chance = min(1.0, self.crit_chance + 0.05)
-        elif stat == "crit_damage":
-            self.crit_damage += 0.2
-        elif stat == "defence":
-            self.defence += 1
-        elif stat == "health_regen":
-            self.health_regen += 2
-        elif stat == "thorn_damage":
-            self.thorn_damage += 1
-        elif stat == "lifesteal":
-            self.lifesteal = min(1.0, self.lifesteal + 0.05)
-        elif stat == "dodge_chance":
-            self.dodge_chance = min(0.7, self.dodge_chance + 0.05)
-        elif stat == "max_hp":
-            self.max_hp += 6
-            self.hp += 6
-        elif stat == "luck":
-            self.luck = min(10, self.luck + 1)
-        elif stat == "bleed":
-            self.bleed += 1
+        self.sheet.add_level(stat)
+
+    def downgrade_stat(self, stat):
+        # Exactly undoes one upgrade_stat
+        self.sheet.add_level(stat, -1)
+
+    def stat_vector(self):
+        """Finished value of every layered stat, e.g. for simulators."""
+        return {stat: getattr(self, stat) for stat in STAT_STEPS}
 
     def reset_regen_timer(self):
         self.regen_timer = 0.0
@@ -555,99 +934,23 @@ class Player(Entity):
         self.skill_cooldown_timer += dt
 
     def equip(self, item):
-        stat_map = {
-            Sword: "attack",
-            Shield: "defence",
-            Armor: "max_hp",
-            Fangs: "lifesteal",
-            Boots: "dodge_chance",
-            Amulet: "crit_chance",
-            Gem: "crit_damage",
-            Thorns: "thorn_damage",
-            Ring: "health_regen",
-            Gloves: "attack_speed",
-            Dagger: "bleed",
-        }
-        for cls, stat in stat_map.items():
-            if isinstance(item, cls):
-                for _ in range(item.level):
-                    self.upgrade_stat(stat)
-                # Apply tier bonus stats
-                if hasattr(item, "bonus_stats"):
-                    if not hasattr(self, "_equipment_bonus_applied"):
-                        self._equipment_bonus_applied = {}
-                    for bonus_stat, bonus in item.bonus_stats.items():
-                        # Save original value if not already saved
-                        if (id(item), bonus_stat) not in self._equipment_bonus_applied:
-                            self._equipment_bonus_applied[(id(item), bonus_stat)] = getattr(self, bonus_stat)
-                        # Apply bonus multiplicatively
-                        setattr(self, bonus_stat, getattr(self, bonus_stat) * (1 + bonus))
-                if not hasattr(self, 'equipment'):
-                    self.equipment = {}
-                self.equipment[stat] = item
-                break
-
-    def downgrade_stat(self, stat):
-        # This should reverse the effect of upgrade_stat
-        if stat == "attack":
-            self.attack = max(1, self.attack - 1)
-        elif stat == "attack_speed":
-            self.attack_speed = max(0.1, self.attack_speed - 0.1)
-        elif stat == "crit_chance":
-            self.crit_chance = max(0.0, self.crit_chance - 0.05)
-        elif stat == "crit_damage":
-            self.crit_damage = max(1.0, self.crit_damage - 0.2)
-        elif stat == "defence":
-            self.defence = max(0, self.defence - 1)
-        elif stat == "health_regen":
-            self.health_regen = max(0, self.health_regen - 1)
-        elif stat == "thorn_damage":
-            self.thorn_damage = max(0, self.thorn_damage - 1)
-        elif stat == "lifesteal":
-            self.lifesteal = max(0.0, self.lifesteal - 0.05)
-        elif stat == "dodge_chance":
-            self.dodge_chance = max(0.0, self.dodge_chance - 0.05)
-            self.dodge_chance = min(self.dodge_chance, 0.7)  # Ensure cap after downgrade
-        elif stat == "max_hp":
-            self.max_hp = max(1, self.max_hp - 5)
-            self.hp = min(self.hp, self.max_hp)
-        elif stat == "luck":
-            self.luck = max(0, self.luck - 1)  # <--- Add this line
-        elif stat == "bleed":
-            self.bleed = max(0, self.bleed - 1)
+        self.sheet.equip(item)
+        self.equipment[item.stat] = item
 
     def unequip(self, item):
-        stat_map = {
-            Sword: "attack",
-            Shield: "defence",
-            Armor: "max_hp",
-            Fangs: "lifesteal",
-            Boots: "dodge_chance",
-            Amulet: "crit_chance",
-            Gem: "crit_damage",
-            Thorns: "thorn_damage",
-            Ring: "health_regen",
-            Gloves: "attack_speed",
-            Dagger: "bleed",
-        }
-        for cls, stat in stat_map.items():
-            if isinstance(item, cls):
-                for _ in range(item.level):
-                    self.downgrade_stat(stat)
-                # Remove tier bonus stats
-                if hasattr(item, "bonus_stats") and hasattr(self, "_equipment_bonus_applied"):
-                    for bonus_stat, bonus in item.bonus_stats.items():
-                        key = (id(item), bonus_stat)
-                        if key in self._equipment_bonus_applied:
-                            # Restore original value
-                            setattr(self, bonus_stat, self._equipment_bonus_applied[key])
-                            del self._equipment_bonus_applied[key]
-                if hasattr(self, 'equipment') and stat in self.equipment:
-                    self.equipment[stat] = None
-                break
+        self.sheet.unequip(item)
+        if self.equipment.get(item.stat) is item:
+            self.equipment[item.stat] = None
+
+    def refresh_equipment(self, item):
+        """Pick up a change to an equipped item (e.g. a forge level up)."""
+        if id(item) in self.sheet.gear:
+            self.sheet.recompute(self.sheet.item_stats(item))
 
 # --- Player Job Classes ---
 class Fighter(Player):
+    __slots__ = ()
+
     def __init__(self, x):
         super().__init__(x)
         self.upgrade_stat("attack")
@@ -659,6 +962,8 @@ class Fighter(Player):
         self.skills = [BigSlashSkill()]
 
 class Assassin(Player):
+    __slots__ = ()
+
     def __init__(self, x):
         super().__init__(x)
         self.upgrade_stat("crit_chance")
@@ -673,6 +978,8 @@ class Assassin(Player):
         self.skills = [DoubleAttackSkill()]
 
 class Paladin(Player):
+    __slots__ = ()
+
     def __init__(self, x):
         super().__init__(x)
         self.upgrade_stat("defence")
@@ -684,87 +991,117 @@ class Paladin(Player):
         self.equip(shield)
         self.skills = [BlessingLightSkill()]
 
+# --- Enemy Templates ---
+# Scaled stats are (base, growth) or (base, growth, bonus) and resolve to
+# base * (1 + growth * (room_number - 1)) * bonus. Anything left out keeps the
+# Entity default.
+ENEMY_TEMPLATES = {
+    'basic': dict(
+        char='E', hp=(8, 0.02), attack=(2, 0.015), attack_speed=(1.0, 0.01),
+        crit_chance=0.1, crit_damage=2.0, defence=0, dodge_chance=(0.05, 0.01),
+    ),
+    'speedy': dict(
+        char='S', hp=(5, 0.07), attack=(1, 0.07), attack_speed=(1.1, 0.01),  # Speed scales more
+        crit_chance=0.1, crit_damage=2.0, defence=0, dodge_chance=(0.12, 0.01),  # Dodge scales more
+    ),
+    'tough': dict(
+        char='O', hp=(13, 0.02, 1.12), attack=(1, 0.015), attack_speed=(0.5, 0.03),  # HP scales more, speed less
+        crit_chance=0.05, crit_damage=2.0, defence_every=8, dodge_chance=(0.02, 0.01),  # +1 defence every 8 rooms
+    ),
+    'brute': dict(
+        char='B', hp=(10, 0.03), attack=(2, 0.04), attack_speed=(0.5, 0.01),  # High damage, slow attack speed
+        crit_chance=0.08, crit_damage=2.0, defence=0, dodge_chance=(0.03, 0.01),
+    ),
+}
+ENEMY_TYPES = list(ENEMY_TEMPLATES)
+
+# How much weaker than a room's main enemy the others are: (hp, attack) multipliers
+ENEMY_ROLES = {
+    'main': None,
+    'extra': (0.6, 0.7),   # Extra enemies in rooms past 10
+    'minion': (0.5, 0.6),  # Final boss summons
+}
+
+@functools.lru_cache(maxsize=4096)
+def enemy_stat_block(enemy_type, room_number=1, difficulty_multiplier=1.0, role='main'):
+    """Resolved stats for an enemy, as a tuple of (attribute, value) pairs. Cached per argument set."""
+    if enemy_type == 'boss':
+        return (('char', '?'),)  # Bosses set their own stats
+    if enemy_type not in ENEMY_TEMPLATES:
+        raise ValueError(f"unknown enemy type {enemy_type!r} (expected one of {', '.join(ENEMY_TYPES)})")
+    template = ENEMY_TEMPLATES[enemy_type]
+    stats = {}
+    for stat, value in template.items():
+        if stat == 'defence_every':
+            stats['defence'] = room_number // value
+        elif isinstance(value, tuple):
+            base, growth, *bonus = value
+            scaled = base * (1 + growth * (room_number - 1))
+            for factor in bonus:
+                scaled *= factor
+            stats[stat] = scaled
+        else:
+            stats[stat] = value
+    stats['hp'] = int(stats['hp'])
+    stats['attack'] = int(stats['attack'])
+    stats['dodge_chance'] = min(stats['dodge_chance'], 0.7)
+    stats['health_regen'] = 0
+    stats['thorn_damage'] = 0
+    stats['lifesteal'] = 0.0
+    if ENEMY_ROLES[role]:
+        hp_mult, attack_mult = ENEMY_ROLES[role]
+        stats['hp'] = max(1, int(stats['hp'] * hp_mult))
+        stats['attack'] = max(1, int(stats['attack'] * attack_mult))
+    stats['hp'] = int(stats['hp'] * difficulty_multiplier)
+    stats['max_hp'] = stats['hp']
+    stats['attack'] = int(stats['attack'] * difficulty_multiplier)
+    stats['defence'] = int(stats['defence'] * difficulty_multiplier)
+    stats['health_regen'] = int(stats['health_regen'] * difficulty_multiplier)
+    return tuple(stats.items())
+
+def difficulty_curve(rooms, difficulty_multiplier=1.0, role='main'):
+    """Stats of every enemy type for rooms 1..`rooms`: {enemy_type: [stats dict per room]}."""
+    return {
+        enemy_type: [dict(enemy_stat_block(enemy_type, room, difficulty_multiplier, role)) for room in range(1, rooms + 1)]
+        for enemy_type in ENEMY_TYPES
+    }
+
 # --- Enemy Classes ---
 class Enemy(Entity):
-    """Enemy character with different types."""
-    def __init__(self, x, enemy_type='basic', room_number=1):
-        # Scaling factors
-        hp_scale = 1 + 0.02 * (room_number - 1)
-        atk_scale = 1 + 0.015 * (room_number - 1)
-        spd_scale = 1 + 0.01 * (room_number - 1)
-        def_scale = 1 + 0.01 * (room_number - 1)
-        dodge_scale = 1 + 0.01 * (room_number - 1)
-
-        if enemy_type == 'basic':
-            char = 'E'
-            super().__init__(x, char)
-            self.dead = False
-            self.hp = int(8 * hp_scale)
-            self.max_hp = self.hp
-            self.attack = int(2 * atk_scale)
-            self.attack_speed = 1.0 * spd_scale
-            self.crit_chance = 0.1
-            self.crit_damage = 2.0
-            self.defence = int(0 * def_scale)
-            self.health_regen = 0
-            self.thorn_damage = 0
-            self.lifesteal = 0.0
-            self.dodge_chance = min(0.05 * dodge_scale, 0.7)
-        elif enemy_type == 'speedy':
-            char = 'S'
-            super().__init__(x, char)
-            self.hp = int(5 * (1 + 0.07 * (room_number - 1)))
-            self.max_hp = self.hp
-            self.attack = int(1 * (1 + 0.07 * (room_number - 1)))
-            self.attack_speed = 1.1 * spd_scale  # Speed scales more
-            self.crit_chance = 0.1
-            self.crit_damage = 2.0
-            self.defence = int(0 * def_scale)
-            self.health_regen = 0
-            self.thorn_damage = 0
-            self.lifesteal = 0.0
-            self.dodge_chance = min(0.12 * dodge_scale, 0.7)  # Dodge scales more
-        elif enemy_type == 'tough':
-            char = 'O'
-            super().__init__(x, char)
-            self.hp = int(13 * hp_scale * 1.12)  # HP scales more
-            self.max_hp = self.hp
-            self.attack = int(1 * atk_scale)
-            self.attack_speed = 0.5 * (1 + 0.03 * (room_number - 1))  # Speed scales less
-            self.crit_chance = 0.05
-            self.crit_damage = 2.0
-            self.defence = int(0 + (room_number // 8))  # Defence increases every 2 rooms
-            self.health_regen = 0
-            self.thorn_damage = 0
-            self.lifesteal = 0.0
-            self.dodge_chance = min(0.02 * dodge_scale, 0.7)
-        elif enemy_type == 'brute':
-            char = 'B'
-            super().__init__(x, char)
-            self.hp = int(10 * (1 + 0.03 * (room_number - 1)))
-            self.max_hp = self.hp
-            self.attack = int(2 * (1 + 0.04 * (room_number - 1)))  # High damage
-            self.attack_speed = 0.5 * (1 + 0.01 * (room_number - 1))  # Slow attack speed
-            self.crit_chance = 0.08
-            self.crit_damage = 2.0
-            self.defence = int(0 * def_scale)
-            self.health_regen = 0
-            self.thorn_damage = 0
-            self.lifesteal = 0.0
-            self.dodge_chance = min(0.03 * dodge_scale, 0.7)
-        else:
-            char = '?'
-            super().__init__(x, char)
+    """Enemy character with different types (see ENEMY_TEMPLATES)."""
+    __slots__ = ('dead',)
+
+    def __init__(self, x, enemy_type='basic', room_number=1, difficulty_multiplier=1.0, role='main'):
+        super().__init__(x, '?')
+        self.dead = False
+        for stat, value in enemy_stat_block(enemy_type, room_number, difficulty_multiplier, role):
+            setattr(self, stat, value)
 
 class BossEnemy(Enemy):
     """Base class for all boss enemies."""
+    __slots__ = ('name', 'skill_cooldown', 'skill_timer')
+
     def __init__(self, x, name="Boss", room_number=1):
         super().__init__(x, enemy_type='boss', room_number=room_number)
         self.name = name
         self.char = 'B'  # Default boss character
+        self.skill_cooldown = None  # Seconds between uses of the boss's timed skill (None = no timed skill)
+        self.skill_timer = 0.0
+
+    def time_to_skill(self):
+        """Seconds until this boss's timed skill fires, or None if it has none."""
+        if self.skill_cooldown is None:
+            return None
+        return self.skill_cooldown - self.skill_timer
+
+    def use_timed_skill(self, enemies, room_number):
+        """Fire the timed skill. Returns a log string or None."""
+        return None
 
 class RegenBoss(BossEnemy):
     """Boss with high health regeneration and Unholy Light skill."""
+    __slots__ = ()
+
     def __init__(self, x, room_number=1):
         super().__init__(x, name="Unholy Paladin", room_number=room_number)
         self.char = 'R'
@@ -779,21 +1116,19 @@ class RegenBoss(BossEnemy):
         self.thorn_damage = 0
         self.lifesteal = 0.0
         self.dodge_chance = 0.07
-        self.unholy_light_cooldown = 8.0
-        self.unholy_light_timer = 0.0
-
-    def update(self, dt, enemies, room_number):
-        self.unholy_light_timer += dt
-        if self.unholy_light_timer >= self.unholy_light_cooldown:
-            self.unholy_light_timer = 0.0
-            # Nerf: Heal only 10% of max HP (was 25%)
-            heal = int(self.max_hp * 0.10)
-            self.hp = min(self.max_hp, self.hp + heal)
-            return f"{self.name} uses UNHOLY LIGHT and heals {heal} HP!"
-        return None
+        self.skill_cooldown = 8.0  # Unholy Light
+        self.skill_timer = 0.0
+
+    def use_timed_skill(self, enemies, room_number):
+        # Nerf: Heal only 10% of max HP (was 25%)
+        heal = int(self.max_hp * 0.10)
+        self.hp = min(self.max_hp, self.hp + heal)
+        return f"{self.name} uses UNHOLY LIGHT and heals {heal} HP!"
 
 class LifestealBoss(BossEnemy):
     """Boss with high lifesteal and Vampiric Strike skill."""
+    __slots__ = ()
+
     def __init__(self, x, room_number=1):
         super().__init__(x, name="Vampire", room_number=room_number)
         self.char = 'L'
@@ -808,31 +1143,28 @@ class LifestealBoss(BossEnemy):
         self.thorn_damage = 0
         self.lifesteal = 0.18
         self.dodge_chance = 0.08
-        self.vamp_strike_cooldown = 6.0
-        self.vamp_strike_timer = 0.0
-
-    def update(self, dt, enemies, room_number):
-        self.vamp_strike_timer += dt
-        if self.vamp_strike_timer >= self.vamp_strike_cooldown:
-            self.vamp_strike_timer = 0.0
-            # Find the player (assume first non-enemy in enemies list is player)
-            from inspect import isclass
-            player = None
-            for e in enemies:
-                if hasattr(e, "char") and getattr(e, "char", None) == '@':
-                    player = e
-                    break
-            # If not found, assume player is not in enemies, so skip
-            if player is None:
-                return None
-            damage = int(self.attack * 1.5)
-            player.hp = max(0, player.hp - damage)
-            self.hp = min(self.max_hp, self.hp + damage)
-            return f"{self.name} uses VAMPIRIC STRIKE! Steals {damage} HP from you!"
-        return None
+        self.skill_cooldown = 6.0  # Vampiric Strike
+        self.skill_timer = 0.0
+
+    def use_timed_skill(self, enemies, room_number):
+        # Find the player (assume first non-enemy in enemies list is player)
+        player = None
+        for e in enemies:
+            if e.char == '@':
+                player = e
+                break
+        # If not found, assume player is not in enemies, so skip
+        if player is None:
+            return None
+        damage = int(self.attack * 1.5)
+        player.hp = max(0, player.hp - damage)
+        self.hp = min(self.max_hp, self.hp + damage)
+        return f"{self.name} uses VAMPIRIC STRIKE! Steals {damage} HP from you!"
 
 class FinalBoss(BossEnemy):
     """Balanced final boss that can summon minions."""
+    __slots__ = ('max_minions', 'minions')
+
     def __init__(self, x, room_number=1):
         super().__init__(x, name="??? FINAL BOSS ???", room_number=room_number)
         self.char = 'F'
@@ -847,34 +1179,39 @@ class FinalBoss(BossEnemy):
         self.thorn_damage = 0
         self.lifesteal = 0.15
         self.dodge_chance = 0.15
-        self.summon_cooldown = 8.0  # seconds
-        self.summon_timer = 0.0
-
-    def update(self, dt, enemies, room_number):
-        # Summon minions every summon_cooldown seconds, up to 2 at a time
-        self.summon_timer += dt
-        if self.summon_timer >= self.summon_cooldown:
-            self.summon_timer = 0.0
-            minions = []
-            for _ in range(2):
-                minion_type = random.choice(['basic', 'speedy', 'tough', 'brute'])
-                minion = Enemy(x=random.randint(10, 50), enemy_type=minion_type, room_number=max(1, room_number - 5))
-                minion.hp = max(1, int(minion.hp * 0.5))
-                minion.max_hp = minion.hp
-                minion.attack = max(1, int(minion.attack * 0.6))
-                minions.append(minion)
-            enemies.extend(minions)
-            return f"{self.name} summons reinforcements!"
-        return None
+        self.skill_cooldown = 8.0  # Summon, in seconds
+        self.skill_timer = 0.0
+        self.max_minions = 4  # Living minions at once
+        self.minions = []
+
+    def use_timed_skill(self, enemies, room_number):
+        # Summon minions every skill_cooldown seconds, up to 2 at a time
+        self.minions = [m for m in self.minions if m.hp > 0]
+        count = min(2, self.max_minions - len(self.minions))
+        if count <= 0:
+            return None
+        minions = []
+        for _ in range(count):
+            minion_type = rng.spawning.choice(ENEMY_TYPES)
+            minion = Enemy(x=rng.spawning.randint(10, 50), enemy_type=minion_type, room_number=max(1, room_number - 5), role='minion')
+            minions.append(minion)
+        self.minions.extend(minions)
+        enemies.extend(minions)
+        return f"{self.name} summons reinforcements!"
         
 # --- Item Classes ---
 class Item:
     """Base class for all items."""
+    __slots__ = ('name',)
+    char = '?'  # Glyph in the inventory and equipment boxes
+
     def __init__(self, name):
         self.name = name
 
 class Potion(Item):
     """Base class for all potions."""
+    __slots__ = ()
+
     def __init__(self, name):
         super().__init__(name)
 
@@ -882,6 +1219,7 @@ class Potion(Item):
         pass  # To be overridden
 
 class HealingPotion(Potion):
+    __slots__ = ()
     heal_percent = 0.0  # Override in subclasses
     potion_classes = []  # Will be filled after all subclasses are defined
 
@@ -896,32 +1234,35 @@ class HealingPotion(Potion):
         return f"{player.char} uses {self.name} and heals {heal_amount} HP!"
 
 class SmallHealingPotion(HealingPotion):
+    __slots__ = ()
     char = '!'
     heal_percent = 0.25
     def __init__(self):
         super().__init__("a small health potion")
 
 class MediumHealingPotion(HealingPotion):
+    __slots__ = ()
     char = '%'
     heal_percent = 0.5
     def __init__(self):
         super().__init__("a medium health potion")
 
 class MaxHealingPotion(HealingPotion):
+    __slots__ = ()
     char = '&'
     heal_percent = 1.0
     def __init__(self):
         super().__init__("a max health potion")
 
 class StatPotion(Potion):
+    __slots__ = ('stat',)
+
     def __init__(self, name, stat):
         super().__init__(name)
         self.stat = stat
 
     def use(self, player):
         # Mark the stat to be boosted for the next battle
-        if not hasattr(player, 'stat_boosts'):
-            player.stat_boosts = {}
         stat_value = getattr(player, self.stat)
         if stat_value == 0:
             player.stat_boosts[self.stat] = "+1"
@@ -933,46 +1274,55 @@ class StatPotion(Potion):
             return f"{player.char} uses {self.name}! {stat_name} x2 next battle!"
 
 class AttackPotion(StatPotion):
+    __slots__ = ()
     char = 'A'
     def __init__(self):
         super().__init__("an attack potion", "attack")
 
 class DefencePotion(StatPotion):
+    __slots__ = ()
     char = 'D'
     def __init__(self):
         super().__init__("a defence potion", "defence")
 
 class AttackSpeedPotion(StatPotion):
+    __slots__ = ()
     char = 'S'
     def __init__(self):
         super().__init__("an attack speed potion", "attack_speed")
 
 class CritChancePotion(StatPotion):
+    __slots__ = ()
     char = 'C'
     def __init__(self):
         super().__init__("a crit chance potion", "crit_chance")
 
 class CritDamagePotion(StatPotion):
+    __slots__ = ()
     char = 'G'
     def __init__(self):
         super().__init__("a crit damage potion", "crit_damage")
 
 class ThornPotion(StatPotion):
+    __slots__ = ()
     char = 'T'
     def __init__(self):
         super().__init__("a thorn potion", "thorn_damage")
 
 class LifestealPotion(StatPotion):
+    __slots__ = ()
     char = 'L'
     def __init__(self):
         super().__init__("a lifesteal potion", "lifesteal")
 
 class DodgePotion(StatPotion):
+    __slots__ = ()
     char = 'V'
     def __init__(self):
         super().__init__("a dodge potion", "dodge_chance")
 
 class RegenPotion(StatPotion):
+    __slots__ = ()
     char = 'R'
     def __init__(self):
         super().__init__("a regen potion", "health_regen")
@@ -985,39 +1335,68 @@ HealingPotion.potion_classes = [
     LifestealPotion, DodgePotion, RegenPotion,
 ]
 
+# --- Weighted Tables ---
+class WeightedTable:
+    """
+    Items with fixed weights, accumulated once. A draw is one bisect into the
+    cumulative weights and takes the same random number as
+    random.choices(items, weights), so seeded runs draw the same items.
+    """
+    __slots__ = ('items', 'cum_weights', 'total', 'hi')
+
+    def __init__(self, items, weights):
+        self.items = list(items)
+        self.cum_weights = list(itertools.accumulate(weights))
+        self.total = self.cum_weights[-1] + 0.0
+        self.hi = len(self.items) - 1
+
+    def draw(self, stream):
+        return self.items[bisect.bisect(self.cum_weights, stream.random() * self.total, 0, self.hi)]
+
+    def draws(self, stream, k):
+        """`k` draws in one call."""
+        items, cum_weights, total, hi, random_ = self.items, self.cum_weights, self.total, self.hi, stream.random
+        return [items[bisect.bisect(cum_weights, random_() * total, 0, hi)] for _ in range(k)]
+
 # --- Equipment Tiers ---
 EQUIPMENT_TIERS = ["Basic", "Good", "Rare", "Awesome", "Legendary"]
 
+# At luck 0: Only Basic, Good, and rarely Rare.
+# Luck unlocks higher tiers and shifts weights.
+# Legendary is always extremely rare.
+# Tiers:        0      1      2      3        4
+#            Basic   Good   Rare  Awesome  Legendary
+TIER_WEIGHTS_BY_LUCK = [
+    [0.80, 0.18, 0.02, 0.00, 0.00],  # luck 0
+    [0.70, 0.22, 0.07, 0.01, 0.00],  # luck 1
+    [0.60, 0.25, 0.12, 0.03, 0.00],  # luck 2
+    [0.50, 0.28, 0.17, 0.05, 0.00],  # luck 3
+    [0.40, 0.30, 0.20, 0.09, 0.01],  # luck 4
+    [0.32, 0.32, 0.22, 0.13, 0.01],  # luck 5
+    [0.25, 0.32, 0.24, 0.17, 0.02],  # luck 6
+    [0.18, 0.32, 0.25, 0.22, 0.03],  # luck 7
+    [0.12, 0.30, 0.26, 0.27, 0.05],  # luck 8
+    [0.07, 0.25, 0.27, 0.34, 0.07],  # luck 9
+    [0.03, 0.18, 0.28, 0.41, 0.10],  # luck 10
+]
+TIER_TABLES = [WeightedTable(EQUIPMENT_TIERS, weights) for weights in TIER_WEIGHTS_BY_LUCK]
+
+def tier_table(luck=0):
+    return TIER_TABLES[min(max(int(luck), 0), 10)]
+
 def random_tier(luck=0):
-    """
-    Returns a random equipment tier, weighted by player's luck.
-    At luck 0: Only Basic, Good, and rarely Rare.
-    Luck unlocks higher tiers and shifts weights.
-    Legendary is always extremely rare.
-    """
-    # Tiers:        0      1      2      3        4
-    #            Basic   Good   Rare  Awesome  Legendary
-    # Weights for each luck level 0-10:
-    tier_weights_by_luck = [
-        [0.80, 0.18, 0.02, 0.00, 0.00],  # luck 0
-        [0.70, 0.22, 0.07, 0.01, 0.00],  # luck 1
-        [0.60, 0.25, 0.12, 0.03, 0.00],  # luck 2
-        [0.50, 0.28, 0.17, 0.05, 0.00],  # luck 3
-        [0.40, 0.30, 0.20, 0.09, 0.01],  # luck 4
-        [0.32, 0.32, 0.22, 0.13, 0.01],  # luck 5
-        [0.25, 0.32, 0.24, 0.17, 0.02],  # luck 6
-        [0.18, 0.32, 0.25, 0.22, 0.03],  # luck 7
-        [0.12, 0.30, 0.26, 0.27, 0.05],  # luck 8
-        [0.07, 0.25, 0.27, 0.34, 0.07],  # luck 9
-        [0.03, 0.18, 0.28, 0.41, 0.10],  # luck 10
-    ]
-    idx = min(max(int(luck), 0), 10)
-    weights = tier_weights_by_luck[idx]
-    return random.choices(EQUIPMENT_TIERS, weights)[0]
+    """Returns a random equipment tier, weighted by player's luck (see TIER_WEIGHTS_BY_LUCK)."""
+    return tier_table(luck).draw(rng.loot)
+
+def random_tiers(k, luck=0):
+    """`k` random equipment tiers in one call."""
+    return tier_table(luck).draws(rng.loot, k)
 
 # --- Equipment Classes ---
 class Equipment(Item):
     """Base class for all equipment items."""
+    __slots__ = ('level', 'tier', 'bonus_stats')
+    stat = None  # Stat each level adds to (see STAT_STEPS), set per subclass
     # List of stats that can be boosted (excluding luck)
     BONUS_STATS = [
         "attack", "attack_speed", "crit_chance", "crit_damage", "defence",
@@ -1052,7 +1431,7 @@ class Equipment(Item):
         self.bonus_stats = {}  # e.g. {"attack": 0.1}
         num_stats, bonus = self.TIER_BONUSES.get(tier, (0, 0.0))
         if num_stats > 0:
-            stats = random.sample(self.BONUS_STATS, num_stats)
+            stats = rng.loot.sample(self.BONUS_STATS, num_stats)
             for stat in stats:
                 self.bonus_stats[stat] = bonus
 
@@ -1069,63 +1448,95 @@ class Equipment(Item):
 # Equipment subclasses for each stat
 
 class Sword(Equipment):
+    __slots__ = ()
     char = '/'
+    stat = "attack"
     def __init__(self, level=1, tier="Basic"):
-        super().__init__("sword", level, tier)  # Attack
+        super().__init__("sword", level, tier)
 
 class Shield(Equipment):
+    __slots__ = ()
     char = ']'
+    stat = "defence"
     def __init__(self, level=1, tier="Basic"):
-        super().__init__("shield", level, tier)  # Defence
+        super().__init__("shield", level, tier)
 
 class Armor(Equipment):
+    __slots__ = ()
     char = 'U'
+    stat = "max_hp"
     def __init__(self, level=1, tier="Basic"):
-        super().__init__("armor", level, tier)  # Max HP
+        super().__init__("armor", level, tier)
 
 class Fangs(Equipment):
+    __slots__ = ()
     char = 'f'
+    stat = "lifesteal"
     def __init__(self, level=1, tier="Basic"):
-        super().__init__("fangs", level, tier)  # Lifesteal
+        super().__init__("fangs", level, tier)
 
 class Boots(Equipment):
+    __slots__ = ()
     char = 'b'
+    stat = "dodge_chance"
     def __init__(self, level=1, tier="Basic"):
-        super().__init__("boots", level, tier)  # Dodge chance
+        super().__init__("boots", level, tier)
 
 class Amulet(Equipment):
+    __slots__ = ()
     char = 'a'
+    stat = "crit_chance"
     def __init__(self, level=1, tier="Basic"):
-        super().__init__("amulet", level, tier)  # Crit chance
+        super().__init__("amulet", level, tier)
 
 class Gem(Equipment):
+    __slots__ = ()
     char = '*'
+    stat = "crit_damage"
     def __init__(self, level=1, tier="Basic"):
-        super().__init__("gem", level, tier)  # Crit damage
+        super().__init__("gem", level, tier)
 
 class Thorns(Equipment):
+    __slots__ = ()
     char = 't'
+    stat = "thorn_damage"
     def __init__(self, level=1, tier="Basic"):
-        super().__init__("thorns", level, tier)  # Thorn damage
+        super().__init__("thorns", level, tier)
 
 class Ring(Equipment):
+    __slots__ = ()
     char = 'r'
+    stat = "health_regen"
     def __init__(self, level=1, tier="Basic"):
-        super().__init__("ring", level, tier)  # Health regen
+        super().__init__("ring", level, tier)
 
 class Gloves(Equipment):
+    __slots__ = ()
     char = 'g'
+    stat = "attack_speed"
     def __init__(self, level=1, tier="Basic"):
-        super().__init__("gloves", level, tier)  # Attack speed
+        super().__init__("gloves", level, tier)
 
 class Dagger(Equipment):
+    __slots__ = ()
     char = 'd'
+    stat = "bleed"
     def __init__(self, level=1, tier="Basic"):
-        super().__init__("dagger", level, tier)  # Bleed
+        super().__init__("dagger", level, tier)
 
 Equipment.equipment_classes = [
     Sword, Shield, Armor, Fangs, Boots, Amulet, Gem, Thorns, Ring, Gloves, Dagger
 ]
+
+def roll_equipment(luck=0, max_level=1, k=1):
+    """`k` random equipment drops (class, level 1..max_level, luck-weighted tier) from the loot stream."""
+    stream, classes, tiers = rng.loot, Equipment.equipment_classes, tier_table(luck)
+    items = []
+    for _ in range(k):
+        eq_class = stream.choice(classes)
+        level = stream.randint(1, max_level)
+        items.append(eq_class(level=level, tier=tiers.draw(stream)))
+    return items
 # Add more as needed for other stats
 
 # --- Room and UI Classes ---
@@ -1134,9 +1545,14 @@ class Room:
     def __init__(self, width, height):
         self.width = width
         self.height = height
+        self.blank_row = ' ' * width
+        self.timeline = None  # AnimationTimeline whose effects are drawn over the rows
 
-    def get_landscape_line(self, y):
-        return [' '] * self.width
+    def overlay_rows(self):
+        """Row -> text drawn instead of the bare landscape: the running animation effects."""
+        if self.timeline is None:
+            return {}
+        return self.timeline.overlays(self.blank_row)
 
 class EventRooms:
     def __init__(self, game):
@@ -1146,29 +1562,27 @@ class EventRooms:
         player = self.game.player
         lines = ["You find a shady gambler! Bet 10 gold for a chance to double it?"]
         lines.append("Press Y to bet, SPACE to skip.")
-        self.game.renderer.render(player, self.game.room, self.game.ui, intro_message="\n".join(lines), room_number=self.game.current_room)
         while True:
             if hasattr(self.game, "autoplay") and self.game.autoplay:
                 # Always skip (space)
                 return
-            if msvcrt.kbhit():
-                key = msvcrt.getch()
-                if key in [b'y', b'Y']:
-                    if player.gold < 10:
-                        self.game.announcements.wait_for_space("Not enough gold!", show_player=True, room_number=self.game.current_room)
-                        return
-                    player.gold -= 10
-                    # Luck: 40% base + 3% per luck, max 80%
-                    win_chance = min(0.4 + 0.03 * player.luck, 0.8)
-                    if random.random() < win_chance:
-                        player.gold += 20
-                        self.game.announcements.wait_for_space("You win! You gain 20 gold!", show_player=True, room_number=self.game.current_room)
-                    else:
-                        self.game.announcements.wait_for_space("You lose! Better luck next time.", show_player=True, room_number=self.game.current_room)
-                    return
-                elif key == b' ':
+            self.game.renderer.render(player, self.game.room, self.game.ui, intro_message="\n".join(lines), room_number=self.game.current_room)
+            key = self.game.input_handler.wait_key(self.game.renderer, self.game.room.timeline)
+            if key in [b'y', b'Y']:
+                if player.gold < 10:
+                    self.game.announcements.wait_for_space("Not enough gold!", show_player=True, room_number=self.game.current_room)
                     return
-            time.sleep(0.08)
+                player.gold -= 10
+                # Luck: 40% base + 3% per luck, max 80%
+                win_chance = min(0.4 + 0.03 * player.luck, 0.8)
+                if rng.events.random() < win_chance:
+                    player.gold += 20
+                    self.game.announcements.wait_for_space("You win! You gain 20 gold!", show_player=True, room_number=self.game.current_room)
+                else:
+                    self.game.announcements.wait_for_space("You lose! Better luck next time.", show_player=True, room_number=self.game.current_room)
+                return
+            elif key == b' ':
+                return
 
     def skill_learn_event(self):
         player = self.game.player
@@ -1178,7 +1592,7 @@ class EventRooms:
         if not available_skills:
             self.game.announcements.wait_for_space("You find a shrine of knowledge, but you already know every skill!", show_player=True, room_number=self.game.current_room)
             return
-        choices = random.sample(available_skills, min(3, len(available_skills)))
+        choices = rng.events.sample(available_skills, min(3, len(available_skills)))
         if hasattr(self.game, "autoplay") and self.game.autoplay:
             self.game.announcements.skill_learn_screen(player, choices)
             return
@@ -1195,146 +1609,138 @@ class EventRooms:
         for idx, eq in enumerate(eqs):
             lines.append(f"{idx+1}. {eq.display_name()}")
         lines.append("Press 1-4 to select, or SPACE to skip.")
-        self.game.renderer.render(player, self.game.room, self.game.ui, intro_message="\n".join(lines), room_number=self.game.current_room)
         while True:
             if hasattr(self.game, "autoplay") and self.game.autoplay:
                 # Upgrade first equipment, level up
                 if eqs:
                     eq = eqs[0]
                     eq.level += 1
+                    player.refresh_equipment(eq)
                 return
-            if msvcrt.kbhit():
-                key = msvcrt.getch()
-                if key in [b'1', b'2', b'3', b'4']:
-                    slot = int(key) - 1
-                    if slot < len(eqs):
-                        eq = eqs[slot]
-                        # Choose upgrade type
-                        while True:
-                            # Render the upgrade prompt directly
-                            lines = [f"Upgrade {eq.display_name()}:"]
-                            lines.append("Press 1 to level up (+1), or SPACE to skip.")
-                            self.game.renderer.render(
-                                player, self.game.room, self.game.ui,
-                                intro_message="\n".join(lines),
+            self.game.renderer.render(player, self.game.room, self.game.ui, intro_message="\n".join(lines), room_number=self.game.current_room)
+            key = self.game.input_handler.wait_key(self.game.renderer, self.game.room.timeline)
+            if key in [b'1', b'2', b'3', b'4']:
+                slot = int(key) - 1
+                if slot < len(eqs):
+                    eq = eqs[slot]
+                    # Choose upgrade type
+                    while True:
+                        # Render the upgrade prompt directly
+                        lines = [f"Upgrade {eq.display_name()}:"]
+                        lines.append("Press 1 to level up (+1), or SPACE to skip.")
+                        self.game.renderer.render(
+                            player, self.game.room, self.game.ui,
+                            intro_message="\n".join(lines),
+                            room_number=self.game.current_room
+                        )
+                        subkey = self.game.input_handler.wait_key(self.game.renderer, self.game.room.timeline)
+                        if subkey == b'1':
+                            eq.level += 1
+                            player.refresh_equipment(eq)
+                            self.game.announcements.wait_for_space(
+                                f"{eq.display_name()} leveled up!",
+                                show_player=True,
                                 room_number=self.game.current_room
                             )
-                            if msvcrt.kbhit():
-                                subkey = msvcrt.getch()
-                                if subkey == b'1':
-                                    eq.level += 1
-                                    self.game.announcements.wait_for_space(
-                                        f"{eq.display_name()} leveled up!",
-                                        show_player=True,
-                                        room_number=self.game.current_room
-                                    )
-                                    return
-                                elif subkey == b' ':
-                                    return
-                            time.sleep(0.08)
-                    else:
-                        return
-                elif key == b' ':
+                            return
+                        elif subkey == b' ':
+                            return
+                else:
                     return
-            time.sleep(0.08)
+            elif key == b' ':
+                return
 
     def mystery_merchant(self):
         lines = ["A mysterious merchant appears!"]
-        offer = random.choice([
+        offer = rng.events.choice([
             ("Buy a random potion for 5 gold?", "potion"),
             ("Buy a random equipment for 10 gold?", "equipment"),
             ("Buy a stat boost (+1 random stat) for 8 gold?", "stat"),
         ])
         lines.append(offer[0])
         lines.append("Press Y to buy, SPACE to ignore.")
-        self.game.renderer.render(self.game.player, self.game.room, self.game.ui, intro_message="\n".join(lines), room_number=self.game.current_room)
         while True:
             if hasattr(self.game, "autoplay") and self.game.autoplay:
                 # Always skip (space)
                 break
-            if msvcrt.kbhit():
-                key = msvcrt.getch()
-                if key in [b'y', b'Y']:
-                    if offer[1] == "potion" and self.game.player.gold >= 5:
-                        self.game.player.gold -= 5
-                        potion_class = random.choice(HealingPotion.potion_classes)
-                        potion = potion_class()
-                        for i in range(4):
-                            if self.game.player.potions[i] is None:
-                                self.game.player.potions[i] = potion
-                                break
-                        else:
-                            self.game.announcements.potion_pickup_prompt(self.game.player, potion)
-                        self.game.announcements.wait_for_space("You bought a potion!", show_player=True, room_number=self.game.current_room)
-                    elif offer[1] == "equipment" and self.game.player.gold >= 10:
-                        self.game.player.gold -= 10
-                        eq_class = random.choice(Equipment.equipment_classes)
-                        eq = eq_class(level=1, tier=random_tier(self.game.player.luck))
-                        for i in range(4):
-                            if self.game.player.equipment_items[i] is None:
-                                self.game.player.equipment_items[i] = eq
-                                self.game.player.equip(eq)
-                                break
-                        else:
-                            self.game.announcements.equipment_pickup_prompt(self.game.player, eq)
-                        self.game.announcements.wait_for_space("You bought equipment!", show_player=True, room_number=self.game.current_room)
-                    elif offer[1] == "stat" and self.game.player.gold >= 8:
-                        self.game.player.gold -= 8
-                        stat = random.choice(["attack", "defence", "max_hp", "luck"])
-                        self.game.player.upgrade_stat(stat)
-                        self.game.announcements.wait_for_space(f"+1 {stat.replace('_',' ').title()}!", show_player=True, room_number=self.game.current_room)
+            self.game.renderer.render(self.game.player, self.game.room, self.game.ui, intro_message="\n".join(lines), room_number=self.game.current_room)
+            key = self.game.input_handler.wait_key(self.game.renderer, self.game.room.timeline)
+            if key in [b'y', b'Y']:
+                if offer[1] == "potion" and self.game.player.gold >= 5:
+                    self.game.player.gold -= 5
+                    potion_class = rng.events.choice(HealingPotion.potion_classes)
+                    potion = potion_class()
+                    for i in range(4):
+                        if self.game.player.potions[i] is None:
+                            self.game.player.potions[i] = potion
+                            break
                     else:
-                        self.game.announcements.wait_for_space("Not enough gold!", show_player=True, room_number=self.game.current_room)
-                    break
-                elif key == b' ':
-                    break
-            time.sleep(0.08)
+                        self.game.announcements.potion_pickup_prompt(self.game.player, potion)
+                    self.game.announcements.wait_for_space("You bought a potion!", show_player=True, room_number=self.game.current_room)
+                elif offer[1] == "equipment" and self.game.player.gold >= 10:
+                    self.game.player.gold -= 10
+                    eq_class = rng.events.choice(Equipment.equipment_classes)
+                    eq = eq_class(level=1, tier=random_tier(self.game.player.luck))
+                    for i in range(4):
+                        if self.game.player.equipment_items[i] is None:
+                            self.game.player.equipment_items[i] = eq
+                            self.game.player.equip(eq)
+                            break
+                    else:
+                        self.game.announcements.equipment_pickup_prompt(self.game.player, eq)
+                    self.game.announcements.wait_for_space("You bought equipment!", show_player=True, room_number=self.game.current_room)
+                elif offer[1] == "stat" and self.game.player.gold >= 8:
+                    self.game.player.gold -= 8
+                    stat = rng.events.choice(["attack", "defence", "max_hp", "luck"])
+                    self.game.player.upgrade_stat(stat)
+                    self.game.announcements.wait_for_space(f"+1 {stat.replace('_',' ').title()}!", show_player=True, room_number=self.game.current_room)
+                else:
+                    self.game.announcements.wait_for_space("Not enough gold!", show_player=True, room_number=self.game.current_room)
+                break
+            elif key == b' ':
+                break
 
     def trapped_chest(self):
         lines = ["You find a suspicious chest...", "Open it? (Y/N)"]
-        self.game.renderer.render(self.game.player, self.game.room, self.game.ui, intro_message="\n".join(lines), room_number=self.game.current_room)
         while True:
             if hasattr(self.game, "autoplay") and self.game.autoplay:
                 # Always skip (space)
                 break
-            if msvcrt.kbhit():
-                key = msvcrt.getch()
-                if key in [b'y', b'Y']:
-                    if random.random() < 0.5:
-                        gold = random.randint(5, 15)
-                        self.game.player.gold += gold
-                        self.game.announcements.wait_for_space(f"You found {gold} gold!", show_player=True, room_number=self.game.current_room)
-                    else:
-                        dmg = random.randint(5, 15)
-                        self.game.player.hp = max(1, self.game.player.hp - dmg)
-                        self.game.announcements.wait_for_space(f"It's a trap! You take {dmg} damage!", show_player=True, room_number=self.game.current_room)
-                    break
-                elif key in [b'n', b'N', b' ']:
-                    break
-            time.sleep(0.08)
+            self.game.renderer.render(self.game.player, self.game.room, self.game.ui, intro_message="\n".join(lines), room_number=self.game.current_room)
+            key = self.game.input_handler.wait_key(self.game.renderer, self.game.room.timeline)
+            if key in [b'y', b'Y']:
+                if rng.events.random() < 0.5:
+                    gold = rng.events.randint(5, 15)
+                    self.game.player.gold += gold
+                    self.game.announcements.wait_for_space(f"You found {gold} gold!", show_player=True, room_number=self.game.current_room)
+                else:
+                    dmg = rng.events.randint(5, 15)
+                    self.game.player.hp = max(1, self.game.player.hp - dmg)
+                    self.game.announcements.wait_for_space(f"It's a trap! You take {dmg} damage!", show_player=True, room_number=self.game.current_room)
+                break
+            elif key in [b'n', b'N', b' ']:
+                break
 
     def cursed_altar(self):
         lines = ["A cursed altar beckons. Touch it? (Y/N)"]
-        self.game.renderer.render(self.game.player, self.game.room, self.game.ui, intro_message="\n".join(lines), room_number=self.game.current_room)
         while True:
             if hasattr(self.game, "autoplay") and self.game.autoplay:
                 # Always skip (space)
                 break
-            if msvcrt.kbhit():
-                key = msvcrt.getch()
-                if key in [b'y', b'Y']:
-                    if random.random() < 0.5:
-                        stat = random.choice(["attack", "defence", "max_hp", "luck"])
-                        self.game.player.upgrade_stat(stat)
-                        self.game.announcements.wait_for_space(f"The curse empowers you! +1 {stat.replace('_',' ').title()}!", show_player=True, room_number=self.game.current_room)
-                    else:
-                        stat = random.choice(["attack", "defence", "max_hp"])
-                        self.game.player.downgrade_stat(stat)
-                        self.game.announcements.wait_for_space(f"The curse weakens you! -1 {stat.replace('_',' ').title()}!", show_player=True, room_number=self.game.current_room)
-                    break
-                elif key in [b'n', b'N', b' ']:
-                    break
-            time.sleep(0.08)
+            self.game.renderer.render(self.game.player, self.game.room, self.game.ui, intro_message="\n".join(lines), room_number=self.game.current_room)
+            key = self.game.input_handler.wait_key(self.game.renderer, self.game.room.timeline)
+            if key in [b'y', b'Y']:
+                if rng.events.random() < 0.5:
+                    stat = rng.events.choice(["attack", "defence", "max_hp", "luck"])
+                    self.game.player.upgrade_stat(stat)
+                    self.game.announcements.wait_for_space(f"The curse empowers you! +1 {stat.replace('_',' ').title()}!", show_player=True, room_number=self.game.current_room)
+                else:
+                    stat = rng.events.choice(["attack", "defence", "max_hp"])
+                    self.game.player.downgrade_stat(stat)
+                    self.game.announcements.wait_for_space(f"The curse weakens you! -1 {stat.replace('_',' ').title()}!", show_player=True, room_number=self.game.current_room)
+                break
+            elif key in [b'n', b'N', b' ']:
+                break
 
     def random_event(self):
         # Map event names to methods
@@ -1350,74 +1756,101 @@ class EventRooms:
         available = [name for name in event_methods if name not in self.game.encountered_events]
         if not available:
             return  # No events left, skip
-        chosen = random.choice(available)
+        chosen = rng.events.choice(available)
         self.game.encountered_events.add(chosen)
         event_methods[chosen]()
 
 class UI:
     """Handles UI elements and stat formatting."""
+    panel_limit = 64  # cached stat panels kept before the cache starts over
+
     def __init__(self):
         self.title = "Kill the Necromancer!"
+        self.panels = {}  # id(entity) -> (displayed values, lines)
 
     def get_title_line(self, pad_left, width):
         return ' ' * pad_left + self.title.center(width + 2)
 
+    def cached_panel(self, entity, values, build):
+        """Return the entity's stat panel, rebuilding it only when the displayed values change."""
+        cached = self.panels.get(id(entity))
+        if cached is not None and cached[0] == values:
+            return cached[1]
+        if len(self.panels) >= self.panel_limit:
+            self.panels.clear()
+        lines = build(*values)
+        self.panels[id(entity)] = (values, lines)
+        return lines
+
     def get_player_stats_lines(self, player, game_height):
+        values = (
+            player.level, player.xp, player.xp_to_next, int(player.hp), player.max_hp,
+            player.attack, player.attack_speed, player.crit_chance, player.crit_damage,
+            player.defence, player.health_regen, player.thorn_damage, player.lifesteal,
+            player.bleed, player.dodge_chance, player.luck, player.gold,
+            game_height,
+        )
+        return self.cached_panel(player, values, self.build_player_stats_lines)
+
+    def build_player_stats_lines(self, level, xp, xp_to_next, hp, max_hp, attack, attack_speed,
+                                 crit_chance, crit_damage, defence, health_regen, thorn_damage,
+                                 lifesteal, bleed, dodge_chance, luck, gold, game_height):
         stats = [
-            f"LVL: {player.level}",
-            f"XP: {player.xp}/{player.xp_to_next}",
-            f"HP: {int(player.hp):.0f}/{player.max_hp:.0f}",
-            f"ATK: {player.attack:.0f}",
-            f"ATK SPD: {player.attack_speed:.1f}",
-            f"CRIT%: {int(round(player.crit_chance * 100))}",
-            f"CRIT DMG: {player.crit_damage:.1f}",
-            f"DEF: {player.defence:.0f}",
-            f"REGEN: {player.health_regen:.0f}",
-            f"THORN: {player.thorn_damage:.0f}",
-            f"LIFESTEAL: {player.lifesteal:.2f}",
-            f"BLEED: {getattr(player, 'bleed', 0)}",
-            f"DODGE%: {int(round(player.dodge_chance * 100))}",
-            f"LUCK: {player.luck}",
-            f"GOLD: {player.gold}",
+            f"LVL: {level}",
+            f"XP: {xp}/{xp_to_next}",
+            f"HP: {hp:.0f}/{max_hp:.0f}",
+            f"ATK: {attack:.0f}",
+            f"ATK SPD: {attack_speed:.1f}",
+            f"CRIT%: {int(round(crit_chance * 100))}",
+            f"CRIT DMG: {crit_damage:.1f}",
+            f"DEF: {defence:.0f}",
+            f"REGEN: {health_regen:.0f}",
+            f"THORN: {thorn_damage:.0f}",
+            f"LIFESTEAL: {lifesteal:.2f}",
+            f"BLEED: {bleed}",
+            f"DODGE%: {int(round(dodge_chance * 100))}",
+            f"LUCK: {luck}",
+            f"GOLD: {gold}",
         ]
         stats += [''] * (game_height - len(stats))
         return stats
 
-    def get_enemy_stats_lines(self, enemy, game_height):
+    def get_enemy_stats_lines(self, enemy, game_height, boss_chance=0.0):
         if enemy is None:
-            stats = [''] * game_height
-        else:
-            stats = [
-                f"ENEMY: {enemy.char}",
-                f"HP: {enemy.hp:.0f}/{enemy.max_hp:.0f}",
-                f"ATK: {enemy.attack}",
-                f"ATK SPD: {enemy.attack_speed:.1f}",
-                f"CRIT%: {int(round(enemy.crit_chance * 100))}",
-                f"CRIT DMG: {enemy.crit_damage:.1f}",
-                f"DEF: {enemy.defence}",
-                f"REGEN: {enemy.health_regen}",
-                f"THORN: {enemy.thorn_damage}",
-                f"LIFESTEAL: {enemy.lifesteal:.1f}",
-                f"DODGE%: {int(round(enemy.dodge_chance * 100))}",
-            ]
-            # Calculate how many blank lines to add so the boss chance is at the bottom
-            lines_needed = game_height - len(stats) - 2
-            if lines_needed > 0:
-                stats += [''] * lines_needed
-            # Add a separator and the boss chance at the very bottom
-            stats.append('-' * 14)
-            # Try to get boss_probability from the game instance
-            boss_chance = 0.0
-            try:
-                import __main__
-                if hasattr(__main__, 'game'):
-                    boss_chance = getattr(__main__.game, 'boss_probability', 0.0)
-            except Exception:
-                pass
-            stats.append(f"BOSS CHANCE: {boss_chance*100:.0f}%")
-            # If stats is now longer than game_height, trim it (shouldn't happen)
-            stats = stats[:game_height]
-        return stats
+            return [''] * game_height
+        values = (
+            enemy.char, enemy.hp, enemy.max_hp, enemy.attack, enemy.attack_speed,
+            enemy.crit_chance, enemy.crit_damage, enemy.defence, enemy.health_regen,
+            enemy.thorn_damage, enemy.lifesteal, enemy.dodge_chance, boss_chance,
+            game_height,
+        )
+        return self.cached_panel(enemy, values, self.build_enemy_stats_lines)
+
+    def build_enemy_stats_lines(self, char, hp, max_hp, attack, attack_speed, crit_chance,
+                                crit_damage, defence, health_regen, thorn_damage, lifesteal,
+                                dodge_chance, boss_chance, game_height):
+        stats = [
+            f"ENEMY: {char}",
+            f"HP: {hp:.0f}/{max_hp:.0f}",
+            f"ATK: {attack}",
+            f"ATK SPD: {attack_speed:.1f}",
+            f"CRIT%: {int(round(crit_chance * 100))}",
+            f"CRIT DMG: {crit_damage:.1f}",
+            f"DEF: {defence}",
+            f"REGEN: {health_regen}",
+            f"THORN: {thorn_damage}",
+            f"LIFESTEAL: {lifesteal:.1f}",
+            f"DODGE%: {int(round(dodge_chance * 100))}",
+        ]
+        # Calculate how many blank lines to add so the boss chance is at the bottom
+        lines_needed = game_height - len(stats) - 2
+        if lines_needed > 0:
+            stats += [''] * lines_needed
+        # Add a separator and the boss chance at the very bottom
+        stats.append('-' * 14)
+        stats.append(f"BOSS CHANCE: {boss_chance*100:.0f}%")
+        # If stats is now longer than game_height, trim it (shouldn't happen)
+        return stats[:game_height]
 
     def get_room_counter_line(self, room_number):
         return f"ROOM: {room_number}"
@@ -1462,74 +1895,181 @@ class UI:
                 lines.append("".join(line))
         return lines
 
+class FrameStats:
+    """Running totals of what the renderer sends to the terminal."""
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.writes = 0
+        self.time = 0.0
+        self.max_bytes = 0
+        self.frame_bytes = 0
+
+    def wrote(self, nbytes):
+        self.bytes += nbytes
+        self.writes += 1
+        self.frame_bytes += nbytes
+
+    def end_frame(self, seconds):
+        self.frames += 1
+        self.time += seconds
+        self.max_bytes = max(self.max_bytes, self.frame_bytes)
+        self.frame_bytes = 0
+
+    def summary(self):
+        if not self.frames:
+            return "No frames rendered."
+        n = self.frames
+        return (f"{n} frames: {self.bytes / n:.0f} bytes (max {self.max_bytes}), "
+                f"{self.writes / n:.2f} writes, {self.time / n * 1000:.2f} ms per frame")
+
+class FrameLayout:
+    """Parts of the frame that only change with the terminal size: padding, borders and box templates."""
+    stats_col_width = 16
+    boss_col_width = 16
+    battle_log_height = 7  # Increased by 1 for even bottom row
+
+    def __init__(self, term_size, width, height, ui):
+        self.term_size = term_size
+        pad_left = (term_size.columns - (width + 2 + self.stats_col_width + self.boss_col_width)) // 2
+        self.pad = ' ' * pad_left
+        self.title = ui.get_title_line(pad_left + self.stats_col_width, width)
+        self.border = self.pad + '+' + '-' * self.stats_col_width + '+' + '-' * width + '+' + '-' * self.boss_col_width + '+'
+        self.inventory_box = ui.get_inventory_box(height=self.battle_log_height, width=self.stats_col_width)
+        self.equipment_box = ui.get_equipment_box(height=self.battle_log_height, width=self.boss_col_width)
+        # Slot positions (row, col) for the 4 slots in the cross
+        self.slot_positions = [
+            (1, self.stats_col_width // 4),           # Top-left
+            (1, 3 * self.stats_col_width // 4),       # Top-right
+            (self.battle_log_height - 2, self.stats_col_width // 4),     # Bottom-left
+            (self.battle_log_height - 2, 3 * self.stats_col_width // 4), # Bottom-right
+        ]
+
+    def stamp_slots(self, box, items):
+        """Copy of a box template with each item's glyph drawn in its slot."""
+        box = list(box)
+        for idx, item in enumerate(items):
+            if item:
+                row, col = self.slot_positions[idx]
+                box[row] = box[row][:col] + item.char + box[row][col + 1:]
+        return box
+
 class Renderer:
     """Handles all drawing to the terminal."""
-    def __init__(self, width, height):
+    draws = True  # False if frames are thrown away, so callers can skip building them
+    probe = None  # Probe timing each frame (set by Game)
+
+    def __init__(self, width, height, stream=None):
         self.width = width
         self.height = height
         self.enemy = None
+        self.stream = stream or sys.stdout
+        self.stats = FrameStats()
+        self.layout = None
+        self.resize_signal = False  # True once SIGWINCH invalidates the layout for us
+
+    def write(self, data):
+        """Send data to the terminal in a single write."""
+        self.stream.write(data)
+        self.stream.flush()
+        self.stats.wrote(len(data.encode()))
 
     def clear(self):
-        print('\033[H', end='')
+        self.write('\033[H')
 
+    @probed("render", "render")
     def render(self, player, room, ui, boss_info_lines=None, battle_log_lines=None, intro_message=None, room_number=None, enemies=None):
-        self.clear()
-        stats_col_width = 16
-        boss_col_width = 16
-        term_size = shutil.get_terminal_size((80, 24))
-        pad_left = (term_size.columns - (self.width + 2 + stats_col_width + boss_col_width)) // 2
-
-        # --- Skill icons rendering ---
+        start = time.perf_counter()
+        self.draw(self.compose(player, room, ui, boss_info_lines, battle_log_lines, intro_message, room_number, enemies))
+        self.stats.end_frame(time.perf_counter() - start)
+
+    def draw(self, lines):
+        """Redraw the whole frame from the top-left corner."""
+        self.write('\033[H' + '\n'.join(lines) + '\n')
+
+    def get_layout(self, ui):
+        """Frame geometry for the current terminal size, rebuilt only after a resize."""
+        if self.layout is None or not self.resize_signal:
+            # Without SIGWINCH (Windows) the size has to be checked every frame
+            term_size = shutil.get_terminal_size((80, 24))
+            if self.layout is None or term_size != self.layout.term_size:
+                self.layout = FrameLayout(term_size, self.width, self.height, ui)
+                self.watch_resize()
+        return self.layout
+
+    def watch_resize(self):
+        """Drop the cached layout whenever the terminal is resized."""
+        if self.resize_signal or not hasattr(signal, "SIGWINCH"):
+            return
+        try:
+            signal.signal(signal.SIGWINCH, lambda signum, frame: self.invalidate_layout())
+        except ValueError:  # Not the main thread
+            return
+        self.resize_signal = True
+
+    def invalidate_layout(self):
+        self.layout = None
+
+    def stale(self):
+        """True if the terminal was resized since the last frame was laid out."""
+        if self.layout is None:
+            return True
+        if self.resize_signal:
+            return False  # SIGWINCH would have dropped the layout
+        return shutil.get_terminal_size((80, 24)) != self.layout.term_size
+
+    def compose(self, player, room, ui, boss_info_lines=None, battle_log_lines=None, intro_message=None, room_number=None, enemies=None):
+        """Build a frame as a list of text lines."""
+        layout = self.get_layout(ui)
+        frame = [layout.title, layout.border]
+        stats_col_width = layout.stats_col_width
+        boss_col_width = layout.boss_col_width
         stats_lines = ui.get_player_stats_lines(player, self.height)
         if boss_info_lines is None:
-            boss_info_lines = [''] * self.height
-        else:
-            boss_info_lines += [''] * (self.height - len(boss_info_lines))
-
-        print(ui.get_title_line(pad_left + stats_col_width, self.width))
-        print(' ' * pad_left + '+' + '-' * stats_col_width + '+' + '-' * self.width + '+' + '-' * boss_col_width + '+')
+            boss_info_lines = ()
+        message_lines = intro_message.split('\n') if intro_message is not None else []
+        msg_start = (self.height - len(message_lines)) // 2
+        overlays = room.overlay_rows()
 
         for y in range(self.height):
-            print(' ' * pad_left + '|' + stats_lines[y].ljust(stats_col_width), end='')
+            row = layout.pad + '|' + stats_lines[y].ljust(stats_col_width) + '|'
             if y == 0:
                 # Always draw skill icons on the first line
-                skill_chars = [getattr(skill, 'char', '?') for skill in getattr(player, 'skills', [])]
-                icons_per_row = self.width
-                skill_line = ''.join(skill_chars[:icons_per_row]).ljust(self.width)
-                print('|' + skill_line + '|', end='')
-                print(boss_info_lines[y].ljust(boss_col_width) + '|')
+                skill_chars = [skill.char for skill in player.skills]
+                row += ''.join(skill_chars[:self.width]).ljust(self.width)
             else:
-                # Draw the normal game area line
-                line = room.get_landscape_line(y)
-                # Draw player and enemies on the correct line
-                if y == self.height - 1:
-                    if 0 <= player.x < self.width:
-                        line[player.x] = player.char
-                    if enemies is None:
-                        enemies = [self.enemy] if self.enemy else []
-                    for enemy in enemies:
-                        if getattr(enemy, "dead", False):
-                            continue
-                        if 0 <= enemy.x < self.width:
-                            line[enemy.x] = enemy.char
-                # Overlay message if intro_message is present and this is a message line
-                if intro_message is not None:
-                    message_lines = intro_message.split('\n')
-                    msg_start = (self.height - len(message_lines)) // 2
-                    if msg_start <= y < msg_start + len(message_lines):
+                # Draw the game area line; only rows with glyphs on them are copied
+                line = overlays.get(y, room.blank_row)
+                on_message = msg_start <= y < msg_start + len(message_lines)
+                if y == self.height - 1 or on_message:
+                    cells = list(line)
+                    # Draw player and enemies on the correct line
+                    if y == self.height - 1:
+                        if 0 <= player.x < self.width:
+                            cells[player.x] = player.char
+                        if enemies is None:
+                            enemies = [self.enemy] if self.enemy else []
+                        for enemy in enemies:
+                            if enemy.dead:
+                                continue
+                            if 0 <= enemy.x < self.width:
+                                cells[enemy.x] = enemy.char
+                    # Overlay the message on top of the line
+                    if on_message:
                         msg = message_lines[y - msg_start].center(self.width)
-                        # Overlay the message on top of the line
                         for i, ch in enumerate(msg):
-                            if i < len(line) and ch != ' ':
-                                line[i] = ch
-                print('|' + ''.join(line) + '|', end='')
-                print(boss_info_lines[y].ljust(boss_col_width) + '|')
+                            if i < len(cells) and ch != ' ':
+                                cells[i] = ch
+                    line = ''.join(cells)
+                row += line
+            boss_line = boss_info_lines[y] if y < len(boss_info_lines) else ''
+            frame.append(row + '|' + boss_line.ljust(boss_col_width) + '|')
 
-        print(' ' * pad_left + '+' + '-' * stats_col_width + '+' + '-' * self.width + '+' + '-' * boss_col_width + '+')
+        frame.append(layout.border)
 
-        battle_log_height = 7  # Increased by 1 for even bottom row
-        if battle_log_lines is None:
-            battle_log_lines = []
+        battle_log_height = layout.battle_log_height
+        # May be a live LogTail: this is where its lines get formatted
+        battle_log_lines = list(battle_log_lines) if battle_log_lines is not None else []
 
         room_num = room_number
         if room_num is None:
@@ -1540,58 +2080,341 @@ class Renderer:
         elif len(battle_log_lines) < battle_log_height:
             battle_log_lines = [room_line] + battle_log_lines
 
-        inventory_box = ui.get_inventory_box(height=battle_log_height, width=stats_col_width)
-        equipment_box = ui.get_equipment_box(height=battle_log_height, width=boss_col_width)
-        # Inventory slot positions (row, col) for 4 slots in the cross
-        slot_positions = [
-            (1, stats_col_width // 4),           # Top-left
-            (1, 3 * stats_col_width // 4),       # Top-right
-            (battle_log_height - 2, stats_col_width // 4),     # Bottom-left
-            (battle_log_height - 2, 3 * stats_col_width // 4), # Bottom-right
-        ]
-        # Copy inventory_box to a mutable list of lists
-        inv_box = [list(row) for row in inventory_box]
-        for idx, potion in enumerate(getattr(player, "potions", [])):
-            if potion:
-                row, col = slot_positions[idx]
-                inv_box[row][col] = getattr(potion, "char", "?")
-        # Convert back to strings
-        inventory_box = ["".join(row) for row in inv_box]
-
-        # --- Equipment rendering logic ---
-        eq_box = [list(row) for row in equipment_box]
-        for idx, eq in enumerate(getattr(player, "equipment_items", [])):
-            if eq:
-                row, col = slot_positions[idx]
-                eq_box[row][col] = getattr(eq, "char", "?")
-        equipment_box = ["".join(row) for row in eq_box]
+        # Stamp potion and equipment glyphs into the cached box templates
+        inventory_box = layout.stamp_slots(layout.inventory_box, player.potions)
+        equipment_box = layout.stamp_slots(layout.equipment_box, player.equipment_items)
 
         for i in range(battle_log_height):
             inv = inventory_box[i] if i < len(inventory_box) else ''
             log = battle_log_lines[i] if i < len(battle_log_lines) else ''
             eq = equipment_box[i] if i < len(equipment_box) else ''
-            print(' ' * pad_left + '|' + inv + '|' + log.ljust(self.width) + '|' + eq + '|')
+            frame.append(layout.pad + '|' + inv + '|' + log.ljust(self.width) + '|' + eq + '|')
 
-        print(' ' * pad_left + '+' + '-' * stats_col_width + '+' + '-' * self.width + '+' + '-' * boss_col_width + '+')
+        frame.append(layout.border)
+        return frame
+
+class DiffRenderer(Renderer):
+    """
+    Double-buffered renderer. Keeps the last frame it drew and only rewrites the
+    runs of cells that changed, jumping between them with cursor moves.
+    """
+    max_gap = 6  # Unchanged cells between two changes cheaper to rewrite than to jump over
+
+    def __init__(self, width, height, stream=None):
+        super().__init__(width, height, stream)
+        self.front = None  # Lines currently on screen; None means unknown
+        self.front_layout = None
+
+    def clear(self):
+        pass  # Cells are addressed directly, so there's no cursor to reset
+
+    def draw(self, lines):
+        out = []
+        if self.front is None or self.layout is not self.front_layout:
+            # Unknown screen (first frame or the terminal was resized): start from blank
+            self.front_layout = self.layout
+            self.front = []
+            out.append('\033[2J')
+        for y in range(max(len(lines), len(self.front))):
+            old = self.front[y] if y < len(self.front) else ''
+            new = lines[y] if y < len(lines) else ''
+            if old != new:
+                self.diff_line(y, old, new, out)
+        if out:
+            out.append(f'\033[{len(lines) + 1};1H')  # Park the cursor below the frame
+            self.write(''.join(out))
+        self.front = list(lines)
+
+    def diff_line(self, y, old, new, out):
+        """Append cursor moves and text that turn `old` into `new` on screen row y."""
+        n = max(len(old), len(new))
+        old = old.ljust(n)
+        new = new.ljust(n)
+        x = 0
+        while x < n:
+            if old[x] == new[x]:
+                x += 1
+                continue
+            start = end = x
+            while x < n and x - end <= self.max_gap:
+                if old[x] != new[x]:
+                    end = x + 1
+                x += 1
+            out.append(f'\033[{y + 1};{start + 1}H{new[start:end]}')
+
+class NullRenderer(Renderer):
+    """Renderer that draws nothing, for headless runs."""
+    draws = False
+
+    def clear(self):
+        pass
+
+    def stale(self):
+        return False
+
+    @probed("render", "render")
+    def render(self, *args, **kwargs):
+        pass
+
+# --- Input Backends ---
+MENU_INPUT_TIMEOUT = 0.5  # seconds an idle screen waits before checking the terminal size (no SIGWINCH)
+MENU_FRAME_TIME = 1 / 30  # seconds between redraws of an idle screen while an effect is playing
+
+class InputBackend:
+    """
+    Source of key presses. read_key() returns one key as bytes in msvcrt.getch()
+    style (arrows as b'H', b'P', b'K', b'M', Enter as b'\\r'), or None if no key
+    arrived within `timeout` seconds (None blocks, 0 just polls).
+    """
+    interactive = True  # False if no key can ever arrive
+
+    def read_key(self, timeout=None):
+        return None
+
+    def close(self):
+        pass
+
+class NullInputBackend(InputBackend):
+    """
+    Never produces a key. Used for headless runs and when stdin is not a terminal.
+    A read still waits out its timeout on `clock`, so idle screens don't spin;
+    a read that would block until a key arrives raises EOFError instead.
+    """
+    interactive = False
+
+    def __init__(self, clock=None):
+        self.clock = clock or RealClock()
+
+    def read_key(self, timeout=None):
+        if timeout is None:
+            raise EOFError("no keyboard input: stdin is not a terminal")
+        if timeout > 0:
+            self.clock.sleep(timeout)
+        return None
+
+class WindowsInputBackend(InputBackend):
+    """Console input through msvcrt. The console can't be waited on, so this polls finely."""
+    poll_interval = 0.01
+
+    def read_key(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not msvcrt.kbhit():
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+        key = msvcrt.getch()
+        if key in (b'\x00', b'\xe0'):  # Arrow/function key prefix
+            key = msvcrt.getch()
+        return key
+
+class PosixInputBackend(InputBackend):
+    """
+    Terminal input through termios. The terminal is put in cbreak mode (no echo,
+    no line buffering, Ctrl+C still works) and reads block in a selector until a
+    key is ready, so idle menus don't use any CPU. Signals (e.g. SIGWINCH) are
+    written to a wakeup pipe in the same selector, so a resize ends the wait too.
+    """
+    ARROW_KEYS = {b'A': b'H', b'B': b'P', b'C': b'M', b'D': b'K'}  # Up, Down, Right, Left
+
+    def __init__(self, fd=None):
+        self.fd = sys.stdin.fileno() if fd is None else fd
+        self.saved_attrs = termios.tcgetattr(self.fd)
+        tty.setcbreak(self.fd)
+        atexit.register(self.close)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.fd, selectors.EVENT_READ)
+        self.pending = []
+        self.wakeup_fd = None
+        wakeup_r, wakeup_w = os.pipe()
+        os.set_blocking(wakeup_r, False)
+        os.set_blocking(wakeup_w, False)
+        try:
+            signal.set_wakeup_fd(wakeup_w, warn_on_full_buffer=False)
+        except ValueError:  # Not the main thread: signals can't end a wait
+            os.close(wakeup_r)
+            os.close(wakeup_w)
+        else:
+            self.wakeup_fd = wakeup_r
+            self.selector.register(wakeup_r, selectors.EVENT_READ)
+
+    def read_key(self, timeout=None):
+        if not self.pending:
+            ready = [key.fd for key, _ in self.selector.select(timeout)]
+            if self.wakeup_fd in ready:
+                try:
+                    os.read(self.wakeup_fd, 512)  # A signal arrived; its handler has already run
+                except BlockingIOError:
+                    pass
+            if self.fd not in ready:
+                return None
+            data = os.read(self.fd, 64)
+            if not data:
+                return None
+            self.pending = self.split_keys(data)
+        return self.pending.pop(0)
+
+    def split_keys(self, data):
+        """Split a chunk of terminal input into keys, translating escape sequences."""
+        keys = []
+        i = 0
+        while i < len(data):
+            if data[i:i+1] == b'\x1b' and data[i+1:i+2] in (b'[', b'O') and i + 2 < len(data):
+                final = data[i+2:i+3]
+                if final in self.ARROW_KEYS:
+                    keys.append(self.ARROW_KEYS[final])
+                i += 3
+                continue
+            key = data[i:i+1]
+            keys.append(b'\r' if key == b'\n' else key)
+            i += 1
+        return keys
+
+    def close(self):
+        if self.saved_attrs is not None:
+            termios.tcsetattr(self.fd, termios.TCSADRAIN, self.saved_attrs)
+            self.saved_attrs = None
+        if self.wakeup_fd is not None:
+            try:
+                signal.set_wakeup_fd(-1)
+            except ValueError:
+                pass
+            self.wakeup_fd = None
+
+def default_input_backend(clock=None):
+    """Pick the input backend for this platform and terminal."""
+    if msvcrt is not None:
+        return WindowsInputBackend()
+    if termios is not None and sys.stdin.isatty():
+        return PosixInputBackend()
+    return NullInputBackend(clock)
+
+# --- Input Recording ---
+class InputRecording:
+    """
+    Everything needed to play a session again: the Game options that shape it
+    and, for each run, its seed and the keys the game read, stamped with the
+    seconds since that run began. Battles read no keys, so a run is fully
+    determined by its seed and the order of these keys.
+    """
+    version = 1
+
+    def __init__(self, options=None, runs=None):
+        self.options = dict(options or {})
+        self.runs = runs if runs is not None else []  # [{"seed": int, "keys": [[seconds, key], ...]}]
+        self.clock = None
+        self.started = 0.0
+
+    def start_run(self, seed, clock):
+        self.clock = clock
+        self.started = clock.now()
+        self.runs.append({"seed": seed, "keys": []})
+
+    def add_key(self, key):
+        stamp = round(self.clock.now() - self.started, 3) if self.clock else 0.0
+        self.runs[-1]["keys"].append([stamp, key.decode("latin-1")])
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"version": self.version, "options": self.options, "runs": self.runs}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != cls.version:
+            raise ValueError(f"{path}: unsupported recording version {data.get('version')!r}")
+        return cls(data.get("options"), data.get("runs"))
+
+class RecordingInputBackend(InputBackend):
+    """Passes keys through from another backend, noting each one in an InputRecording."""
+    def __init__(self, backend, recording):
+        self.backend = backend
+        self.recording = recording
+
+    @property
+    def interactive(self):
+        return self.backend.interactive
+
+    def read_key(self, timeout=None):
+        key = self.backend.read_key(timeout)
+        if key is not None:
+            self.recording.add_key(key)
+        return key
+
+    def close(self):
+        self.backend.close()
+
+class ReplayEnded(Exception):
+    """The replayed session has run out of recorded seeds or keys."""
+
+class ReplayInputBackend(InputBackend):
+    """
+    Plays an InputRecording back: hands out its run seeds in order and returns
+    its keys at once, one per read, ignoring the timestamps. Raises ReplayEnded
+    when the game asks for more than was recorded.
+    """
+    def __init__(self, recording):
+        self.recording = recording
+        self.seeds = [run["seed"] for run in recording.runs]
+        self.keys = [key.encode("latin-1") for run in recording.runs for _, key in run["keys"]]
+        self.next_run = 0
+        self.next_key = 0
+
+    def next_seed(self):
+        if self.next_run >= len(self.seeds):
+            raise ReplayEnded(f"all {len(self.seeds)} recorded runs replayed")
+        self.next_run += 1
+        return self.seeds[self.next_run - 1]
+
+    def read_key(self, timeout=None):
+        if self.next_key >= len(self.keys):
+            raise ReplayEnded(f"all {len(self.keys)} recorded keys replayed")
+        self.next_key += 1
+        return self.keys[self.next_key - 1]
 
 # --- Input Handler ---
 class InputHandler:
     """Handles keyboard input (ESC to quit, SPACE to start)."""
-    def __init__(self):
+    def __init__(self, backend=None):
+        self.backend = backend or default_input_backend()
         self.quit = False
         self.space_pressed = False
 
-    def poll(self):
-        if msvcrt.kbhit():
-            key = msvcrt.getch()
-            if key == b'\x1b':
-                self.quit = True
-            elif key == b' ':
-                self.space_pressed = True
+    def read_key(self, timeout=None):
+        """Wait up to `timeout` seconds for a key press; None if there was none."""
+        return self.backend.read_key(timeout)
+
+    def poll(self, timeout=0):
+        key = self.read_key(timeout)
+        if key == b'\x1b':
+            self.quit = True
+        elif key == b' ':
+            self.space_pressed = True
+        return key
+
+    def wait_key(self, renderer, timeline=None):
+        """
+        Wait on an idle screen, without redrawing, until a key arrives or the
+        screen has to be drawn again: after a resize, or for the next frame of
+        an effect still playing on `timeline`. Returns the key, or None when
+        only a redraw is due. ESC and space are noted like poll() does.
+        """
+        while True:
+            animating = timeline is not None and timeline.playing(timeline.clock.now())
+            if animating:
+                timeout = max(0.0, min(MENU_FRAME_TIME, timeline.end - timeline.clock.now()))
+            elif renderer.resize_signal or not self.backend.interactive:
+                timeout = None  # SIGWINCH ends the wait; with no keyboard this raises EOFError
+            else:
+                timeout = MENU_INPUT_TIMEOUT  # No resize signal: check the size now and then
+            key = self.poll(timeout)
+            if key is not None or animating or renderer.stale():
+                return key
 
 # --- Announcements Class ---
 class Announcements:
     """Handles displaying announcements and intro messages."""
+    probe = None  # Probe told when the level-up screen opens (set by Game)
     
     AUTOPLAY_STAT_PRIORITY = {
         "Fighter": ["attack", "max_hp", "defence", "attack_speed", "crit_chance", "crit_damage", "health_regen", "thorn_damage", "lifesteal", "dodge_chance", "bleed", "luck"],
@@ -1620,12 +2443,13 @@ class Announcements:
         "Paladin":    ["Shield", "Armor", "Ring", "Sword", "Thorns", "Gloves", "Amulet", "Gem", "Fangs", "Boots", "Dagger"],
     }
 
-    def __init__(self, renderer, ui, room, player, input_handler):
+    def __init__(self, renderer, ui, room, player, input_handler, clock=None):
         self.renderer = renderer
         self.ui = ui
         self.room = room
         self.player = player
         self.input_handler = input_handler
+        self.clock = clock or RealClock()
         self.current_room = 1  # Will be set by Game
 
     def wait_for_space(self, message, enemy=None, show_player=True, room_number=None, battle_log_lines=None, enemies=None):
@@ -1642,8 +2466,7 @@ class Announcements:
                 self.player.x = -1
             else:
                 self.player.x = original_player_x
-            self.renderer.clear()
-            boss_info_lines = self.ui.get_enemy_stats_lines(enemy, self.room.height) if enemy else [''] * self.room.height
+            boss_info_lines = self.ui.get_enemy_stats_lines(enemy, self.room.height, self.game.boss_probability)
             self.renderer.render(
                 self.player, self.room, self.ui,
                 boss_info_lines=boss_info_lines,
@@ -1652,8 +2475,7 @@ class Announcements:
                 battle_log_lines=battle_log_lines,
                 enemies=enemies,
             )
-            self.input_handler.poll()
-            time.sleep(0.05)
+            self.input_handler.wait_key(self.renderer, self.room.timeline)
         if show_player:
             self.player.x = original_player_x
         if enemy is None:
@@ -1678,6 +2500,8 @@ class Announcements:
         self.wait_for_space("You lose!\nPress spacebar to restart", enemy=enemy, show_player=False, room_number=self.current_room)
 
     def level_up_screen(self, player, battle_log_lines=None):
+        if self.probe:
+            self.probe.level_up(player)
         # List of upgradable stats and their display names
         stat_options = [
             ("attack", "Attack +1"),
@@ -1693,9 +2517,9 @@ class Announcements:
             ("bleed", "Bleed +1"),
         ]
         # Add luck if not maxed
-        if getattr(player, "luck", 0) < 10:
+        if player.luck < 10:
             stat_options.append(("luck", "Luck +1"))
-        choices = random.sample(stat_options, 3)
+        choices = rng.level_up.sample(stat_options, 3)
         selected = 0
 
         while True:
@@ -1724,18 +2548,16 @@ class Announcements:
             message = "\n".join(lines)
             self.renderer.render(self.player, self.room, self.ui, intro_message=message, room_number=self.current_room, battle_log_lines=battle_log_lines)
             # Keyboard navigation: arrows or 1/2/3
-            if msvcrt.kbhit():
-                key = msvcrt.getch()
-                if key in [b'1', b'2', b'3']:
-                    selected = int(key) - 1
-                    break
-                elif key in [b'H', b'K', b'w']:  # Up arrow or W
-                    selected = (selected - 1) % 3
-                elif key in [b'P', b'M', b's']:  # Down arrow or S
-                    selected = (selected + 1) % 3
-                elif key == b'\r' or key == b' ':  # Enter or Space
-                    break
-            time.sleep(0.08)
+            key = self.input_handler.wait_key(self.renderer, self.room.timeline)
+            if key in [b'1', b'2', b'3']:
+                selected = int(key) - 1
+                break
+            elif key in [b'H', b'K', b'w']:  # Up arrow or W
+                selected = (selected - 1) % 3
+            elif key in [b'P', b'M', b's']:  # Down arrow or S
+                selected = (selected + 1) % 3
+            elif key == b'\r' or key == b' ':  # Enter or Space
+                break
         player.upgrade_stat(choices[selected][0])
 
     def job_select_screen(self):
@@ -1748,7 +2570,8 @@ class Announcements:
         while True:
             # --- AUTOPLAY support ---
             if hasattr(self, "game") and getattr(self.game, "autoplay", False):
-                selected = 0
+                job = getattr(self.game, "job", None)
+                selected = jobs.index(job) if job in jobs else 0
                 break
             lines = ["CHOOSE YOUR CLASS:"]
             for i, name in enumerate(jobs):
@@ -1756,18 +2579,16 @@ class Announcements:
                 lines.append(f"{prefix}{i+1}. {name}")
             message = "\n".join(lines)
             self.renderer.render(self.player, self.room, self.ui, intro_message=message, room_number=self.current_room)
-            if msvcrt.kbhit():
-                key = msvcrt.getch()
-                if key in [b'1', b'2', b'3']:
-                    selected = int(key) - 1
-                    break
-                elif key in [b'H', b'K', b'w']:
-                    selected = (selected - 1) % 3
-                elif key in [b'P', b'M', b's']:
-                    selected = (selected + 1) % 3
-                elif key == b'\r' or key == b' ':
-                    break
-            time.sleep(0.08)
+            key = self.input_handler.wait_key(self.renderer, self.room.timeline)
+            if key in [b'1', b'2', b'3']:
+                selected = int(key) - 1
+                break
+            elif key in [b'H', b'K', b'w']:
+                selected = (selected - 1) % 3
+            elif key in [b'P', b'M', b's']:
+                selected = (selected + 1) % 3
+            elif key == b'\r' or key == b' ':
+                break
         return selected
 
     def pre_battle_item_use(self, player, enemy, enemies=None):
@@ -1802,18 +2623,16 @@ class Announcements:
             lines.append("[Press 1-4 to use, or space to start battle]")
             message = "\n".join(lines)
             self.renderer.render(player, self.room, self.ui, intro_message=message, room_number=self.current_room, enemies=enemies)
-            if msvcrt.kbhit():
-                key = msvcrt.getch()
-                if key in [b'1', b'2', b'3', b'4']:
-                    slot = int(key) - 1
-                    if player.potions[slot]:
-                        log = player.potions[slot].use(player)
-                        player.potions[slot] = None
-                        # Show heal message, pass the enemy!
-                        self.wait_for_space(log, enemy=enemy, show_player=True, room_number=self.current_room, enemies=enemies)
-                elif key == b' ':
-                    break
-            time.sleep(0.08)
+            key = self.input_handler.wait_key(self.renderer, self.room.timeline)
+            if key in [b'1', b'2', b'3', b'4']:
+                slot = int(key) - 1
+                if player.potions[slot]:
+                    log = player.potions[slot].use(player)
+                    player.potions[slot] = None
+                    # Show heal message, pass the enemy!
+                    self.wait_for_space(log, enemy=enemy, show_player=True, room_number=self.current_room, enemies=enemies)
+            elif key == b' ':
+                break
 
     def loot_screen(self, found_items, battle_log_lines=None):
         # found_items: list of Item objects
@@ -1843,7 +2662,6 @@ class Announcements:
         lines.append(f"New: {new_name}")
         lines.append("Press 1-4 to replace, or SPACE to discard new item.")
         message = "\n".join(lines)
-        self.renderer.render(player, self.room, self.ui, intro_message=message, room_number=self.current_room)
         while True:
             # --- AUTOPLAY support ---
             if hasattr(self, "game") and getattr(self.game, "autoplay", False):
@@ -1870,19 +2688,18 @@ class Announcements:
                 player.equipment_items[slot] = new_item
                 player.equip(new_item)
                 return
-            if msvcrt.kbhit():
-                key = msvcrt.getch()
-                if key in [b'1', b'2', b'3', b'4']:
-                    slot = int(key) - 1
-                    # Unequip old item if present
-                    if player.equipment_items[slot]:
-                        player.unequip(player.equipment_items[slot])
-                    player.equipment_items[slot] = new_item
-                    player.equip(new_item)
-                    return
-                elif key == b' ':
-                    return
-            time.sleep(0.08)
+            self.renderer.render(player, self.room, self.ui, intro_message=message, room_number=self.current_room)
+            key = self.input_handler.wait_key(self.renderer, self.room.timeline)
+            if key in [b'1', b'2', b'3', b'4']:
+                slot = int(key) - 1
+                # Unequip old item if present
+                if player.equipment_items[slot]:
+                    player.unequip(player.equipment_items[slot])
+                player.equipment_items[slot] = new_item
+                player.equip(new_item)
+                return
+            elif key == b' ':
+                return
 
     def potion_pickup_prompt(self, player, new_potion):
         lines = ["Potion slots full!"]
@@ -1892,22 +2709,20 @@ class Announcements:
         lines.append(f"New: {new_potion.name}")
         lines.append("Press 1-4 to replace, or SPACE to discard new potion.")
         message = "\n".join(lines)
-        self.renderer.render(player, self.room, self.ui, intro_message=message, room_number=self.current_room)
         while True:
             # --- AUTOPLAY support ---
             if hasattr(self, "game") and getattr(self.game, "autoplay", False):
-                slot = random.randint(0, 3)
+                slot = rng.loot.randint(0, 3)
                 player.potions[slot] = new_potion
                 return
-            if msvcrt.kbhit():
-                key = msvcrt.getch()
-                if key in [b'1', b'2', b'3', b'4']:
-                    slot = int(key) - 1
-                    player.potions[slot] = new_potion
-                    return
-                elif key == b' ':
-                    return
-            time.sleep(0.08)
+            self.renderer.render(player, self.room, self.ui, intro_message=message, room_number=self.current_room)
+            key = self.input_handler.wait_key(self.renderer, self.room.timeline)
+            if key in [b'1', b'2', b'3', b'4']:
+                slot = int(key) - 1
+                player.potions[slot] = new_potion
+                return
+            elif key == b' ':
+                return
 
     def skill_learn_screen(self, player, skill_classes, battle_log_lines=None):
         selected = 0
@@ -1941,18 +2756,16 @@ class Announcements:
                 room_number=self.current_room,
                 battle_log_lines=battle_log_lines  # <-- Add this
             )
-            if msvcrt.kbhit():
-                key = msvcrt.getch()
-                if key in [b'1', b'2', b'3']:
-                    selected = int(key) - 1
-                    break
-                elif key in [b'H', b'K', b'w']:
-                    selected = (selected - 1) % len(skill_classes)
-                elif key in [b'P', b'M', b's']:
-                    selected = (selected + 1) % len(skill_classes)
-                elif key == b'\r' or key == b' ':
-                    break
-            time.sleep(0.08)
+            key = self.input_handler.wait_key(self.renderer, self.room.timeline)
+            if key in [b'1', b'2', b'3']:
+                selected = int(key) - 1
+                break
+            elif key in [b'H', b'K', b'w']:
+                selected = (selected - 1) % len(skill_classes)
+            elif key in [b'P', b'M', b's']:
+                selected = (selected + 1) % len(skill_classes)
+            elif key == b'\r' or key == b' ':
+                break
         # Actually add the skill
         new_skill = skill_classes[selected]()
         player.skills.append(new_skill)
@@ -1974,264 +2787,407 @@ class Announcements:
             "Press R to restart the game.",
             "Press E to continue in Endless Mode."
         ]
-        self.renderer.render(self.player, self.room, self.ui, intro_message="\n".join(lines), room_number=self.current_room)
         while True:
-            if msvcrt.kbhit():
-                key = msvcrt.getch()
-                if key in [b'r', b'R']:
-                    return "reset"
-                elif key in [b'e', b'E']:
-                    return "endless"
-            time.sleep(0.08 * (1 / getattr(self, "game_speed", 1.0)))
+            # --- AUTOPLAY support ---
+            if hasattr(self, "game") and getattr(self.game, "autoplay", False):
+                return "endless"
+            self.renderer.render(self.player, self.room, self.ui, intro_message="\n".join(lines), room_number=self.current_room)
+            key = self.input_handler.wait_key(self.renderer, self.room.timeline)
+            if key in [b'r', b'R']:
+                return "reset"
+            elif key in [b'e', b'E']:
+                return "endless"
+# --- Animation Timeline ---
+class AnimationTrack:
+    """
+    One effect on the timeline: frames of (seconds, stamps) shown one after the
+    other from `start`, where each stamp is a (row, column, text) drawn over the room.
+    """
+    __slots__ = ('frames', 'ends', 'start', 'end')
+
+    def __init__(self, frames, start, speed):
+        self.frames = frames
+        self.start = start
+        self.ends = list(itertools.accumulate(seconds / speed for seconds, _ in frames))
+        self.end = start + (self.ends[-1] if self.ends else 0.0)
+
+    def stamps(self, now):
+        """Stamps of the frame showing at `now` (none before the start or after the end)."""
+        if now < self.start or now >= self.end:
+            return ()
+        return self.frames[bisect.bisect_right(self.ends, now - self.start)][1]
+
+class AnimationTimeline:
+    """
+    Effects playing over the room against the clock. Starting one never waits:
+    the renderer composites whatever is showing into every frame it draws, so
+    the battle keeps going while effects play. Newer tracks draw on top.
+    `speed` scales how fast effects play; 0 skips them altogether.
+    """
+    probe = None  # Probe told about every effect started (set by Game)
+
+    def __init__(self, clock, speed=1.0):
+        self.clock = clock
+        self.speed = speed
+        self.tracks = []
+        self.end = float('-inf')  # When the last effect finishes
+
+    def play(self, frames):
+        """Start a track of (seconds, stamps) frames now."""
+        if self.speed <= 0 or not frames:
+            return None
+        now = self.clock.now()
+        self.tracks = [t for t in self.tracks if t.end > now]
+        track = AnimationTrack(frames, now, self.speed)
+        self.tracks.append(track)
+        self.end = max(self.end, track.end)
+        if self.probe:
+            self.probe.effect(track)
+        return track
+
+    def playing(self, now):
+        return now < self.end
+
+    def overlays(self, blank_row):
+        """Row -> text for the rows the stamps showing right now are drawn on."""
+        if not self.tracks:
+            return {}
+        now = self.clock.now()
+        self.tracks = [t for t in self.tracks if t.end > now]
+        rows = {}
+        for track in self.tracks:
+            for y, x, text in track.stamps(now):
+                cells = rows.get(y)
+                if cells is None:
+                    cells = rows[y] = list(blank_row)
+                for i, ch in enumerate(text, x):
+                    if 0 <= i < len(cells):
+                        cells[i] = ch
+        return {y: ''.join(cells) for y, cells in rows.items()}
+
+    def clear(self):
+        self.tracks = []
+        self.end = float('-inf')
+
 # --- Animations Class ---
 class Animations:
-    """Handles all game animations (player slide, attacks, etc)."""
-    def __init__(self, renderer, room, ui, player):
+    """
+    Handles all game animations (player slide, attacks, etc). Effects go on the
+    room's timeline and play while the game carries on; only cutscenes
+    (play_out) wait for them.
+    """
+    speed = 1.0  # Animation speed: 2 plays effects twice as fast, 0 makes them instant
+    fps = 30  # Frame rate while playing out a cutscene
+    probe = None  # Probe timing each animation call (set by Game)
+
+    def __init__(self, renderer, room, ui, player, clock=None, speed=None):
         self.renderer = renderer
         self.room = room
         self.ui = ui
         self.player = player
+        self.clock = clock or RealClock()
         self.current_room = 1  # Will be set by Game
-
-    def player_slide_and_disappear(self, enemies=None):
-        for x in range(self.player.x, WIDTH):
-            self.player.x = x
-            self.renderer.render(self.player, self.room, self.ui, room_number=self.current_room, enemies=enemies)
-            time.sleep(0.02)
-        self.player.x = -1
-        self.renderer.render(self.player, self.room, self.ui, room_number=self.current_room, enemies=enemies)
-        time.sleep(0.3)
-
-    def death(self, entity, battle_log_lines=None, enemies=None):
-        fade_chars = ['*', '.', ' ']
-        old_char = entity.char
-        for char in fade_chars:
-            entity.char = char
+        if speed is not None:
+            self.speed = speed
+        self.timeline = AnimationTimeline(self.clock, self.speed)
+        room.timeline = self.timeline
+
+    @probed("animation")
+    def play_out(self, battle_log_lines=None, enemies=None):
+        """Draw frames until every effect on the timeline has finished."""
+        pacer = FramePacer(self.clock, self.fps)
+        while True:
             self.renderer.render(self.player, self.room, self.ui, room_number=self.current_room, battle_log_lines=battle_log_lines, enemies=enemies)
-            time.sleep(0.12)
-        entity.char = old_char
-        entity.x = -1
-        self.renderer.render(self.player, self.room, self.ui, room_number=self.current_room, battle_log_lines=battle_log_lines, enemies=enemies)
-        time.sleep(0.2)
-
-    def crit_effect(self, attacker, boss_info_lines=None, battle_log_lines=None, enemies=None):
-        y = self.room.height - 2
-        old_get_landscape_line = self.room.get_landscape_line
+            pacer.drew(self.clock.now())
+            if not self.timeline.playing(self.clock.now()):
+                break
+            self.clock.sleep(max(0.0, min(pacer.next_frame, self.timeline.end) - self.clock.now()))
 
-        def make_crit_line():
-            line = [' '] * self.room.width
-            word = 'CRIT!'
-            start = max(0, min(self.room.width - len(word), attacker.x - len(word)//2))
-            for i, ch in enumerate(word):
-                line[start + i] = ch
-            return line
+    def word_frames(self, word, entity, seconds=0.6):
+        """A word centred over an entity's head, just above the floor."""
+        start = max(0, min(self.room.width - len(word), entity.x - len(word)//2))
+        return [(seconds, [(self.room.height - 2, start, word)])]
 
-        try:
-            def patched_get_landscape_line(row):
-                if row == y:
-                    return make_crit_line()
-                else:
-                    return old_get_landscape_line(row)
-            self.room.get_landscape_line = patched_get_landscape_line
-            self.renderer.render(
-                self.player, self.room, self.ui,
-                boss_info_lines=boss_info_lines,
-                battle_log_lines=battle_log_lines,
-                room_number=self.current_room,
-                enemies=enemies
-            )
-            time.sleep(0.6)
-        finally:
-            self.room.get_landscape_line = old_get_landscape_line
-        self.renderer.render(
-            self.player, self.room, self.ui,
-            boss_info_lines=boss_info_lines,
-            battle_log_lines=battle_log_lines,
-            room_number=self.current_room,
-            enemies=enemies
-        )
-
-    def dodge_effect(self, target, boss_info_lines=None, battle_log_lines=None, enemies=None):
-        y = self.room.height - 2
-        old_get_landscape_line = self.room.get_landscape_line
+    @probed("animation")
+    def player_slide_and_disappear(self, enemies=None):
+        floor = self.room.height - 1
+        frames = [(0.02, [(floor, x, self.player.char)]) for x in range(self.player.x, WIDTH)]
+        frames.append((0.3, []))
+        self.player.x = -1
+        self.timeline.play(frames)
+        self.play_out(enemies=enemies)
 
-        def make_dodge_line():
-            line = [' '] * self.room.width
-            word = 'DODGED!'
-            start = max(0, min(self.room.width - len(word), target.x - len(word)//2))
-            for i, ch in enumerate(word):
-                line[start + i] = ch
-            return line
+    @probed("animation")
+    def death(self, entity):
+        floor = self.room.height - 1
+        x = entity.x
+        entity.x = -1
+        if 0 <= x < self.room.width:
+            self.timeline.play([(0.12, [(floor, x, char)]) for char in ('*', '.')])
 
-        try:
-            def patched_get_landscape_line(row):
-                if row == y:
-                    return make_dodge_line()
-                else:
-                    return old_get_landscape_line(row)
-            self.room.get_landscape_line = patched_get_landscape_line
-            self.renderer.render(
-                self.player, self.room, self.ui,
-                boss_info_lines=boss_info_lines,
-                battle_log_lines=battle_log_lines,
-                room_number=self.current_room,
-                enemies=enemies
-            )
-            time.sleep(0.6)
-        finally:
-            self.room.get_landscape_line = old_get_landscape_line
-        self.renderer.render(
-            self.player, self.room, self.ui,
-            boss_info_lines=boss_info_lines,
-            battle_log_lines=battle_log_lines,
-            room_number=self.current_room,
-            enemies=enemies
-        )
+    @probed("animation")
+    def crit_effect(self, attacker):
+        self.timeline.play(self.word_frames('CRIT!', attacker))
 
-    def slash(self, attacker, target=None, boss_info_lines=None, battle_log_lines=None, enemies=None):
-        y = self.room.height - 1
+    @probed("animation")
+    def dodge_effect(self, target):
+        self.timeline.play(self.word_frames('DODGED!', target))
 
+    @probed("animation")
+    def slash(self, attacker, target=None):
+        floor = self.room.height - 1
         if target is not None and attacker.x < target.x:
             frames = ['>', '>>']
             pos = attacker.x + 1
         else:
             frames = ['<<']
             pos = attacker.x - 1
+        self.timeline.play([(0.08, [(floor, pos, frame)]) for frame in frames])
 
-        old_get_landscape_line = self.room.get_landscape_line
+    @probed("animation")
+    def skill_effect(self, skill_name, attacker):
+        self.timeline.play(self.word_frames(skill_name, attacker))
 
-        def make_slash_line(frame):
-            line = [' '] * self.room.width
-            # Draw all enemies at their real positions
-            if enemies:
-                for enemy in enemies:
-                    if getattr(enemy, "dead", False):
-                        continue
-                    if 0 <= enemy.x < self.room.width:
-                        line[enemy.x] = enemy.char
-            # Draw attacker at their real position (in case attacker is not in enemies)
-            if 0 <= attacker.x < self.room.width:
-                line[attacker.x] = attacker.char
-            # Draw slash effect at desired position (use a local variable, not attacker.x)
-            if 0 <= pos < self.room.width:
-                for i, ch in enumerate(frame):
-                    if 0 <= pos + i < self.room.width:
-                        line[pos + i] = ch
-            return line
+class NullAnimations(Animations):
+    """Animations that skip drawing and waiting, for headless runs."""
+    @probed("animation")
+    def play_out(self, battle_log_lines=None, enemies=None):
+        pass
 
-        try:
-            for frame in frames:
-                def patched_get_landscape_line(row):
-                    if row == y:
-                        return make_slash_line(frame)
-                    else:
-                        return old_get_landscape_line(row)
-                self.room.get_landscape_line = patched_get_landscape_line
-                self.renderer.render(
-                    self.player, self.room, self.ui,
-                    boss_info_lines=boss_info_lines,
-                    battle_log_lines=battle_log_lines,
-                    room_number=self.current_room,
-                    enemies=enemies
-                )
-                time.sleep(0.08)
-        finally:
-            self.room.get_landscape_line = old_get_landscape_line
-        self.renderer.render(
-            self.player, self.room, self.ui,
-            boss_info_lines=boss_info_lines,
-            battle_log_lines=battle_log_lines,
-            room_number=self.current_room,
-            enemies=enemies
-        )
+    @probed("animation")
+    def player_slide_and_disappear(self, enemies=None):
+        self.player.x = -1
 
-    def skill_effect(self, skill_name, attacker, boss_info_lines=None, battle_log_lines=None, enemies=None):
-        y = self.room.height - 2  # Same as crit_effect: just above the player
-        old_get_landscape_line = self.room.get_landscape_line
+    @probed("animation")
+    def death(self, entity):
+        entity.x = -1
 
-        def make_skill_line():
-            line = [' '] * self.room.width
-            word = skill_name
-            start = max(0, min(self.room.width - len(word), attacker.x - len(word)//2))
-            for i, ch in enumerate(word):
-                line[start + i] = ch
-            return line
+    @probed("animation")
+    def crit_effect(self, attacker):
+        pass
 
-        try:
-            def patched_get_landscape_line(row):
-                if row == y:
-                    return make_skill_line()
-                else:
-                    return old_get_landscape_line(row)
-            self.room.get_landscape_line = patched_get_landscape_line
-            self.renderer.render(
-                self.player, self.room, self.ui,
-                boss_info_lines=boss_info_lines,
-                battle_log_lines=battle_log_lines,
-                room_number=self.current_room,
-                enemies=enemies
-            )
-            time.sleep(0.6)
-        finally:
-            self.room.get_landscape_line = old_get_landscape_line
-        self.renderer.render(
-            self.player, self.room, self.ui,
-            boss_info_lines=boss_info_lines,
-            battle_log_lines=battle_log_lines,
-            room_number=self.current_room,
-            enemies=enemies
-        )
+    @probed("animation")
+    def dodge_effect(self, target):
+        pass
+
+    @probed("animation")
+    def slash(self, attacker, target=None):
+        pass
+
+    @probed("animation")
+    def skill_effect(self, skill_name, attacker):
+        pass
+
+# --- Battle Scheduler ---
+class BattleScheduler:
+    """
+    Event queue for a battle, measured in ticks.
+    Each key (an attack, a timer, ...) has at most one pending tick. Rescheduling
+    a key leaves its old heap entry behind; stale entries are skipped on pop.
+    """
+    def __init__(self):
+        self.heap = []
+        self.pending = {}  # key -> tick
+        self.seq = 0
+
+    def schedule(self, tick, key):
+        self.pending[key] = tick
+        self.seq += 1
+        heapq.heappush(self.heap, (tick, self.seq, key))
+
+    def next_tick(self):
+        heap = self.heap
+        while heap:
+            tick, _, key = heap[0]
+            if self.pending.get(key) == tick:
+                return tick
+            heapq.heappop(heap)
+        return None
+
+    def cancel(self, key):
+        """Drop `key`'s pending tick, if any."""
+        self.pending.pop(key, None)
+
+    def pop_due(self, tick):
+        """Remove and return the set of keys due at or before `tick`."""
+        due = set()
+        heap = self.heap
+        while heap and heap[0][0] <= tick:
+            when, _, key = heapq.heappop(heap)
+            if self.pending.get(key) == when:
+                del self.pending[key]
+                due.add(key)
+        return due
+
+# --- Battle Log ---
+# Templates for the messages the battle writes most, formatted only when read
+LOG_DODGE = "{0} attacks {1}, but {1} dodges!"
+LOG_DODGE_HEAL = "{0} attacks {1}, but {1} dodges! {1} heals {2} HP!"
+LOG_LIFESTEAL = "{0} lifesteals {1:.0f} HP!"
+LOG_LIFESTEAL_FULL = "{0} lifesteals but is already at full HP!"
+LOG_INVINCIBLE = "{0} is INVINCIBLE and takes no damage!"
+LOG_BLEED = "{0} bleeds for 1 damage!"
+LOG_BLOODLUST = "{0} heals 1 HP from BLOODLUST!"
+LOG_REGEN = "{0} regenerates {1} HP!"
+LOG_HIT = {  # (crit, thorns) -> template
+    (False, False): "{0} hits {1} for {2:.0f} damage!",
+    (True, False): "{0} hits {1} for {2:.0f} damage (CRIT!)!",
+    (False, True): "{0} hits {1} for {2:.0f} damage! {0} takes {3:.0f} thorn damage!",
+    (True, True): "{0} hits {1} for {2:.0f} damage (CRIT!)! {0} takes {3:.0f} thorn damage!",
+}
+
+class BattleLog:
+    """
+    The last `size` battle events, as (template, args) records. Text is only
+    made when lines are read, e.g. by the renderer through `tail`.
+    """
+    size = 64
+    shown = 6  # Lines the battle screen shows
+
+    def __init__(self):
+        self.records = collections.deque(maxlen=self.size)
+        self.tail = LogTail(self, self.shown)
+
+    def add(self, template, *args):
+        self.records.append((template, args))
+
+    def append(self, text):
+        """Add a message that is already text."""
+        self.records.append((text, None))
+
+    def extend(self, records):
+        self.records.extend(records)
+
+    def lines(self, n=None):
+        """The newest `n` messages (all kept ones if None) as text, oldest first."""
+        records = self.records
+        if n is not None and n < len(records):
+            records = itertools.islice(records, len(records) - n, None)
+        return [template if args is None else template.format(*args) for template, args in records]
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.lines())
+
+class LogTail:
+    """Live view of the newest lines of a BattleLog, formatted each time it is read."""
+    __slots__ = ('log', 'n')
+
+    def __init__(self, log, n):
+        self.log = log
+        self.n = n
+
+    def __len__(self):
+        return min(self.n, len(self.log))
+
+    def __iter__(self):
+        return iter(self.log.lines(self.n))
+
+class BattleState:
+    """Everything one battle needs between ticks."""
+    def __init__(self, player, enemies):
+        self.player = player
+        self.enemies = enemies
+        self.log = BattleLog()
+        self.scheduler = BattleScheduler()
+        self.tick = 0
+        self.last_tick = -1  # Timers already move on the very first tick
+        self.elapsed = 0.0
+        self.due = set()
+        self.acted = False
+        self.skill_used = False
+        self.alive = [e for e in enemies if e.hp > 0]  # Living enemies in list order, kept up to date
+        self.living = []
+        # Skills the player can fire, paired with how to call them (passives left out)
+        self.active_skills = [(skill, SKILL_TARGETING[skill.target]) for skill in player.skills if skill.target]
+        self.ready_skills = []  # (position, skill, use) for skills off cooldown, in skill order
+        self.deadlines = {}     # timer key -> tick it runs out on
+        self.effects = {}       # effect name -> the timed_effects entry its deadline belongs to
+        self.order = {}        # enemy -> position among every enemy that joined the fight
+        self.next_attack = {player: 0.0}
+        self.bosses = [e for e in enemies if isinstance(e, (FinalBoss, RegenBoss, LifestealBoss))]
+        self.quick_step_active = False
+        self.first_attack_done = False
 
 # --- Battle System Class ---
 class Battle:
     """Handles the battle logic between two entities, using all stats."""
-    def __init__(self, renderer, ui, room):
+    time_step = 0.05  # seconds per tick
+    regen_base_interval = 6.0  # seconds for 1 regen
+    enemy_regen_speed = ENEMY_REGEN_SPEED  # Enemy regen timer seconds per second of battle
+    time_limit = None  # seconds of battle before calling it a "timeout" (None = no limit)
+    fps = 30  # target frame rate while fighting
+    boss_chance = 0.0  # shown under the enemy panel; set per battle by Game
+    animations = None     # Set by Game; benchmarks fight without them
+    announcements = None
+    probe = None          # Probe watching each battle (set by Game)
+    PHASES = (  # (phase, method) of a tick, in the order step() runs them
+        ("timers", "advance_timers"),
+        ("bosses", "update_bosses"),
+        ("skills", "use_skills"),
+        ("player_attack", "player_attack"),
+        ("enemy_attacks", "enemy_attacks"),
+        ("regen", "regenerate"),
+        ("retire", "retire_dead"),
+    )
+
+    def __init__(self, renderer, ui, room, clock=None):
         self.renderer = renderer
         self.ui = ui
         self.room = room
+        self.clock = clock or RealClock()
         self.current_room = 1  # Will be set by Game
 
-    def attack(self, attacker, defender, boss_info_lines=None, battle_log_lines=None, first_attack=False, enemies=None):
-        messages = []
+    def attack(self, attacker, defender, battle_log_lines=None, first_attack=False):
+        """Resolve one attack; returns its BattleLog records."""
+        records = self.resolve_attack(attacker, defender, battle_log_lines, first_attack)
+        if self.probe:
+            self.probe.attacked(attacker, defender, records)
+        return records
+
+    def resolve_attack(self, attacker, defender, battle_log_lines=None, first_attack=False):
+        messages = []  # BattleLog records
         # --- Heavy Hitter logic ---
         heavy_hitter_active = False
-        if first_attack and isinstance(attacker, Player) and "HeavyHitterSkill" in getattr(attacker, "permanent_skills_used", set()):
+        if first_attack and isinstance(attacker, Player) and "HeavyHitterSkill" in attacker.permanent_skills_used:
             heavy_hitter_active = True
 
         # Play slash/crit/dodge animation if available
-        if hasattr(self, 'animations') and self.animations:
+        if self.animations:
             # Dodge check first
-            if random.random() < defender.dodge_chance:
-                self.animations.dodge_effect(defender, boss_info_lines, battle_log_lines, enemies=enemies,)
-                msg = f"{attacker.char} attacks {defender.char}, but {defender.char} dodges!"
+            if rng.combat.random() < defender.dodge_chance:
+                self.animations.dodge_effect(defender)
+                record = (LOG_DODGE, (attacker.char, defender.char))
                 # Healing Dodge logic
-                if isinstance(defender, Player) and "HealingDodgeSkill" in getattr(defender, "permanent_skills_used", set()):
-                    if random.random() < 0.5:
+                if isinstance(defender, Player) and "HealingDodgeSkill" in defender.permanent_skills_used:
+                    if rng.combat.random() < 0.5:
                         healed = min(2, defender.max_hp - defender.hp)
                         defender.hp += healed
                         if healed > 0:
-                            msg += f" {defender.char} heals {healed} HP!"
+                            record = (LOG_DODGE_HEAL, (attacker.char, defender.char, healed))
                 # Counter Dodge logic...
-                return [msg]
+                return [record]
             # Crit check
             crit = False
-            if random.random() < attacker.crit_chance:
+            if rng.combat.random() < attacker.crit_chance:
                 damage = int(max(1, attacker.attack - defender.defence) * attacker.crit_damage)
                 crit = True
                 if heavy_hitter_active:
                     damage = int(damage * 1.2)
-                self.animations.crit_effect(attacker, boss_info_lines, battle_log_lines, enemies=enemies,)
+                self.animations.crit_effect(attacker)
             else:
                 damage = max(1, attacker.attack - defender.defence)
                 if heavy_hitter_active:
                     damage = int(damage * 1.2)
-                self.animations.slash(attacker, defender, boss_info_lines, battle_log_lines, enemies=enemies,)
+                self.animations.slash(attacker, defender)
         else:
             # No animations
-            if random.random() < defender.dodge_chance:
-                return [f"{attacker.char} attacks {defender.char}, but {defender.char} dodges!"]
+            if rng.combat.random() < defender.dodge_chance:
+                return [(LOG_DODGE, (attacker.char, defender.char))]
             crit = False
-            if random.random() < attacker.crit_chance:
+            if rng.combat.random() < attacker.crit_chance:
                 damage = int(max(1, attacker.attack - defender.defence) * attacker.crit_damage)
                 crit = True
                 if heavy_hitter_active:
@@ -2242,11 +3198,9 @@ class Battle:
                     damage = int(damage * 1.2)
 
         # --- Cumulative lifesteal logic ---
-        if hasattr(attacker, "lifesteal") and attacker.lifesteal > 0:
+        if attacker.lifesteal > 0:
             # Only apply to Player, not enemies
             if isinstance(attacker, Player):
-                if not hasattr(attacker, "lifesteal_pool"):
-                    attacker.lifesteal_pool = 0.0
                 attacker.lifesteal_pool += damage * attacker.lifesteal
                 healed = 0
                 while attacker.lifesteal_pool >= 1.0:
@@ -2258,9 +3212,9 @@ class Battle:
                         break
                 if battle_log_lines is not None:
                     if healed > 0:
-                        messages.append(f"{attacker.char} lifesteals {healed:.0f} HP!")
+                        messages.append((LOG_LIFESTEAL, (attacker.char, healed)))
                     elif damage * attacker.lifesteal > 0 and attacker.hp >= attacker.max_hp:
-                        messages.append(f"{attacker.char} lifesteals but is already at full HP!")
+                        messages.append((LOG_LIFESTEAL_FULL, (attacker.char,)))
             else:
                 # For enemies, keep old logic if needed
                 heal = int(damage * attacker.lifesteal)
@@ -2276,7 +3230,7 @@ class Battle:
                 del defender.timed_effects["crit_shield"]
         # --- Invincible logic ---
         if isinstance(defender, Player) and "invincible" in defender.timed_effects:
-            messages.append(f"{defender.char} is INVINCIBLE and takes no damage!")
+            messages.append((LOG_INVINCIBLE, (defender.char,)))
             return messages
 
         defender.hp -= damage
@@ -2286,313 +3240,728 @@ class Battle:
             while attacker.bleed_counter >= 15:
                 attacker.bleed_counter -= 15
                 defender.hp -= 1
-                messages.append(f"{defender.char} bleeds for 1 damage!")
+                messages.append((LOG_BLEED, (defender.char,)))
                 # Bloodlust synergy
-                if "bloodlust" in getattr(attacker, "timed_effects", {}):
+                if "bloodlust" in attacker.timed_effects:
                     healed = min(1, attacker.max_hp - attacker.hp)
                     attacker.hp += healed
                     if healed > 0:
-                        messages.append(f"{attacker.char} heals 1 HP from BLOODLUST!")
-        thorn_msg = ""
+                        messages.append((LOG_BLOODLUST, (attacker.char,)))
+        thorn_hit = 0
         if defender.thorn_damage > 0:
             thorn_hit = max(1, defender.thorn_damage - attacker.defence)
             attacker.hp -= thorn_hit
-            thorn_msg = f" {attacker.char} takes {thorn_hit:.0f} thorn damage!"
-        msg = f"{attacker.char} hits {defender.char} for {damage:.0f} damage"
-        if 'crit' in locals() and crit:
-            msg += " (CRIT!)"
-        msg += "!" + thorn_msg
-        messages.append(msg)  # The main attack message
+        # The main attack message
+        messages.append((LOG_HIT[crit, thorn_hit > 0], (attacker.char, defender.char, damage, thorn_hit)))
         return messages
 
-    def battle(self, player, enemies, running_flag):
-        animations = getattr(self, 'animations', None)
-        battle_log = []
-        player_next_attack = 0.0
-        enemy_next_attack = [0.0 for _ in enemies]
-        clock = 0.0
-        time_step = 0.05
-        regen_base_interval = 6.0  # seconds for 1 regen
+    # --- Event-driven battle loop ---
+    # The battle still runs on a grid of `time_step` ticks (so attack rates,
+    # cooldowns and regen behave exactly as before), but instead of visiting
+    # every tick it jumps straight to the next tick on which something is due.
+    # Within a tick the phases run in the same order as the old fixed-step loop:
+    # timers -> boss skills -> player skills -> player attack -> enemy attacks
+    # -> regen -> win/lose check. Drawing is paced separately (see battle()).
+
+    def tick_at(self, seconds):
+        """First tick whose clock is at or after `seconds`."""
+        return math.ceil(seconds / self.time_step - 1e-9)
+
+    def start(self, player, enemies):
+        """Set up a battle and schedule its first events. Returns the BattleState."""
+        state = BattleState(player, list(enemies))  # Retiring the dead mustn't touch the caller's list
 
         # --- Apply stat boosts ---
-        original_stats = {}
-        if hasattr(player, 'stat_boosts'):
+        # They sit on their own layer of the stat sheet until finish() takes them off
+        if player.stat_boosts:
             for stat, boost_type in player.stat_boosts.items():
-                original_stats[stat] = getattr(player, stat)
                 if boost_type == "double":
-                    setattr(player, stat, getattr(player, stat) * 2)
+                    player.sheet.boost(stat, getattr(player, stat))
                 elif boost_type == "+1":
-                    setattr(player, stat, getattr(player, stat) + 1)
+                    player.sheet.boost(stat, 1)
             player.stat_boosts.clear()
 
         # --- Quick Step logic ---
-        quick_step_active = False
-        quick_step_timer = 0.0
-        if "QuickStepSkill" in getattr(player, "permanent_skills_used", set()):
+        if "QuickStepSkill" in player.permanent_skills_used:
             player.dodge_chance = min(0.7, player.dodge_chance + 0.10)
-            quick_step_active = True
-            quick_step_timer = 5.0
-
-        first_attack_done = False
-
-        while player.hp > 0 and any(e.hp > 0 for e in enemies) and running_flag():
-            acted = False
-
-            # --- Ensure enemy_next_attack matches enemies ---
-            while len(enemy_next_attack) < len(enemies):
-                enemy_next_attack.append(clock)
-            while len(enemy_next_attack) > len(enemies):
-                enemy_next_attack.pop()
-
-            # --- SKILL USAGE (automatic) ---
-            player.update_skill_timer(time_step)
-
-            for skill in player.skills:
-                skill.cooldown_timer += time_step
-
-            # --- Timed effects update (add this here) ---
-            to_remove = []
-            for effect, data in player.timed_effects.items():
-                data["timer"] -= time_step
-                if data["timer"] <= 0:
-                    to_remove.append(effect)
-            for effect in to_remove:
-                if effect == "adrenaline":
-                    player.attack_speed -= player.timed_effects[effect]["value"]
-                del player.timed_effects[effect]
-
-            # --- Quick Step timer update ---
-            if quick_step_active:
-                quick_step_timer -= time_step
-                if quick_step_timer <= 0:
-                    player.dodge_chance = max(0.0, player.dodge_chance - 0.10)
-                    quick_step_active = False
-
-            # --- Final Boss Summon Skill & Boss Skill Animations ---
-            for enemy in enemies:
-                if isinstance(enemy, (FinalBoss, RegenBoss, LifestealBoss)):
-                    skill_msg = enemy.update(time_step, [player] + enemies, self.current_room)
-                    if skill_msg:
-                        # --- Boss skill animation ---
-                        if hasattr(self, 'animations') and self.animations:
-                            if isinstance(enemy, RegenBoss):
-                                self.animations.skill_effect(
-                                    "UNHOLY LIGHT!", enemy,
-                                    boss_info_lines=self.ui.get_enemy_stats_lines(enemy, self.room.height),
-                                    battle_log_lines=battle_log[-6:],
-                                    enemies=enemies,
-                                )
-                            elif isinstance(enemy, LifestealBoss):
-                                self.animations.skill_effect(
-                                    "VAMPIRIC STRIKE!", enemy,
-                                    boss_info_lines=self.ui.get_enemy_stats_lines(enemy, self.room.height),
-                                    battle_log_lines=battle_log[-6:],
-                                    enemies=enemies,
-                                )
-                            elif isinstance(enemy, FinalBoss):
-                                self.animations.skill_effect(
-                                    "SUMMON!", enemy,
-                                    boss_info_lines=self.ui.get_enemy_stats_lines(enemy, self.room.height),
-                                    battle_log_lines=battle_log[-6:],
-                                    enemies=enemies,
-                                )
-                        battle_log.append(skill_msg)
-            # Rebuild living_enemies and sync enemy_next_attack if new enemies were added
-            while len(enemy_next_attack) < len(enemies):
-                enemy_next_attack.append(clock)
-            while len(enemy_next_attack) > len(enemies):
-                enemy_next_attack.pop()
-            living_enemies = [e for e in enemies if e.hp > 0]
-
-            skill_log = None
-            skill_name = None
-            living_enemies = [e for e in enemies if e.hp > 0]
-            for skill in player.skills:
-                # Check if the skill is ready
-                if skill.cooldown_timer >= skill.cooldown:
-                    skill_log = None
-                    skill_name = skill.name
-                    # Use correct arguments for each skill
-                    if isinstance(skill, BigSlashSkill):
-                        skill_log = skill.use(player, living_enemies)
-                    elif isinstance(skill, DoubleAttackSkill):
-                        if living_enemies:
-                            skill_log = skill.use(player, random.choice(living_enemies))
-                    elif isinstance(skill, BlindingFlashSkill):
-                        if living_enemies:
-                            skill_log = skill.use(player, living_enemies)
-                    elif isinstance(skill, BlessingLightSkill):
-                        skill_log = skill.use(player)
-                    elif isinstance(skill, ThornBurstSkill):
-                        skill_log = skill.use(player, living_enemies)
-                    elif isinstance(skill, LuckyStrikeSkill):
-                        if living_enemies:
-                            skill_log = skill.use(player, random.choice(living_enemies))
-                    elif isinstance(skill, RegenWaveSkill):
-                        skill_log = skill.use(player)
-                    elif isinstance(skill, CritShieldSkill):
-                        skill_log = skill.use(player)
-                    elif isinstance(skill, LifestealNovaSkill):
-                        if living_enemies:
-                            skill_log = skill.use(player, living_enemies)
-                    elif isinstance(skill, InvincibleSkill):
-                        skill_log = skill.use(player)
-                    elif isinstance(skill, GoldRushSkill):
-                        skill_log = skill.use(player)
-                    elif isinstance(skill, GuaranteedCritSkill):
-                        if living_enemies:
-                            skill_log = skill.use(player, random.choice(living_enemies))
-                    elif isinstance(skill, AdrenalineRushSkill):
-                        skill_log = skill.use(player)
-                    elif isinstance(skill, JackpotSkill):
-                        skill_log = skill.use(player)
-                    elif isinstance(skill, GambleSkill):
-                        skill_log = skill.use(player)
-                    elif isinstance(skill, GlassCannonSkill):
-                        skill_log = skill.use(player)
-                    elif isinstance(skill, ClumsySwingSkill):
-                        if living_enemies:
-                            skill_log = skill.use(player, random.choice(living_enemies))
-                    elif isinstance(skill, UnstablePowerSkill):
-                        skill_log = skill.use(player)
-                    elif isinstance(skill, HemorrhageSkill):
-                        if living_enemies:
-                            skill_log = skill.use(player, random.choice(living_enemies))
-                    elif isinstance(skill, BloodlustSkill):
-                        skill_log = skill.use(player)
-                    # Add more skills here as needed
-
-                    if skill_log:
-                        if hasattr(self, 'animations') and self.animations:
-                            anim_name = skill_name.upper() + "!"
-                            self.animations.skill_effect(
-                                anim_name, player,
-                                boss_info_lines=self.ui.get_enemy_stats_lines(living_enemies[0] if living_enemies else None, self.room.height),
-                                battle_log_lines=battle_log[-6:],
-                                enemies=enemies,
-                            )
-                        battle_log.append(skill_log)
-                        acted = True
-
-            # --- Player attacks a random living enemy ---
-            if clock >= player_next_attack and living_enemies:
-                target = random.choice(living_enemies)
-                is_first_attack = not first_attack_done
-                msgs = self.attack(
-                    player, target,
-                    boss_info_lines=self.ui.get_enemy_stats_lines(target, self.room.height),
-                    battle_log_lines=battle_log[-6:],
-                    first_attack=is_first_attack,
-                    enemies=enemies
-                )
-                battle_log.extend(msgs)
-                player_next_attack += 1.0 / player.attack_speed
-                acted = True
-                if is_first_attack:
-                    first_attack_done = True
-
-            # --- Each enemy attacks independently ---
-            for idx, enemy in enumerate(enemies):
-                if hasattr(enemy, "skip_turns") and enemy.skip_turns > 0:
-                    enemy.skip_turns -= 1
-                    continue  # Skip this enemy's attack this turn
-                if enemy.hp > 0 and clock >= enemy_next_attack[idx]:
-                    msgs = self.attack(
-                        enemy, player,
-                        boss_info_lines=self.ui.get_enemy_stats_lines(enemy, self.room.height),
-                        battle_log_lines=battle_log[-6:],
-                        enemies=enemies
-                    )
-                    battle_log.extend(msgs)
-                    enemy_next_attack[idx] += 1.0 / enemy.attack_speed
-                    acted = True
-
-            # --- Regen logic ---
-            if player.health_regen > 0:
-                interval = regen_base_interval * (0.95 ** (player.health_regen - 1))
-                player.regen_timer += time_step
-                if player.regen_timer >= interval:
-                    healed = min(1, player.max_hp - player.hp)
-                    if healed > 0:
-                        player.hp += healed
-                        battle_log.append(f"{player.char} regenerates {healed} HP!")
-                    player.regen_timer = 0.0
-            for enemy in enemies:
-                if enemy.health_regen > 0 and int(clock * 10) % 10 == 0:
-                    for enemy in enemies:
-                        if not hasattr(enemy, "regen_timer"):
-                            enemy.regen_timer = 0.0
-                        if enemy.health_regen > 0:
-                            interval = regen_base_interval * (0.95 ** (enemy.health_regen - 1))
-                            enemy.regen_timer += time_step
-                            if enemy.regen_timer >= interval:
-                                healed = min(1, enemy.max_hp - enemy.hp)
-                                if healed > 0:
-                                    enemy.hp += healed
-                                    battle_log.append(f"{enemy.char} regenerates {healed} HP!")
-                                enemy.regen_timer = 0.0
-
-            # --- Render ---
-            if acted or int(clock * 10) % 2 == 0:
-                living_enemies = [e for e in enemies if e.hp > 0]
-                if living_enemies:
-                    main_enemy = max(living_enemies, key=lambda e: (e.max_hp, e.attack))
-                else:
-                    main_enemy = None
-                self.renderer.enemy = main_enemy
-                self.renderer.render(
-                    player, self.room, self.ui,
-                    boss_info_lines=self.ui.get_enemy_stats_lines(main_enemy, self.room.height),
-                    battle_log_lines=battle_log[-6:],
-                    room_number=self.current_room,
-                    enemies=enemies,
-                )
-
-            # --- Check for win/lose ---
-            if all(e.hp <= 0 for e in enemies):
-                if hasattr(self, 'animations') and self.animations:
-                    for enemy in enemies:
-                        if enemy.hp <= 0 and not getattr(enemy, "dead", False):
-                            self.animations.death(enemy, battle_log_lines=battle_log[-6:])
-                            enemy.dead = True
-                self.renderer.enemy = None
-                xp_reward = (8 + 2 * self.current_room) * max(1, len(enemies))
-                leveled_up = player.gain_xp(xp_reward)
-                if leveled_up and hasattr(self, 'announcements') and self.announcements:
-                    self.announcements.level_up_screen(player, battle_log_lines=battle_log[-6:])
-                    # --- Skill roll on level up (after stat upgrade, before loot) ---
-                    skill_chance = 0.35 + 0.01 * player.luck  # 35% base +1% per luck
-                    if random.random() < skill_chance:
-                        owned_types = {type(skill) for skill in player.skills}
-                        available_skills = [cls for cls in SKILL_POOL if cls not in owned_types]
-                        if available_skills:
-                            choices = random.sample(available_skills, min(3, len(available_skills)))
-                            self.announcements.skill_learn_screen(player, choices, battle_log_lines=battle_log[-6:])
-                if original_stats:
-                    for stat, value in original_stats.items():
-                        setattr(player, stat, value)
-                return "win", battle_log
-            if player.hp <= 0:
-                if hasattr(self, 'animations') and self.animations:
-                    self.animations.death(player)
-                return "lose", battle_log
-            time.sleep(time_step)
-            clock += time_step
-        return "lose", []
-    
+            state.quick_step_active = True
+
+        # Everybody attacks on the very first tick
+        state.scheduler.schedule(0, ("attack", player))
+        for idx, enemy in enumerate(enemies):
+            state.order[enemy] = idx
+            state.next_attack[enemy] = 0.0
+            state.scheduler.schedule(0, ("attack", enemy))
+        self.start_timers(state)
+        if self.probe:
+            self.probe.battle_started(self, state)
+        return state
+
+    # --- Timers ---
+    # Every countdown (skill cooldowns, the class skill, timed effects, Quick
+    # Step, boss skills, each entity's regen) is a single deadline tick on the
+    # scheduler, set when the timer starts. Nothing counts down tick by tick: a
+    # timer's seconds are only worked out from its deadline when a skill reads
+    # them and when the battle ends. A step only touches the timers that ran
+    # out on it.
+
+    def set_deadline(self, state, key, seconds, tick):
+        """Let timer `key` run out `seconds` after `tick`. One that already ran out fires next tick."""
+        deadline = tick + self.tick_at(seconds)
+        state.deadlines[key] = deadline
+        state.scheduler.schedule(max(deadline, tick + 1), key)
+
+    def time_left(self, state, key):
+        """Seconds until timer `key` runs out (negative once it has)."""
+        return (state.deadlines[key] - state.tick) * self.time_step
+
+    def timer_value(self, state, key, length):
+        """Seconds a timer of `length` seconds has run, as of this tick."""
+        return length - self.time_left(state, key)
+
+    def start_timers(self, state):
+        player = state.player
+        tick = state.last_tick  # Timers already move on the very first tick
+        for skill, _ in state.active_skills:
+            self.set_deadline(state, ("skill", skill), skill.cooldown - skill.cooldown_timer, tick)
+        self.set_deadline(state, "class_skill", player.skill_cooldown - player.skill_cooldown_timer, tick)
+        for effect, data in player.timed_effects.items():
+            state.effects[effect] = data
+            self.set_deadline(state, ("effect", effect), data["timer"], tick)
+        if state.quick_step_active:
+            self.set_deadline(state, "quick_step", 5.0, tick)
+        for boss in state.bosses:
+            remaining = boss.time_to_skill()
+            if remaining is not None:
+                self.set_deadline(state, ("boss", boss), remaining, tick)
+        for entity in [player] + state.enemies:
+            self.schedule_regen(state, entity, tick)
+
+    def settle_timers(self, state):
+        """Write every timer's seconds back, for the screens after the battle and the next fight."""
+        player = state.player
+        for skill, _ in state.active_skills:
+            skill.cooldown_timer = self.timer_value(state, ("skill", skill), skill.cooldown)
+        player.skill_cooldown_timer = self.timer_value(state, "class_skill", player.skill_cooldown)
+        for effect, data in state.effects.items():
+            if player.timed_effects.get(effect) is data:
+                data["timer"] = self.time_left(state, ("effect", effect))
+        for boss in state.bosses:
+            if ("boss", boss) in state.deadlines:
+                boss.skill_timer = self.timer_value(state, ("boss", boss), boss.skill_cooldown)
+        for entity in [player] + state.enemies:
+            if ("regen", entity) in state.deadlines:
+                entity.regen_timer = self.regen_interval(entity) - self.time_left(state, ("regen", entity)) * self.regen_speed(state, entity)
+
+    def regen_interval(self, entity):
+        """Seconds of regen timer per HP regenerated."""
+        return self.regen_base_interval * (0.95 ** (entity.health_regen - 1))
+
+    def regen_speed(self, state, entity):
+        return 1.0 if entity is state.player else self.enemy_regen_speed
+
+    def schedule_regen(self, state, entity, tick):
+        """Book the entity's next regen, counting on from its regen_timer at `tick`."""
+        if entity.health_regen <= 0:
+            return
+        remaining = (self.regen_interval(entity) - entity.regen_timer) / self.regen_speed(state, entity)
+        self.set_deadline(state, ("regen", entity), remaining, tick)
+
+    def step(self, state):
+        """Process the next tick with anything due. Returns "win", "lose" or None."""
+        tick = state.scheduler.next_tick()
+        if tick is None:
+            tick = state.tick + 1
+        state.tick = tick
+        state.elapsed = (tick - state.last_tick) * self.time_step
+        state.due = state.scheduler.pop_due(tick)
+        state.acted = False
+        state.skill_used = False
+
+        probe = self.probe
+        if probe is None:
+            self.advance_timers(state)
+            self.update_bosses(state)
+            self.use_skills(state)
+            self.player_attack(state)
+            self.enemy_attacks(state)
+            self.regenerate(state)
+            self.retire_dead(state)
+        else:
+            probe.enter("tick", "battle")
+            for phase, method in self.PHASES:
+                probe.enter(phase, "phase")
+                getattr(self, method)(state)
+                probe.leave(phase, "phase")
+            probe.leave("tick", "battle", {"tick": tick})
+
+        state.last_tick = tick
+        if not state.alive:
+            return "win"
+        if state.player.hp <= 0:
+            return "lose"
+        return None
+
+    def advance_timers(self, state):
+        """Handle the timers that ran out on this tick."""
+        player, due = state.player, state.due
+        for position, (skill, use_skill) in enumerate(state.active_skills):
+            if ("skill", skill) in due:
+                bisect.insort(state.ready_skills, (position, skill, use_skill))
+
+        # --- Timed effects update ---
+        for effect in [e for e in state.effects if ("effect", e) in due]:
+            data = state.effects.pop(effect)
+            if player.timed_effects.get(effect) is not data:
+                continue  # Already gone (a broken crit shield) or started over
+            if effect == "adrenaline":
+                player.attack_speed -= data["value"]
+            del player.timed_effects[effect]
+
+        # --- Quick Step timer update ---
+        if "quick_step" in due:
+            player.dodge_chance = max(0.0, player.dodge_chance - 0.10)
+            state.quick_step_active = False
+
+    def update_bosses(self, state):
+        # --- Final Boss Summon Skill & Boss Skill Animations ---
+        player, enemies, battle_log = state.player, state.enemies, state.log
+        joined = []
+        for enemy in state.bosses:
+            if ("boss", enemy) not in state.due:
+                continue
+            enemy.skill_timer = 0.0
+            self.set_deadline(state, ("boss", enemy), enemy.skill_cooldown, state.tick)
+            arena = [player] + enemies  # Bosses look for the player in here
+            skill_msg = enemy.use_timed_skill(arena, self.current_room)
+            joined.extend(arena[1 + len(enemies):])
+            if skill_msg:
+                # --- Boss skill animation ---
+                if self.animations:
+                    if isinstance(enemy, RegenBoss):
+                        anim_name = "UNHOLY LIGHT!"
+                    elif isinstance(enemy, LifestealBoss):
+                        anim_name = "VAMPIRIC STRIKE!"
+                    else:
+                        anim_name = "SUMMON!"
+                    self.animations.skill_effect(anim_name, enemy)
+                battle_log.append(skill_msg)
+                state.acted = True
+        # Summons join the fight and attack this tick
+        for enemy in joined:
+            enemies.append(enemy)
+            state.alive.append(enemy)
+            state.order[enemy] = len(state.order)
+            state.next_attack[enemy] = state.tick * self.time_step
+            state.due.add(("attack", enemy))
+            self.schedule_regen(state, enemy, state.tick)
+        if joined and self.probe:
+            self.probe.summoned(len(joined))
+
+    def use_skills(self, state):
+        player, battle_log = state.player, state.log
+        # Skills and the player's attack share one snapshot of the living enemies
+        living_enemies = state.living = state.alive
+        if not state.ready_skills:
+            return
+        # Class skills check player.can_use_skill(), so give them its timer
+        player.skill_cooldown_timer = self.timer_value(state, "class_skill", player.skill_cooldown)
+        for entry in list(state.ready_skills):
+            _, skill, use_skill = entry
+            if skill.requires_target and not living_enemies:
+                continue
+            skill.cooldown_timer = self.timer_value(state, ("skill", skill), skill.cooldown)
+            skill_timer, class_timer = skill.cooldown_timer, player.skill_cooldown_timer
+            skill_name = skill.name
+            skill_log = use_skill(skill, player, living_enemies)
+            self.restart_timers(state, entry, skill_timer, class_timer)
+
+            if skill_log:
+                if self.probe:
+                    self.probe.skill_cast(skill)
+                if self.animations:
+                    anim_name = skill_name.upper() + "!"
+                    self.animations.skill_effect(anim_name, player)
+                battle_log.append(skill_log)
+                state.acted = True
+                state.skill_used = True
+
+    def restart_timers(self, state, entry, skill_timer, class_timer):
+        """Pick up the timers a skill (re)started: its own cooldown, the class skill's and new effects."""
+        player, tick = state.player, state.tick
+        _, skill, _ = entry
+        if skill.cooldown_timer != skill_timer:
+            state.ready_skills.remove(entry)
+            self.set_deadline(state, ("skill", skill), skill.cooldown - skill.cooldown_timer, tick)
+        if player.skill_cooldown_timer != class_timer:
+            self.set_deadline(state, "class_skill", player.skill_cooldown - player.skill_cooldown_timer, tick)
+        for effect, data in player.timed_effects.items():
+            if state.effects.get(effect) is not data:
+                state.effects[effect] = data
+                self.set_deadline(state, ("effect", effect), data["timer"], tick)
+
+    def player_attack(self, state):
+        # --- Player attacks a random living enemy ---
+        player, living_enemies = state.player, state.living
+        if ("attack", player) in state.due and living_enemies:
+            target = rng.combat.choice(living_enemies)
+            is_first_attack = not state.first_attack_done
+            msgs = self.attack(
+                player, target,
+                battle_log_lines=state.log.tail,
+                first_attack=is_first_attack,
+            )
+            state.log.extend(msgs)
+            state.next_attack[player] += 1.0 / player.attack_speed
+            state.acted = True
+            state.first_attack_done = True
+        elif ("attack", player) in state.due:
+            # Nobody left to hit; stay ready for the next tick
+            state.scheduler.schedule(state.tick + 1, ("attack", player))
+            return
+        else:
+            return
+        state.scheduler.schedule(max(state.tick + 1, self.tick_at(state.next_attack[player])), ("attack", player))
+
+    def enemy_attacks(self, state):
+        # --- Each enemy attacks independently ---
+        player, due, tick = state.player, state.due, state.tick
+        attackers = [key[1] for key in due if type(key) is tuple and key[0] == "attack" and key[1] is not player]
+        if state.skill_used:
+            # Only skills stun; a stun is spent on the tick it lands
+            attackers += [e for e in state.enemies if e.skip_turns > 0]
+        for enemy in sorted(set(attackers), key=state.order.get):
+            is_due = ("attack", enemy) in due
+            if enemy.skip_turns > 0:
+                enemy.skip_turns -= 1
+                if is_due:
+                    state.scheduler.schedule(tick + 1, ("attack", enemy))
+                continue  # Skip this enemy's attack this turn
+            if not is_due or enemy.hp <= 0:
+                continue  # The dead are retired at the end of the tick
+            msgs = self.attack(enemy, player, battle_log_lines=state.log.tail)
+            state.log.extend(msgs)
+            state.next_attack[enemy] += 1.0 / enemy.attack_speed
+            state.acted = True
+            state.scheduler.schedule(max(tick + 1, self.tick_at(state.next_attack[enemy])), ("attack", enemy))
+
+    def regenerate(self, state):
+        # --- Regen logic ---
+        # Each entity has its own regen deadline, so only the ones due are touched
+        player, battle_log, tick = state.player, state.log, state.tick
+        regenerating = [key[1] for key in state.due if type(key) is tuple and key[0] == "regen"]
+        for entity in sorted(regenerating, key=lambda e: state.order.get(e, -1)):  # Player first
+            if entity is not player and entity.hp <= 0:
+                continue  # Fell this tick: retired below, not healed back up
+            healed = min(1, entity.max_hp - entity.hp)
+            if healed > 0:
+                entity.hp += healed
+                battle_log.add(LOG_REGEN, entity.char, healed)
+                state.acted = True
+            entity.regen_timer = 0.0
+            self.schedule_regen(state, entity, tick)
+
+    def retire_dead(self, state):
+        """Take enemies that fell this tick out of the fight, leaving their death animation playing."""
+        if all(e.hp > 0 for e in state.alive):
+            return
+        fallen = [e for e in state.alive if e.hp <= 0]
+        state.alive = [e for e in state.alive if e.hp > 0]
+        if not state.alive:
+            return  # The fight is won; finish() plays the last death animations
+        for enemy in fallen:
+            if self.animations:
+                self.animations.death(enemy)
+            enemy.dead = True
+            state.enemies.remove(enemy)
+            state.next_attack.pop(enemy, None)
+            for key in (("attack", enemy), ("regen", enemy), ("boss", enemy)):
+                state.scheduler.cancel(key)
+                state.deadlines.pop(key, None)
+        if any(e not in state.enemies for e in state.bosses):
+            state.bosses = [e for e in state.bosses if e in state.enemies]
+
+    def render_battle(self, state):
+        # --- Render ---
+        living_enemies = state.alive
+        if living_enemies:
+            main_enemy = max(living_enemies, key=lambda e: (e.max_hp, e.attack))
+        else:
+            main_enemy = None
+        self.renderer.enemy = main_enemy
+        if self.probe:
+            self.probe.enter("render", "phase")
+        if self.renderer.draws:  # Headless: don't build panels nobody sees
+            self.renderer.render(
+                state.player, self.room, self.ui,
+                boss_info_lines=self.ui.get_enemy_stats_lines(main_enemy, self.room.height, self.boss_chance),
+                battle_log_lines=state.log.tail,
+                room_number=self.current_room,
+                enemies=state.enemies,
+            )
+        if self.probe:
+            self.probe.leave("render", "phase")
+
+    def finish(self, state, result):
+        """Play out the end of a battle (death animations, XP, level ups)."""
+        player, enemies, battle_log = state.player, state.enemies, state.log
+        self.settle_timers(state)
+        if result == "win":
+            if self.animations:
+                for enemy in enemies:
+                    if enemy.hp <= 0 and not enemy.dead:
+                        self.animations.death(enemy)
+                        enemy.dead = True
+                self.animations.play_out(battle_log_lines=battle_log.tail, enemies=enemies)
+            self.renderer.enemy = None
+            xp_reward = (8 + 2 * self.current_room) * max(1, len(state.order))  # Summons count too
+            leveled_up = player.gain_xp(xp_reward)
+            if leveled_up and self.announcements:
+                self.announcements.level_up_screen(player, battle_log_lines=battle_log.tail)
+                # --- Skill roll on level up (after stat upgrade, before loot) ---
+                skill_chance = 0.35 + 0.01 * player.luck  # 35% base +1% per luck
+                if rng.level_up.random() < skill_chance:
+                    owned_types = {type(skill) for skill in player.skills}
+                    available_skills = [cls for cls in SKILL_POOL if cls not in owned_types]
+                    if available_skills:
+                        choices = rng.level_up.sample(available_skills, min(3, len(available_skills)))
+                        self.announcements.skill_learn_screen(player, choices, battle_log_lines=battle_log.tail)
+            for stat in player.sheet.clear_boosts():  # Level-ups won this battle stay
+                # Keep a still-running adrenaline boost; it is taken off when it expires
+                if stat == "attack_speed" and "adrenaline" in player.timed_effects:
+                    player.attack_speed += player.timed_effects["adrenaline"]["value"]
+        elif result == "lose":
+            if self.animations:
+                self.animations.death(player)
+                self.animations.play_out(battle_log_lines=battle_log.tail, enemies=enemies)
+        if self.probe:
+            self.probe.battle_finished(self, state, result)
+        return result, battle_log
+
+    def battle(self, player, enemies, running_flag, boss_chance=0.0):
+        # The fight keeps its own schedule: tick k happens k * time_step seconds
+        # after the start, no matter how long drawing takes. Frames are drawn by
+        # the pacer in the gaps between ticks and dropped when there's no time.
+        # Effects play on the animation timeline while the fight goes on; frames
+        # keep coming while one is showing and once more after the last ends.
+        # Time spent inside a step pauses the fight instead.
+        self.boss_chance = boss_chance
+        state = self.start(player, enemies)
+        pacer = FramePacer(self.clock, self.fps)
+        self.pacer = pacer
+        timeline = self.animations.timeline if self.animations else None
+        drawn_at = float('-inf')
+        tick_zero = self.clock.now()
+        while player.hp > 0 and state.alive and running_flag():
+            step_start = self.clock.now()
+            result = self.step(state)
+            tick_zero += self.clock.now() - step_start
+            if result is None and self.time_limit is not None and state.tick * self.time_step >= self.time_limit:
+                result = "timeout"  # Stalemate (e.g. regen outpacing damage)
+            if result:
+                self.render_battle(state)
+                return self.finish(state, result)
+            next_tick = state.scheduler.next_tick()
+            if next_tick is None:
+                next_tick = state.tick + 1
+            deadline = tick_zero + next_tick * self.time_step
+            dirty = True  # The last step changed what's on screen
+            while True:
+                now = self.clock.now()
+                wants_frame = dirty or (timeline is not None and drawn_at <= timeline.end)
+                if wants_frame and pacer.frame_due(now):
+                    if now < deadline:
+                        self.render_battle(state)
+                        drawn_at = now
+                        pacer.drew(self.clock.now())
+                        dirty = False
+                        continue
+                    pacer.drop(now)  # Behind schedule: keep fighting, draw later
+                if now >= deadline:
+                    break
+                wake = min(deadline, pacer.next_frame) if wants_frame else deadline
+                self.clock.sleep(wake - now)
+        self.settle_timers(state)
+        if self.probe:
+            self.probe.battle_finished(self, state, None)
+        return "lose", state.log
+
+# --- Battle Profiler ---
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+class BattleProfiler(Probe):
+    """
+    Times each phase of a battle tick and counts what happened, one report per
+    battle, from the hooks the battle calls on its probe. Time is exclusive: a
+    tick's own time leaves out the phases inside it, so the shares add up to 100%.
+    """
+    PHASES = tuple(phase for phase, _ in Battle.PHASES) + ("tick", "render")
+    LABELS = {"tick": "tick (rest)"}  # What's left of the tick once its phases are taken out
+    COUNTERS = ("attacks", "dodges", "crits", "skill_casts", "frames")
+    CRIT_TEMPLATES = {LOG_HIT[True, False], LOG_HIT[True, True]}
+    DODGE_TEMPLATES = {LOG_DODGE, LOG_DODGE_HEAL}
+    TIMED = ("phase", "battle")  # Span categories the profiler times
+
+    def __init__(self):
+        self.reports = []
+        self.samples = None  # phase -> seconds per call, for the battle being fought
+        self.counters = None
+        self.open = []  # [start, seconds spent in inner spans] of each timed span not closed yet
+
+    def battle_started(self, battle, state):
+        self.samples = {phase: [] for phase in self.PHASES}
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+
+    def enter(self, name, cat):
+        if cat in self.TIMED:
+            self.open.append([time.perf_counter(), 0.0])
+
+    def leave(self, name, cat, args=None):
+        if cat not in self.TIMED:
+            return
+        start, inner = self.open.pop()
+        elapsed = time.perf_counter() - start
+        if self.open:
+            self.open[-1][1] += elapsed
+        self.samples[name].append(elapsed - inner)
+
+    def attacked(self, attacker, defender, records):
+        counters = self.counters
+        counters["attacks"] += 1
+        for template, _ in records:
+            if template in self.DODGE_TEMPLATES:
+                counters["dodges"] += 1
+            elif template in self.CRIT_TEMPLATES:
+                counters["crits"] += 1
+
+    def skill_cast(self, skill):
+        self.counters["skill_casts"] += 1
+
+    def battle_finished(self, battle, state, result):
+        if result is None:
+            return  # Left midway, nothing worth reporting
+        self.counters["frames"] = len(self.samples["render"])
+        self.reports.append(self.battle_report(battle, state, result))
+
+    def battle_report(self, battle, state, result):
+        phases = {}
+        for phase, samples in self.samples.items():
+            ordered = sorted(samples)
+            phases[phase] = {
+                "calls": len(ordered),
+                "total": math.fsum(ordered),
+                "p50": percentile(ordered, 0.50),
+                "p95": percentile(ordered, 0.95),
+                "p99": percentile(ordered, 0.99),
+                "max": ordered[-1] if ordered else 0.0,
+            }
+        return {
+            "room": battle.current_room,
+            "result": result,
+            "ticks": len(self.samples["tick"]),
+            "battle_time": state.tick * battle.time_step,
+            "enemies": len(state.order),
+            "phases": phases,
+            "counters": dict(self.counters),
+        }
+
+    def format_report(self, report):
+        """One battle's report as text lines."""
+        phases = report["phases"]
+        busy = math.fsum(p["total"] for p in phases.values())
+        lines = [
+            f"Room {report['room']}: {report['result']} after {report['battle_time']:.1f} s, "
+            f"{report['ticks']} ticks, {report['enemies']} enemies",
+            f"  {'phase':<14} {'calls':>7} {'self ms':>9} {'share':>6} {'p50 us':>8} {'p95 us':>8} {'p99 us':>8} {'max us':>8}",
+        ]
+        for phase in self.PHASES:
+            p = phases[phase]
+            share = p["total"] / busy * 100 if busy else 0.0
+            lines.append(
+                f"  {self.LABELS.get(phase, phase):<14} {p['calls']:>7} {p['total']*1e3:>9.2f} {share:>5.1f}% "
+                f"{p['p50']*1e6:>8.1f} {p['p95']*1e6:>8.1f} {p['p99']*1e6:>8.1f} {p['max']*1e6:>8.1f}"
+            )
+        lines.append("  " + ", ".join(f"{name}: {count}" for name, count in report["counters"].items()))
+        return lines
+
+# --- Trace Export ---
+class TraceRecorder(Probe):
+    """
+    Collects a Chrome trace (about:tracing, Perfetto) of a run: spans for each
+    room, battle, battle tick, animation call and render, the time every effect
+    stays on screen, and instant events for crits, dodges, summons and level-ups.
+    It hears about all of them through the same probe hooks as BattleProfiler.
+    Times come from the game's clock, so a headless run is traced in game time
+    (only its sleeps take any).
+    """
+    GAME_THREAD = 1
+    EFFECTS_THREAD = 2  # Effects play on the timeline while the game goes on, so they get their own row
+
+    def __init__(self):
+        self.clock = None
+        self.start = 0.0  # Clock reading at which the trace began
+        self.events = [
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": self.GAME_THREAD, "args": {"name": "game"}},
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": self.EFFECTS_THREAD, "args": {"name": "effects"}},
+        ]
+        self.room = None  # (room number, start) of the room span still open
+        self.battle = None  # Start of the battle span still open
+        self.open = []  # (name, cat, start) of each span not closed yet
+
+    def use_clock(self, clock):
+        """Time the trace by `clock` from here on."""
+        # A restart brings a new clock (a virtual one starts again at 0), so carry the trace on from here
+        self.start = clock.now() - self.now() / 1e6
+        self.clock = clock
+        return self
+
+    def now(self):
+        """Microseconds since the recorder started."""
+        return self.stamp(self.clock.now()) if self.clock else 0.0
+
+    def stamp(self, seconds):
+        """Trace timestamp, in microseconds, of a reading of the game's clock."""
+        return (seconds - self.start) * 1e6
+
+    def span(self, name, cat, ts, dur, args=None, tid=GAME_THREAD):
+        event = {"name": name, "cat": cat, "ph": "X", "ts": ts, "dur": dur, "pid": 1, "tid": tid}
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    def instant(self, name, cat, args=None):
+        event = {"name": name, "cat": cat, "ph": "i", "s": "t", "ts": self.now(), "pid": 1, "tid": self.GAME_THREAD}
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    def enter_room(self, room_number):
+        """Close the current room's span and open one for `room_number`."""
+        self.leave_room()
+        self.room = (room_number, self.now())
+
+    def leave_room(self):
+        if self.room is not None:
+            room_number, start = self.room
+            self.span(f"room {room_number}", "room", start, self.now() - start, {"room": room_number})
+            self.room = None
+
+    # --- Probe hooks ---
+    def enter(self, name, cat):
+        if cat != "phase":  # Tick phases are the profiler's business
+            self.open.append((name, cat, self.now()))
+
+    def leave(self, name, cat, args=None):
+        if cat != "phase":
+            name, cat, start = self.open.pop()
+            self.span(name, cat, start, self.now() - start, args)
+
+    def battle_started(self, battle, state):
+        self.battle = self.now()
+
+    def battle_finished(self, battle, state, result):
+        if self.battle is not None:
+            self.span("battle", "battle", self.battle, self.now() - self.battle)
+            self.battle = None
+
+    def attacked(self, attacker, defender, records):
+        for template, _ in records:
+            if template in BattleProfiler.DODGE_TEMPLATES:
+                self.instant("dodge", "combat", {"attacker": attacker.char, "defender": defender.char})
+            elif template in BattleProfiler.CRIT_TEMPLATES:
+                self.instant("crit", "combat", {"attacker": attacker.char, "defender": defender.char})
+
+    def summoned(self, count):
+        self.instant("summon", "combat", {"joined": count})
+
+    def effect(self, track):
+        # Named after the animation playing it (e.g. "slash" for Animations.slash)
+        name = next((span[0].rsplit(".", 1)[-1] for span in reversed(self.open) if span[1] == "animation"), "effect")
+        self.span(name, "effect", self.stamp(track.start), (track.end - track.start) * 1e6, tid=self.EFFECTS_THREAD)
+
+    def level_up(self, player):
+        self.instant("level up", "player", {"level": player.level})
+
+    def save(self, path):
+        """Write the trace as JSON, closing the room still open."""
+        self.leave_room()
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
 # --- Main Game Loop ---
 class Game:
     """Main game class. Manages game state and runs the main loop."""
-    def __init__(self):
+    def __init__(self, headless=False, autoplay=False, single_run=False, job=None, battle_time_limit=None, clock=None, renderer=None, seed=None, fps=None, animation_speed=None, profile=False, trace=False, input_backend=None, record=False):
+        """
+        headless: no drawing, no animations and a virtual clock that never sleeps.
+        autoplay: start in autoplay mode, skipping every prompt.
+        single_run: stop after one run (death or final boss) instead of restarting.
+        job: class name autoplay picks on the job screen (default Fighter).
+        battle_time_limit: end battles that last longer than this many seconds as a "timeout" loss.
+        clock/renderer: override the clock or renderer picked by `headless`.
+        seed: run seed for the random streams (random if None); the same seed replays the same run.
+        fps: target frame rate during battles (default Battle.fps).
+        animation_speed: how fast effects play, 0 for instant (default Animations.speed).
+        profile: time each phase of every battle tick; reports collect in self.profiler.reports.
+        trace: record a Chrome trace of the run in self.tracer (save it with self.tracer.save(path)).
+        input_backend: where keys come from (default: the terminal, or no keys when headless).
+            A ReplayInputBackend also supplies the seed of each run it replays.
+        record: note each run's seed and the keys it reads in self.recording (an InputRecording).
+        """
+        # Keep the input backend across restarts (a reset runs __init__ again)
+        backend = getattr(getattr(self, "input_handler", None), "backend", None) or input_backend
+        if seed is None and isinstance(backend, ReplayInputBackend):
+            seed = backend.next_seed()
+        self.options = dict(
+            headless=headless, autoplay=autoplay, single_run=single_run, job=job,
+            battle_time_limit=battle_time_limit, clock=clock, renderer=renderer, seed=seed, fps=fps,
+            animation_speed=animation_speed, profile=profile, trace=trace,
+            input_backend=input_backend, record=record,
+        )
+        self.seed = rng.seed(seed)
+        self.headless = headless
+        self.single_run = single_run
+        self.job = job
+        self.clock = clock or (VirtualClock() if headless else RealClock())
         self.player = Player(x=PLAYER_START_X)
         self.room = Room(WIDTH, HEIGHT)
         self.ui = UI()
-        self.renderer = Renderer(WIDTH, HEIGHT)
-        self.input_handler = InputHandler()
-        self.announcements = Announcements(self.renderer, self.ui, self.room, self.player, self.input_handler)
-        self.animations = Animations(self.renderer, self.room, self.ui, self.player)
-        self.battle_system = Battle(self.renderer, self.ui, self.room)
+        self.renderer = renderer or (NullRenderer(WIDTH, HEIGHT) if headless else DiffRenderer(WIDTH, HEIGHT))
+        if isinstance(backend, NullInputBackend):
+            backend = None  # Nothing to keep, and its waits belong on this run's clock
+        elif isinstance(backend, RecordingInputBackend) and isinstance(backend.backend, NullInputBackend):
+            backend.backend = NullInputBackend(self.clock)
+        backend = backend or (NullInputBackend(self.clock) if headless else default_input_backend(self.clock))
+        if record and not isinstance(backend, RecordingInputBackend):
+            backend = RecordingInputBackend(backend, InputRecording(dict(
+                autoplay=autoplay, single_run=single_run, job=job, battle_time_limit=battle_time_limit)))
+        self.recording = backend.recording if record else None
+        if self.recording:
+            self.recording.start_run(self.seed, self.clock)
+        self.input_handler = InputHandler(backend)
+        self.announcements = Announcements(self.renderer, self.ui, self.room, self.player, self.input_handler, clock=self.clock)
+        animations_cls = NullAnimations if headless else Animations
+        self.animations = animations_cls(self.renderer, self.room, self.ui, self.player, clock=self.clock, speed=animation_speed)
+        self.battle_system = Battle(self.renderer, self.ui, self.room, clock=self.clock)
+        self.battle_system.time_limit = battle_time_limit
+        if fps:
+            self.battle_system.fps = fps
+            self.animations.fps = fps
         self.battle_system.animations = self.animations
+        # Keep one profiler across restarts (a reset runs __init__ again)
+        profiler = getattr(self, "profiler", None)
+        self.profiler = (profiler or BattleProfiler()) if profile else None
+        tracer = getattr(self, "tracer", None)
+        self.tracer = (tracer or TraceRecorder()).use_clock(self.clock) if trace else None
+        # Both watch the game through the same hooks
+        self.probe = combine_probes(self.profiler, self.tracer)
+        for watched in (self.renderer, self.battle_system, self.animations, self.animations.timeline, self.announcements):
+            watched.probe = self.probe
         self.announcements.game = self
         self.battle_system.announcements = self.announcements  # <-- Add this line
         self.enemy = None
@@ -2608,7 +3977,8 @@ class Game:
         self.encountered_events = set()
         self.endless_loops = 0
         self.difficulty_multiplier = 1.0
-        self.autoplay = False
+        self.autoplay = autoplay
+        self.last_run = None  # Summary of the last finished run (see finish_run)
         
         # Link room number to other classes
         self.announcements.current_room = self.current_room
@@ -2637,8 +4007,9 @@ class Game:
         enemies = []
         room = self.current_room
         # Main enemy (always strongest, at current room level)
-        main_enemy_type = random.choice(['basic', 'speedy', 'tough', 'brute'])
-        main_enemy = Enemy(x=(WIDTH * 3) // 4, enemy_type=main_enemy_type, room_number=room)
+        main_enemy_type = rng.spawning.choice(ENEMY_TYPES)
+        main_enemy = Enemy(x=(WIDTH * 3) // 4, enemy_type=main_enemy_type, room_number=room,
+                           difficulty_multiplier=self.difficulty_multiplier)
         enemies.append(main_enemy)
 
         # Only add extra enemies for rooms > 10
@@ -2654,23 +4025,15 @@ class Game:
                 max_extra = 4
             for i in range(1, max_extra + 1):
                 chance = min(0.04 * (room - 10), 0.40)  # 4% per room after 10, capped at 40%
-                if random.random() < chance:
+                if rng.spawning.random() < chance:
                     weaker_room = max(1, room - 2 * i)
-                    enemy_type = random.choice(['basic', 'speedy', 'tough', 'brute'])
+                    enemy_type = rng.spawning.choice(ENEMY_TYPES)
                     x_pos = (WIDTH * 3) // 4 - i * 2
-                    extra_enemy = Enemy(x_pos, enemy_type=enemy_type, room_number=weaker_room)
-                    extra_enemy.hp = max(1, int(extra_enemy.hp * 0.6))
-                    extra_enemy.max_hp = extra_enemy.hp
-                    extra_enemy.attack = max(1, int(extra_enemy.attack * 0.7))
+                    extra_enemy = Enemy(x_pos, enemy_type=enemy_type, room_number=weaker_room,
+                                        difficulty_multiplier=self.difficulty_multiplier, role='extra')
                     enemies.append(extra_enemy)
                 else:
                     break  # Stop rolling if one fails
-        for enemy in enemies:
-            enemy.hp = int(enemy.hp * self.difficulty_multiplier)
-            enemy.max_hp = enemy.hp
-            enemy.attack = int(enemy.attack * self.difficulty_multiplier)
-            enemy.defence = int(enemy.defence * self.difficulty_multiplier)
-            enemy.health_regen = int(enemy.health_regen * self.difficulty_multiplier)
 
         self.enemies = enemies
         self.enemy = enemies[0]  # For compatibility with old code
@@ -2706,19 +4069,17 @@ class Game:
                 self.player = Paladin(x=PLAYER_START_X)
             self.reset_player_position()
 
-            # --- Autoplay prompt ---
-            self.autoplay = False
+            # --- Autoplay prompt (skipped when autoplay was requested up front) ---
+            self.autoplay = self.options["autoplay"]
             lines = ["Enable AUTOPLAY mode?", "Press Y for autoplay, SPACE for manual."]
-            self.renderer.render(self.player, self.room, self.ui, intro_message="\n".join(lines), room_number=self.current_room)
-            while True:
-                if msvcrt.kbhit():
-                    key = msvcrt.getch()
-                    if key in [b'y', b'Y']:
-                        self.autoplay = True
-                        break
-                    elif key == b' ':
-                        break
-                time.sleep(0.08)
+            while not self.autoplay:
+                self.renderer.render(self.player, self.room, self.ui, intro_message="\n".join(lines), room_number=self.current_room)
+                key = self.input_handler.wait_key(self.renderer, self.room.timeline)
+                if key in [b'y', b'Y']:
+                    self.autoplay = True
+                    break
+                elif key == b' ':
+                    break
 
             self.current_room = 1  # Reset room counter on new game
             self.final_boss_ready = False
@@ -2743,10 +4104,12 @@ class Game:
 
             while self.running:
                 self.current_room += 1
+                if self.probe:
+                    self.probe.enter_room(self.current_room)
 
                 # --- SHOP LOGIC: Only after room 5 ---
                 if self.current_room > 5:
-                    if random.random() < self.shop_probability:
+                    if rng.events.random() < self.shop_probability:
                         self.show_shop()
                         self.shop_probability = 0.0
                     else:
@@ -2764,17 +4127,17 @@ class Game:
                             self.final_boss_ready = True
                             self.boss_probability = 0.0  # Reset boss chance for final boss
                         # Final boss logic (like regular bosses, but only after countdown)
-                        if self.final_boss_ready and random.random() < self.boss_probability:
+                        if self.final_boss_ready and rng.spawning.random() < self.boss_probability:
                             boss_room = True
                             boss_to_spawn = FinalBoss
                             self.boss_probability = 0.0
                     elif len(self.bosses_defeated) < len(self.boss_classes):
-                        if random.random() < self.boss_probability:
+                        if rng.spawning.random() < self.boss_probability:
                             boss_room = True
                             available_bosses = [b for b in self.boss_classes if b not in self.bosses_encountered]
                             if not available_bosses:
                                 available_bosses = [b for b in self.boss_classes if b not in self.bosses_defeated]
-                            boss_to_spawn = random.choice(available_bosses)
+                            boss_to_spawn = rng.spawning.choice(available_bosses)
                             self.bosses_encountered.add(boss_to_spawn)
                             self.boss_probability = 0.0  # Only reset here!
                 else:
@@ -2806,7 +4169,7 @@ class Game:
                         event_base_chance = 0.08
                         luck_bonus = (self.player.luck // 2) * 0.01  # +1% per 2 luck
                         event_chance = event_base_chance + luck_bonus
-                        if random.random() < event_chance:
+                        if rng.events.random() < event_chance:
                             self.event_rooms.random_event()
                             self.animations.player_slide_and_disappear()
                             continue  # Skip battle for this room, go to next
@@ -2825,7 +4188,7 @@ class Game:
                 if self.input_handler.quit:
                     return
 
-                result, battle_log = self.battle_system.battle(self.player, self.enemies, lambda: self.running)
+                result, battle_log = self.battle_system.battle(self.player, self.enemies, lambda: self.running, self.boss_probability)
 
                 if result == "win":
                     # --- Mark boss as defeated if this was a boss room ---
@@ -2837,10 +4200,13 @@ class Game:
                     
                     # Check for final boss defeat and handle win/endless
                     if boss_room and boss_to_spawn == FinalBoss:
+                        if self.single_run:
+                            self.finish_run("win")
+                            return
                         if self.endless_loops == 0:
                             choice = self.announcements.show_win_screen()
                             if choice == "reset":
-                                self.__init__()
+                                self.__init__(**dict(self.options, seed=None))  # New run, new seed
                                 break  # Exit inner loop, restart game
                             elif choice == "endless":
                                 self.bosses_defeated.clear()
@@ -2866,27 +4232,24 @@ class Game:
                     base_chance = 0.20
                     luck_bonus = (self.player.luck // 2) * 0.01  # +1% per 2 luck
                     loot_chance = base_chance + luck_bonus
-                    loot_chance += getattr(self.player, "loot_chance_bonus", 0.0)
+                    loot_chance += self.player.loot_chance_bonus
 
                     found_items = []
-                    if random.random() < loot_chance:
-                        potion_class = random.choice(HealingPotion.potion_classes)
+                    if rng.loot.random() < loot_chance:
+                        potion_class = rng.loot.choice(HealingPotion.potion_classes)
                         found_items.append(potion_class())
-                    if random.random() < loot_chance:
-                        eq_class = random.choice(Equipment.equipment_classes)
+                    if rng.loot.random() < loot_chance:
                         max_eq_level = 1 + (self.current_room // 10)
-                        eq_level = random.randint(1, max_eq_level)
-                        eq_tier = random_tier(self.player.luck)
-                        found_items.append(eq_class(level=eq_level, tier=eq_tier))
+                        found_items.extend(roll_equipment(self.player.luck, max_eq_level))
                     
                     # --- Gold reward ---
                     gold_chance = 0.35 + 0.01 * self.player.luck  # 30% base +1% per luck
-                    if random.random() < gold_chance:
-                        gold_earned = random.randint(1, 3)
+                    if rng.loot.random() < gold_chance:
+                        gold_earned = rng.loot.randint(1, 3)
                         self.player.gold += gold_earned
                         found_items.append(type("Gold", (), {"name": f"{gold_earned} gold"})())
                     if found_items:
-                        self.announcements.loot_screen(found_items, battle_log_lines=battle_log[-6:])
+                        self.announcements.loot_screen(found_items, battle_log_lines=battle_log.tail)
                         for item in found_items:
                             if isinstance(item, Potion):
                                 for i in range(4):
@@ -2908,30 +4271,47 @@ class Game:
                     self.announcements.current_room = self.current_room
                     self.animations.current_room = self.current_room
                     self.battle_system.current_room = self.current_room
-                    self.announcements.win(battle_log_lines=battle_log[-6:])
+                    self.announcements.win(battle_log_lines=battle_log.tail)
                     self.animations.player_slide_and_disappear()
                 else:
                     self.announcements.lose(self.enemy)
-                    self.__init__()
+                    if self.single_run:
+                        self.finish_run(result)
+                        return
+                    self.__init__(**dict(self.options, seed=None))  # New run, new seed
                     break
 
                 if self.input_handler.quit:
                     return
 
+    def finish_run(self, result):
+        """Record a summary of the finished run and stop the main loop."""
+        self.last_run = {
+            "result": result,
+            "seed": self.seed,
+            "job": type(self.player).__name__,
+            "room": self.current_room,
+            "level": self.player.level,
+            "bosses_defeated": len(self.bosses_defeated),
+            "game_time": self.clock.now() if self.headless else None,
+        }
+        self.running = False
+        return self.last_run
+
     def show_shop(self):
-        healing_potion_cls = random.choice([SmallHealingPotion, MediumHealingPotion, MaxHealingPotion])
+        healing_potion_cls = rng.loot.choice([SmallHealingPotion, MediumHealingPotion, MaxHealingPotion])
         healing_prices = {SmallHealingPotion: 5, MediumHealingPotion: 10, MaxHealingPotion: 15}
         healing_price = healing_prices[healing_potion_cls]
         healing_potion = healing_potion_cls()
 
-        stat_potion_cls = random.choice([
+        stat_potion_cls = rng.loot.choice([
             AttackPotion, DefencePotion, AttackSpeedPotion, CritChancePotion,
             CritDamagePotion, ThornPotion, LifestealPotion, DodgePotion, RegenPotion
         ])
         stat_potion = stat_potion_cls()
         stat_price = 10
 
-        eq_class = random.choice(Equipment.equipment_classes)
+        eq_class = rng.loot.choice(Equipment.equipment_classes)
         eq_level = max(1, self.current_room // 10)
         eq_tier = random_tier(self.player.luck)
         eq_item = eq_class(level=eq_level, tier=eq_tier)
@@ -2963,40 +4343,410 @@ class Game:
             self.renderer.render(self.player, self.room, self.ui, intro_message=message, room_number=self.current_room)
             # --- Input handling ---
             while True:
-                if msvcrt.kbhit():
-                    key = msvcrt.getch()
-                    if key in [b'1', b'2', b'3', b'4']:
-                        idx = int(key) - 1
-                        item, price = shop_items[idx]
-                        if self.player.gold >= price:
-                            self.player.gold -= price
-                            # Give item to player, using the same logic as loot
-                            if isinstance(item, Potion):
-                                for i in range(4):
-                                    if self.player.potions[i] is None:
-                                        self.player.potions[i] = item
-                                        break
-                            elif isinstance(item, Equipment):
-                                for i in range(4):
-                                    if self.player.equipment_items[i] is None:
-                                        self.player.equipment_items[i] = item
-                                        self.player.equip(item)
-                                        break
-                            else:
-                                # All slots full, prompt
-                                self.announcements.equipment_pickup_prompt(self.player, item)
-                            self.announcements.wait_for_space(f"You bought {item.name}!", show_player=True, room_number=self.current_room)
+                key = self.input_handler.wait_key(self.renderer, self.room.timeline)
+                if key is None:
+                    break  # Resized: draw the shop again
+                if key in [b'1', b'2', b'3', b'4']:
+                    idx = int(key) - 1
+                    item, price = shop_items[idx]
+                    if self.player.gold >= price:
+                        self.player.gold -= price
+                        # Give item to player, using the same logic as loot
+                        if isinstance(item, Potion):
+                            for i in range(4):
+                                if self.player.potions[i] is None:
+                                    self.player.potions[i] = item
+                                    break
+                        elif isinstance(item, Equipment):
+                            for i in range(4):
+                                if self.player.equipment_items[i] is None:
+                                    self.player.equipment_items[i] = item
+                                    self.player.equip(item)
+                                    break
                         else:
-                            self.announcements.wait_for_space("Not enough gold!", show_player=True, room_number=self.current_room)
-                        break  # Re-render shop after purchase or error
-                    elif key == b' ':
-                        return  # Exit shop
-                time.sleep(0.08)
-
-if __name__ == "__main__":
-    print('\033[?25l', end='')
+                            # All slots full, prompt
+                            self.announcements.equipment_pickup_prompt(self.player, item)
+                        self.announcements.wait_for_space(f"You bought {item.name}!", show_player=True, room_number=self.current_room)
+                    else:
+                        self.announcements.wait_for_space("Not enough gold!", show_player=True, room_number=self.current_room)
+                    break  # Re-render shop after purchase or error
+                elif key == b' ':
+                    return  # Exit shop
+
+# --- Monte Carlo Simulation ---
+JOB_NAMES = ["Fighter", "Assassin", "Paladin"]
+SIMULATION_BATTLE_TIME_LIMIT = 600.0  # seconds; longer battles are stalemates
+
+def simulate_run(seed, job_class="Fighter"):
+    """Play one headless autoplay run with the given seed and return its summary."""
+    game = Game(headless=True, autoplay=True, single_run=True, job=job_class,
+                battle_time_limit=SIMULATION_BATTLE_TIME_LIMIT, seed=seed)
+    start = time.perf_counter()
+    game.run()
+    summary = dict(game.last_run)
+    summary["wall_time"] = time.perf_counter() - start
+    return summary
+
+def replay_session(recording, **options):
+    """
+    Play a recorded session again through the same menus and battles, headless
+    and without sleeping, until its keys run out or it ends. Returns the Game;
+    game.last_run summarizes the run the replay stopped in.
+    """
+    game = Game(headless=True, input_backend=ReplayInputBackend(recording), **dict(recording.options, **options))
     try:
-        game = Game()
         game.run()
+    except ReplayEnded:
+        pass
+    if game.last_run is None:
+        game.finish_run("lose" if game.player.hp <= 0 else "quit")
+    return game
+
+def simulate(runs, jobs=1, job_class="Fighter", seed=0):
+    """
+    Play `runs` headless autoplay runs across `jobs` worker processes.
+    Run i always uses seed `seed + i`, so results don't depend on how runs
+    are spread over the workers, and two builds simulated with the same base
+    seed see the same dungeons (common random numbers).
+    """
+    seeds = [seed + i for i in range(runs)]
+    if jobs <= 1:
+        return [simulate_run(s, job_class) for s in seeds]
+    chunksize = max(1, runs // (jobs * 8))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(simulate_run, seeds, [job_class] * runs, chunksize=chunksize))
+
+def simulation_report(results, wall_time=None):
+    """Format win rate, room reached, bosses defeated and timings as text lines."""
+    n = len(results)
+    if n == 0:
+        return ["No runs."]
+    outcomes = {}
+    for r in results:
+        outcomes[r["result"]] = outcomes.get(r["result"], 0) + 1
+    wins = outcomes.get("win", 0)
+    win_rate = wins / n
+    # 95% normal-approximation interval for the win rate
+    margin = 1.96 * math.sqrt(win_rate * (1 - win_rate) / n)
+    rooms = sorted(r["room"] for r in results)
+    lines = [
+        f"Runs: {n} ({results[0]['job']})",
+        f"Win rate: {win_rate*100:.2f}% +/- {margin*100:.2f}%  " + ", ".join(f"{k}: {v}" for k, v in sorted(outcomes.items())),
+        f"Room reached: mean {sum(rooms)/n:.1f}, median {rooms[n//2]}, min {rooms[0]}, max {rooms[-1]}",
+    ]
+    # Room distribution in buckets of 5 rooms
+    lines.append("Room distribution:")
+    buckets = {}
+    for room in rooms:
+        buckets[(room - 1) // 5] = buckets.get((room - 1) // 5, 0) + 1
+    for bucket in range(min(buckets), max(buckets) + 1):
+        count = buckets.get(bucket, 0)
+        label = f"{bucket*5+1}-{bucket*5+5}"
+        lines.append(f"  {label:>9} {count:>7} {count/n*100:6.2f}% " + "#" * int(round(count / n * 50)))
+    lines.append("Bosses defeated:")
+    bosses = {}
+    for r in results:
+        bosses[r["bosses_defeated"]] = bosses.get(r["bosses_defeated"], 0) + 1
+    for count_defeated in sorted(bosses):
+        lines.append(f"  {count_defeated:>9} {bosses[count_defeated]:>7} {bosses[count_defeated]/n*100:6.2f}%")
+    run_times = [r["wall_time"] for r in results]
+    game_times = [r["game_time"] for r in results]
+    lines.append(f"Time per run: {sum(run_times)/n*1000:.2f} ms (game time {sum(game_times)/n:.0f} s)")
+    if wall_time is not None:
+        lines.append(f"Wall time: {wall_time:.2f} s ({n/wall_time:.1f} runs/s)")
+    return lines
+
+# --- Benchmarks ---
+BENCH_BASELINE_FILE = "bench_baseline.json"
+BENCH_THRESHOLD = 0.25  # A benchmark this much slower than its baseline is a regression
+BENCH_MIN_TIME = 0.2  # seconds each timing round runs for at least
+
+def bench_render():
+    """A full frame through the plain renderer, which redraws everything each time."""
+    stream = io.StringIO()
+    renderer = Renderer(WIDTH, HEIGHT, stream=stream)
+    room, ui = Room(WIDTH, HEIGHT), UI()
+    player = Fighter(x=PLAYER_START_X)
+    enemy = Enemy((WIDTH * 3) // 4, enemy_type="tough", room_number=20)
+    log = BattleLog()
+    for i in range(log.size):
+        log.add(LOG_HIT[(i % 3 == 0, i % 5 == 0)], "@", "O", i, 1)
+    boss_info_lines = ui.get_enemy_stats_lines(enemy, HEIGHT)
+
+    def run():
+        stream.seek(0)
+        stream.truncate()
+        renderer.render(player, room, ui, boss_info_lines=boss_info_lines, battle_log_lines=log.tail,
+                        room_number=20, enemies=[enemy])
+
+    def extra():
+        return {"bytes": renderer.stats.bytes / max(1, renderer.stats.frames)}
+    return run, extra
+
+def bench_battle_tick(count):
+    """One battle step against `count` enemies that never die."""
+    rng.seed(0)
+    battle = Battle(NullRenderer(WIDTH, HEIGHT), UI(), Room(WIDTH, HEIGHT), clock=VirtualClock())
+    player = Fighter(x=PLAYER_START_X)
+    player.max_hp = player.hp = 10**9
+    enemies = [Enemy((WIDTH * 3) // 4 - i % 10, rng.spawning.choice(ENEMY_TYPES), 20) for i in range(count)]
+    for enemy in enemies:
+        enemy.max_hp = enemy.hp = 10**9
+    state = battle.start(player, enemies)
+
+    def run():
+        battle.step(state)
+    return run, None
+
+def bench_attack():
+    """Battle.attack between a player and an enemy, without animations."""
+    rng.seed(0)
+    battle = Battle(NullRenderer(WIDTH, HEIGHT), UI(), Room(WIDTH, HEIGHT), clock=VirtualClock())
+    player = Fighter(x=PLAYER_START_X)
+    enemy = Enemy((WIDTH * 3) // 4, enemy_type="tough", room_number=20)
+    log = BattleLog()
+
+    def run():
+        player.hp = player.max_hp
+        enemy.hp = enemy.max_hp
+        log.extend(battle.attack(player, enemy, battle_log_lines=log.tail))
+    return run, None
+
+def bench_spawn(room_number):
+    """Game.spawn_enemies for one room."""
+    rng.seed(0)
+    game = Game(headless=True, autoplay=True, seed=0)
+    game.current_room = room_number
+
+    def run():
+        game.spawn_enemies()
+    return run, None
+
+def bench_equip():
+    """Equipping and unequipping one item."""
+    player = Fighter(x=PLAYER_START_X)
+    item = Ring(level=3, tier="Rare")
+
+    def run():
+        player.equip(item)
+        player.unequip(item)
+    return run, None
+
+def bench_random_tier():
+    """Drawing one equipment tier."""
+    rng.seed(0)
+
+    def run():
+        random_tier(5)
+    return run, None
+
+def bench_entity_memory(make, count=1000):
+    """Building one object with `make`; also reports the bytes each one keeps allocated."""
+    make()  # Warm any caches the constructor fills, so they aren't counted
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = [make() for _ in range(count)]
+        allocated = tracemalloc.get_traced_memory()[0] - before
     finally:
-        print('\033[?25h', end='')
\ No newline at end of file
+        tracemalloc.stop()
+    del kept
+
+    def run():
+        make()
+
+    def extra():
+        return {"alloc": allocated / count}
+    return run, extra
+
+def bench_attribute_reads():
+    """Reading five stats off an Enemy, as the battle loop does for every attack."""
+    enemy = Enemy((WIDTH * 3) // 4, enemy_type="tough", room_number=20)
+
+    def run():
+        enemy.attack; enemy.defence; enemy.crit_chance; enemy.dodge_chance; enemy.hp
+    return run, None
+
+def bench_headless_run():
+    """A whole headless autoplay run (seed 0)."""
+    def run():
+        simulate_run(0)
+    return run, None
+
+BENCHMARKS = [
+    ("render.full_frame", bench_render),
+    ("battle.tick.1", lambda: bench_battle_tick(1)),
+    ("battle.tick.5", lambda: bench_battle_tick(5)),
+    ("battle.tick.50", lambda: bench_battle_tick(50)),
+    ("battle.attack", bench_attack),
+    ("spawn.room.1", lambda: bench_spawn(1)),
+    ("spawn.room.50", lambda: bench_spawn(50)),
+    ("spawn.room.500", lambda: bench_spawn(500)),
+    ("player.equip_unequip", bench_equip),
+    ("loot.random_tier", bench_random_tier),
+    ("run.headless", bench_headless_run),
+    ("memory.player", lambda: bench_entity_memory(lambda: Fighter(x=PLAYER_START_X))),
+    ("memory.enemy", lambda: bench_entity_memory(lambda: Enemy((WIDTH * 3) // 4, enemy_type="tough", room_number=20))),
+    ("memory.sword", lambda: bench_entity_memory(lambda: Sword(level=3, tier="Rare"))),
+    ("entity.attribute_reads", bench_attribute_reads),
+]
+
+def time_benchmark(make, repeat=5, min_time=BENCH_MIN_TIME):
+    """
+    Seconds per call of the benchmark built by `make`: the best of `repeat`
+    rounds, each looping long enough to last at least `min_time`. Also returns
+    any extra figures the benchmark reports.
+    """
+    run, extra = make()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed * 1.2)))
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best, extra() if extra else {}
+
+def run_benchmarks(names=None, repeat=5, min_time=BENCH_MIN_TIME):
+    """
+    Time the benchmarks picked by `names` (all if None). A name picks the
+    benchmarks it matches whole dotted parts of: "tick" runs battle.tick.1,
+    .5 and .50, "tick.5" only battle.tick.5. Returns {name: result}.
+    """
+    results = {}
+    for name, make in BENCHMARKS:
+        if names and not any(f".{part}." in f".{name}." for part in names):
+            continue
+        seconds, extra = time_benchmark(make, repeat, min_time)
+        results[name] = dict(extra, seconds=seconds)
+    rng.seed(None)  # Don't leave the streams on a benchmark seed
+    return results
+
+def load_baseline(path):
+    """Stored benchmark results ({} if there is no baseline yet)."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_baseline(path, results):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+def format_duration(seconds):
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+def benchmark_report(results, baseline=None, threshold=BENCH_THRESHOLD):
+    """
+    Format the timings against the baseline as text lines. Returns the lines
+    and the names of benchmarks that got slower, or (memory benchmarks) kept
+    more bytes allocated, by more than `threshold`.
+    """
+    baseline = baseline or {}
+    regressions = []
+    lines = [f"{'benchmark':<22} {'time':>10} {'baseline':>10} {'change':>8}"]
+    for name, result in results.items():
+        seconds = result["seconds"]
+        line = f"{name:<22} {format_duration(seconds):>10}"
+        base = baseline.get(name)
+        if base:
+            change = seconds / base["seconds"] - 1
+            line += f" {format_duration(base['seconds']):>10} {change*100:+7.1f}%"
+            if change > threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        else:
+            line += f" {'-':>10} {'':>8}"
+        if "bytes" in result:
+            line += f"  ({result['bytes']:.0f} bytes/frame)"
+        if "alloc" in result:
+            line += f"  ({result['alloc']:.0f} bytes each"
+            if base and base.get("alloc"):
+                growth = result["alloc"] / base["alloc"] - 1
+                line += f", {growth*100:+.1f}%"
+                if growth > threshold and name not in regressions:
+                    regressions.append(name)
+                    line += " REGRESSION"
+            line += ")"
+        lines.append(line)
+    if baseline:
+        lines.append(f"{len(regressions)} regression(s) over {threshold*100:.0f}%" + (": " + ", ".join(regressions) if regressions else ""))
+    else:
+        lines.append("No baseline to compare against (save one with --save-baseline).")
+    return lines, regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Kill the Necromancer!")
+    parser.add_argument("--simulate", type=int, metavar="N", help="play N headless autoplay runs and print statistics")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, metavar="K", help="worker processes for --simulate (default: all cores)")
+    parser.add_argument("--job-class", choices=JOB_NAMES, default="Fighter", help="class autoplay picks in --simulate")
+    parser.add_argument("--seed", type=int, help="run seed; for --simulate the base seed, run i uses seed + i (default 0)")
+    parser.add_argument("--fps", type=int, help=f"target frame rate during battles (default {Battle.fps})")
+    parser.add_argument("--anim-speed", type=float, metavar="X", help=f"animation speed multiplier, 0 for instant (default {Animations.speed:g})")
+    parser.add_argument("--bench", nargs="*", metavar="NAME", help="time the hot-path benchmarks (only those with a NAME as whole dotted parts, e.g. tick.5, if given) against the baseline")
+    parser.add_argument("--baseline", default=BENCH_BASELINE_FILE, metavar="PATH", help=f"benchmark baseline file (default {BENCH_BASELINE_FILE})")
+    parser.add_argument("--save-baseline", action="store_true", help="store the --bench results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=BENCH_THRESHOLD, metavar="X", help=f"slowdown over the baseline that counts as a regression (default {BENCH_THRESHOLD})")
+    parser.add_argument("--profile", action="store_true", help="time each phase of every battle tick and print per-battle reports on exit")
+    parser.add_argument("--trace", metavar="PATH", help="write a Chrome trace (about:tracing, Perfetto) of the session to PATH on exit")
+    parser.add_argument("--record", metavar="PATH", help="save the seed and key presses of every run to PATH on exit, for --replay")
+    parser.add_argument("--replay", metavar="PATH", help="play a session saved with --record again, headless and at full speed")
+    parser.add_argument("--frame-stats", action="store_true", help="print bytes, writes and time per rendered frame on exit")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.bench is not None:
+        results = run_benchmarks(args.bench)
+        lines, regressions = benchmark_report(results, load_baseline(args.baseline), args.threshold)
+        print("\n".join(lines))
+        if args.save_baseline:
+            save_baseline(args.baseline, dict(load_baseline(args.baseline), **results))
+            print(f"Baseline saved to {args.baseline}")
+        elif regressions:
+            sys.exit(1)
+    elif args.simulate:
+        start = time.perf_counter()
+        results = simulate(args.simulate, jobs=args.jobs, job_class=args.job_class, seed=args.seed or 0)
+        print("\n".join(simulation_report(results, wall_time=time.perf_counter() - start)))
+    elif args.replay:
+        recording = InputRecording.load(args.replay)
+        start = time.perf_counter()
+        game = replay_session(recording, profile=args.profile, trace=bool(args.trace))
+        keys = sum(len(run["keys"]) for run in recording.runs)
+        print(f"Replayed {len(recording.runs)} run(s), {keys} keys in {time.perf_counter() - start:.2f} s")
+        print(", ".join(f"{k}: {v}" for k, v in game.last_run.items()))
+    else:
+        print('\033[?25l', end='')
+        game = None
+        try:
+            game = Game(seed=args.seed, fps=args.fps, animation_speed=args.anim_speed, profile=args.profile,
+                        trace=bool(args.trace), record=bool(args.record))
+            game.run()
+        except EOFError as error:
+            sys.exit(f"Kill the Necromancer! needs a terminal to play ({error}); try --simulate")
+        finally:
+            print('\033[?25h', end='')
+            if args.record and game is not None:
+                game.recording.save(args.record)  # Also after Ctrl+C, so the run can be replayed
+    if args.bench is None and not args.simulate:
+        if args.frame_stats:
+            print(game.renderer.stats.summary())
+        if args.trace:
+            game.tracer.save(args.trace)
+        if args.profile:
+            for report in game.profiler.reports:
+                print("\n".join(game.profiler.format_report(report)))
\ No newline at end of file